@@ -0,0 +1,749 @@
+"""
+Benchmarks for dashtoolkit, run with: python benchmark.py
+
+    python benchmark.py                                          micro benchmarks
+    python benchmark.py e2e --devices 1000 100000 --days 1 30 --out results.json
+    python benchmark.py setbased --devices 10000 --days 10
+    python benchmark.py intervals --devices 2000 --days 365
+    python benchmark.py keys --rows 1000000 --keys 100 10000 100000 1000000
+    python benchmark.py compare baseline.json results.json
+
+e2e generates asset-report csv files, loads them into a local SQLite warehouse 
+with DataPrep.ingest_report and runs the CreateDash queries; results files of 
+two versions can be compared.
+"""
+
+
+def synthetic_equipment(devices: "number of devices" = 500000,
+                        seed: "random seed" = 0):
+    """current dim_equipment rows for devices, with every tracked column filled"""
+    import numpy as np
+    import pandas as pd
+    from dashtoolkit import EQUIPMENT_COLUMNS
+
+    rng = np.random.default_rng(seed)
+    ids = np.arange(devices)
+    df = pd.DataFrame({
+        'equipment_key': ids + 1,
+        'equipment_id': pd.Series(ids).map('dev{}SN'.format),
+        'location_key': rng.integers(1, 200, devices),
+        'asset_tag': pd.Series(ids).map('T{}'.format),
+        'barcode': pd.Series(ids).map('B{}'.format),
+        'device_name': pd.Series(ids).map('dev{}'.format),
+        'device_type': rng.choice(['switch', 'ap', 'router', 'ups', 'camera'], devices),
+        'ip_address': pd.Series(ids).map(lambda i: f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'),
+        'make': rng.choice(['cisco', 'aruba', 'apc'], devices),
+        'model': rng.choice(['m1', 'm2', 'm3', 'm4'], devices),
+        'serial_number': pd.Series(ids).map('SN{}'.format),
+        'simple_model': rng.choice(['s1', 's2'], devices),
+        'port_count': rng.choice([8.0, 24.0, 48.0, np.nan], devices),
+        'primary_purpose': rng.choice(['access', 'core', 'power'], devices),
+        'category': rng.choice(['network', 'facility'], devices),
+        'purpose_id': rng.integers(1, 10, devices).astype('float64'),
+        'rack_room_number': rng.choice(['R1', 'R2', None], devices),
+        'replacement_cost': rng.choice([120.0, 999.5, 4500.0], devices),
+    })
+    return df.loc[:, ['equipment_key'] + EQUIPMENT_COLUMNS]
+
+
+def bench_equipment_diff(devices: "devices in the snapshot" = 500000,
+                         churn: "share of devices retired, added and modified" = 0.01,
+                         seed: "random seed" = 0):
+    """
+    Daily diff of a snapshot against dim_equipment: full outer merge with a
+    wide column compare versus equipment_id + row fingerprint.
+    """
+    import time
+    import numpy as np
+    import pandas as pd
+    from dashtoolkit import EQUIPMENT_TRACKED, row_fingerprint
+
+    rng = np.random.default_rng(seed)
+    current = synthetic_equipment(devices, seed)
+    current['row_hash'] = row_fingerprint(current)
+    n = int(devices * churn)
+    snapshot = current.drop(columns = ['equipment_key', 'row_hash'])
+    snapshot = snapshot.drop(index = rng.choice(snapshot.index, n, replace = False))
+    added = synthetic_equipment(n, seed + 1).drop(columns = 'equipment_key')
+    added['equipment_id'] = added['equipment_id'] + 'new'
+    snapshot = pd.concat([snapshot, added], ignore_index = True)
+    modified = rng.choice(snapshot.index[:-n], n, replace = False)
+    snapshot.loc[modified, 'ip_address'] = '192.168.0.1'
+
+    start = time.perf_counter()
+    merged = snapshot.merge(current, how = 'outer', on = ['equipment_id'],
+                            suffixes = ['', '_current'], indicator = True)
+    both = merged[merged['_merge'] == 'both']
+    changed = np.zeros(len(both), dtype = bool)
+    for col in EQUIPMENT_TRACKED:
+        a, b = both[col], both[f'{col}_current']
+        changed |= ~((a == b) | (a.isna() & b.isna())).values
+    legacy = {'new': int((merged['_merge'] == 'left_only').sum()),
+              'retired': int((merged['_merge'] == 'right_only').sum()),
+              'modified': int(changed.sum())}
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stored = pd.Series(current['row_hash'].values, index = current['equipment_id'].values)
+    matched = snapshot['equipment_id'].map(stored)
+    fingerprint = {'new': int(matched.isna().sum()),
+                   'retired': int((~current['equipment_id'].isin(snapshot['equipment_id'])).sum()),
+                   'modified': int((matched.notna() & (matched != row_fingerprint(snapshot))).sum())}
+    fingerprint_seconds = time.perf_counter() - start
+
+    return {'devices': devices,
+            'merge_seconds': round(legacy_seconds, 3), 'merge_counts': legacy,
+            'fingerprint_seconds': round(fingerprint_seconds, 3), 'fingerprint_counts': fingerprint}
+
+
+def synthetic_change_by_type(types: "number of device types" = 300,
+                             days: "number of dates" = 3 * 365,
+                             density: "share of (date, type) cells with changes" = 0.3,
+                             seed: "random seed" = 0):
+    """result of the change by type by date query: date, deviceType, changes"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2019-01-01', periods = days).strftime('%Y-%m-%d')
+    cells = pd.MultiIndex.from_product([dates, [f'type{i}' for i in range(types)]],
+                                       names = ['date', 'deviceType']).to_frame(index = False)
+    cells = cells[rng.random(len(cells)) < density]
+    cells['changes'] = rng.integers(1, 50, len(cells))
+    return cells.reset_index(drop = True)
+
+
+def legacy_stacked_changes(df_change_type, num_date):
+    """the nested query loop stacked_bar used before shape_series"""
+    dates = sorted(list(set(df_change_type.date.tolist())), 
+                   reverse = True)[0:num_date]
+    device_type = list(set(df_change_type.deviceType.tolist()))
+    changes = {}
+    for dt in device_type:
+        changes[dt] = []
+    for dt in device_type:
+        for d in dates:
+            subset = df_change_type.query('date == @d')
+            try:
+                changes[dt].append(subset.query('deviceType == @dt').changes.values[0])
+            except IndexError:
+                changes[dt].append(0)
+    changes['dates'] = dates
+    return changes
+
+
+def bench_stacked_bar_shaping(types: "number of device types" = 300,
+                              days: "number of dates" = 3 * 365,
+                              num_date: "dates on the plot for the legacy loop" = 52,
+                              seed: "random seed" = 0):
+    """
+    stacked_bar data shaping: nested query loop versus shape_series.
+    
+    The loop is only timed for num_date dates, shape_series for num_date and for every date.
+    """
+    import time
+    from dashtoolkit import shape_series
+
+    df = synthetic_change_by_type(types, days, seed = seed)
+    dates = sorted(df.date.unique().tolist(), reverse = True)
+
+    start = time.perf_counter()
+    legacy = legacy_stacked_changes(df, num_date)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wide = shape_series(df, 'date', 'changes', columns = 'deviceType', index_values = dates[0:num_date])
+    pivot_seconds = time.perf_counter() - start
+    same = all(legacy[dt] == wide[dt].tolist() for dt in wide.columns) and len(legacy) == len(wide.columns) + 1
+
+    start = time.perf_counter()
+    shape_series(df, 'date', 'changes', columns = 'deviceType', index_values = dates)
+    pivot_all_seconds = time.perf_counter() - start
+
+    return {'types': types, 'days': days, 'rows': len(df), 'num_date': num_date,
+            'loop_seconds': round(legacy_seconds, 3), 
+            'pivot_seconds': round(pivot_seconds, 4), 
+            'pivot_all_dates_seconds': round(pivot_all_seconds, 4), 
+            'same_result': same}
+
+
+REPORT_HEADER = ['location', 'bldg', 'asset tag', 'barcode', 'device name', 'device type', 
+                 'ip address', 'make', 'model', 'serial number', 'simple model', 'port count', 
+                 'primary purpose', 'category', 'purpose id', 'rack room number', 'replacement cost']
+
+WAREHOUSE_SCHEMA = """
+CREATE TABLE dim_location (
+    location_key INTEGER PRIMARY KEY AUTOINCREMENT, 
+    location_name TEXT, building TEXT, effective_dt TEXT, expiration_dt TEXT);
+CREATE INDEX ix_dim_location_name ON dim_location (location_name, building);
+CREATE TABLE dim_equipment (
+    equipment_key INTEGER PRIMARY KEY AUTOINCREMENT, 
+    equipment_id TEXT, location_key INTEGER, asset_tag TEXT, barcode TEXT, device_name TEXT, 
+    device_type TEXT, ip_address TEXT, make TEXT, model TEXT, serial_number TEXT, 
+    simple_model TEXT, port_count REAL, primary_purpose TEXT, category TEXT, purpose_id REAL, 
+    rack_room_number TEXT, replacement_cost REAL, effective_date TEXT, retirement_date TEXT, 
+    last_update_date TEXT, row_hash INTEGER);
+CREATE INDEX ix_dim_equipment_id ON dim_equipment (equipment_id);
+CREATE TABLE dim_date_calendar (
+    date_key TEXT, cal_year INTEGER, cal_month INTEGER, cal_week_of_year INTEGER);
+CREATE TABLE fact_inventory (
+    equipment_key INTEGER, location_key INTEGER, date_key TEXT, 
+    has_changed INTEGER, is_deployed INTEGER);
+CREATE INDEX ix_fact_inventory_date ON fact_inventory (date_key);
+"""
+
+
+def generate_reports(directory: "output directory for the csv files",
+                     devices: "devices deployed on the first day" = 1000,
+                     days: "number of daily reports" = 5,
+                     churn: "share of devices retired, and as many added, per day" = 0.01,
+                     modified: "share of devices moved to another location per day" = 0.005,
+                     locations: "number of (location, bldg) pairs" = 50,
+                     device_types: "number of device types" = 8,
+                     nan_serials: "share of devices without a serial number" = 0.2,
+                     start: "date of the first report" = '2021-01-01',
+                     seed: "random seed" = 0):
+    """
+    Write a series of asset-report-YYYY-MM-DD.csv files like the Box reports, returns their paths.
+    
+    Attributes are drawn once per device, so a device only changes when it is moved. 
+    Devices without a serial number are identified by their rack/room number, as in production.
+    """
+    import os
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok = True)
+    per_day = int(round(devices * churn))
+    total = devices + per_day * max(days - 1, 0)
+    location = rng.integers(0, locations, total)
+    device_type = rng.integers(0, device_types, total)
+    no_serial = rng.random(total) < nan_serials
+    port_count = rng.choice([8.0, 24.0, 48.0, np.nan], total)
+    cost = rng.choice([120.0, 999.5, 4500.0], total)
+    alive = np.arange(devices)
+    next_id = devices
+    
+    files = []
+    for day, date in enumerate(pd.date_range(start, periods = days).strftime('%Y-%m-%d')):
+        if day:
+            alive = np.concatenate([np.delete(alive, rng.choice(len(alive), per_day, replace = False)), 
+                                    np.arange(next_id, next_id + per_day)])
+            next_id += per_day
+            moved = rng.choice(alive, int(round(len(alive) * modified)), replace = False)
+            location[moved] = (location[moved] + rng.integers(1, max(locations, 2), len(moved))) % locations
+        ids = pd.Series(alive).astype(str)
+        serial = ('SN ' + ids).where(~no_serial[alive])
+        df = pd.DataFrame({
+            'location': 'Hall ' + pd.Series(location[alive] // 3).astype(str),
+            'bldg': 'B' + pd.Series(location[alive] % 3).astype(str),
+            'asset tag': 'T' + ids,
+            'barcode': 'B' + ids,
+            'device name': 'dev' + ids + '.net.edu',
+            'device type': 'type' + pd.Series(device_type[alive]).astype(str),
+            'ip address': ('10.' + pd.Series(alive // 65536 % 256).astype(str) + '.' 
+                           + pd.Series(alive // 256 % 256).astype(str) + '.' 
+                           + pd.Series(alive % 256).astype(str)),
+            'make': 'make' + pd.Series(device_type[alive] % 3).astype(str),
+            'model': 'm ' + pd.Series(device_type[alive] % 5).astype(str),
+            'serial number': serial,
+            'simple model': 's',
+            'port count': port_count[alive],
+            'primary purpose': 'access',
+            'category': 'network',
+            'purpose id': (device_type[alive] % 4 + 1).astype(float),
+            'rack room number': 'R ' + ids,
+            'replacement cost': cost[alive],
+        }, columns = REPORT_HEADER)
+        path = f'{directory}/asset-report-{date}.csv'
+        df.to_csv(path, index = False)
+        files.append(path)
+    return files
+
+
+def create_warehouse(path: "sqlite database file, replaced if it exists"):
+    """empty SQLite warehouse with dim_location, dim_equipment, dim_date_calendar and fact_inventory, returns its url"""
+    import os
+    import sqlite3
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as connection:
+        connection.executescript(WAREHOUSE_SCHEMA)
+    connection.close()
+    return f'sqlite:///{os.path.abspath(path)}'
+
+
+def bench_end_to_end(devices: "devices per report" = 1000,
+                     days: "number of daily reports" = 5,
+                     churn: "share of devices retired and added per day" = 0.01,
+                     chunksize: "ingest_report chunksize, None reads whole files" = None,
+                     workdir: "directory for the csv files and the database, a temporary one if None" = None,
+                     seed: "random seed" = 0):
+    """generate days reports, ingest them into a fresh SQLite warehouse and run the dashboard queries"""
+    import os
+    import time
+    import shutil
+    import tempfile
+    import pandas as pd
+    from dashtoolkit import DataPrep, CreateDash, EngineRegistry, Tracer, MemorySink, peak_rss_kb
+
+    tmp = workdir or tempfile.mkdtemp(prefix = 'dashbench')
+    try:
+        start = time.perf_counter()
+        files = generate_reports(f'{tmp}/raw_csv', devices, days, churn, seed = seed)
+        generate_seconds = time.perf_counter() - start
+        engineStr = create_warehouse(f'{tmp}/warehouse.db')
+        
+        sink = MemorySink()
+        start = time.perf_counter()
+        with DataPrep(engineStr, tracer = Tracer([sink])) as prep:
+            for file in files:
+                prep.ingest_report(file, chunksize = chunksize)
+        ingest_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        with CreateDash(engineStr, cache_entries = 0) as dash:
+            query_rows = {name: len(dash.read_sql(query)) for name, query in CreateDash.queries.items()}
+        dashboard_seconds = time.perf_counter() - start
+        fact_rows = int(pd.read_sql_query('SELECT COUNT(*) AS n FROM fact_inventory;', 
+                                          con = engineStr).n[0])
+        EngineRegistry.release(engineStr)
+        
+        stages = {stage: {k: (round(v, 3) if isinstance(v, float) else v) for k, v in totals.items()} 
+                  for stage, totals in sink.totals().items()}
+        return {'bench': 'end_to_end', 'devices': devices, 'days': days, 'churn': churn, 
+                'chunksize': chunksize,
+                'csv_bytes': sum(os.path.getsize(f) for f in files),
+                'generate_seconds': round(generate_seconds, 3),
+                'ingest_seconds': round(ingest_seconds, 3),
+                'seconds_per_day': round(ingest_seconds / max(days, 1), 3),
+                'dashboard_seconds': round(dashboard_seconds, 3),
+                'fact_rows': fact_rows, 'query_rows': query_rows,
+                'db_bytes': os.path.getsize(f'{tmp}/warehouse.db'),
+                'process_peak_rss_kb': peak_rss_kb(), 'stages': stages}
+    finally:
+        if workdir is None:
+            shutil.rmtree(tmp, ignore_errors = True)
+
+
+def bench_compact_schema(devices: "devices in the report" = 200000,
+                         locations: "number of (location, bldg) pairs" = 300,
+                         repeat: "merges timed, the best is kept" = 3,
+                         seed: "random seed" = 0):
+    """
+    Memory of a parsed report and time of the location merge, str columns versus 
+    the shared categoricals of ReportSchema.
+    """
+    import time
+    import shutil
+    import tempfile
+    from dashtoolkit import ReportSchema, read_report
+
+    tmp = tempfile.mkdtemp(prefix = 'dashbench')
+    try:
+        file = generate_reports(tmp, devices, 1, locations = locations, seed = seed)[0]
+        schema = ReportSchema()
+        start = time.perf_counter()
+        plain = read_report(file, '2021-01-01')
+        plain_read = time.perf_counter() - start
+        start = time.perf_counter()
+        compact = read_report(file, '2021-01-01', schema = schema)
+        compact_read = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    # dim_location current rows as DimensionCache keeps them
+    dim = (plain.loc[:, ['location', 'bldg']].drop_duplicates()
+                .rename(columns = {'location': 'location_name', 'bldg': 'building'}))
+    dim['location_key'] = range(1, len(dim) + 1)
+    dim['expiration_dt'] = '9999-12-31'
+    frames = {'plain': (plain.rename(columns = {'location': 'location_name', 'bldg': 'building'}), 
+                        dim.astype({'location_key': 'int64'})),
+              'compact': (compact.rename(columns = {'location': 'location_name', 'bldg': 'building'}), 
+                          schema.apply(dim))}
+    merge_seconds = {}
+    for name, (report, dim_rows) in frames.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            report.merge(dim_rows, how = 'left', on = ['location_name', 'building'])
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        merge_seconds[name] = best
+
+    plain_bytes = int(plain.memory_usage(deep = True).sum())
+    compact_bytes = int(compact.memory_usage(deep = True).sum())
+    return {'bench': 'compact_schema', 'devices': devices, 'locations': locations,
+            'plain_mb': round(plain_bytes / 2**20, 1), 'compact_mb': round(compact_bytes / 2**20, 1),
+            'memory_saved': round(1 - compact_bytes / plain_bytes, 3),
+            'plain_read_seconds': round(plain_read, 3), 'compact_read_seconds': round(compact_read, 3),
+            'plain_merge_seconds': round(merge_seconds['plain'], 4), 
+            'compact_merge_seconds': round(merge_seconds['compact'], 4),
+            'merge_speedup': round(merge_seconds['plain'] / merge_seconds['compact'], 2)}
+
+
+def warehouse_state(engineStr: "warehouse url"):
+    """every warehouse table as a dataFrame in a stable order, to compare two loads"""
+    import pandas as pd
+    from sqlalchemy import create_engine
+    order = {'dim_location': 'location_key', 'dim_equipment': 'equipment_key', 
+             'dim_date_calendar': 'date_key', 
+             'fact_inventory': 'date_key, is_deployed DESC, equipment_key',
+             'agg_inventory_daily': 'date_key', 'agg_inventory_daily_type': 'date_key, device_type'}
+    engine = create_engine(engineStr)
+    try:
+        return {table: pd.read_sql_query(f"SELECT * FROM {table} ORDER BY {key};", con = engine)
+                       .astype(str).reset_index(drop = True) 
+                for table, key in order.items()}
+    finally:
+        engine.dispose()
+
+
+def same_warehouse(a: "warehouse url", 
+                   b: "warehouse url", 
+                   ignore: "columns left out of the comparison, e.g. row_hash" = ('row_hash',)):
+    """{table: True/False}, True where both warehouses hold the same rows"""
+    state_a, state_b = warehouse_state(a), warehouse_state(b)
+    return {t: state_a[t].drop(columns = list(ignore), errors = 'ignore')
+                         .equals(state_b[t].drop(columns = list(ignore), errors = 'ignore'))
+            for t in state_a}
+
+
+def bench_set_based(devices: "devices per report" = 10000,
+                    days: "number of daily reports" = 10,
+                    churn: "share of devices retired and added per day" = 0.01,
+                    seed: "random seed" = 0):
+    """
+    pandas path (ingest_report) versus SetBasedLoader on fresh SQLite warehouses, 
+    with a check that both end in the same state.
+    
+    SQLite has no stored procedures; against MySQL use bench_procedures_vs_set_based.
+    """
+    import time
+    import shutil
+    import tempfile
+    from dashtoolkit import DataPrep, EngineRegistry
+
+    tmp = tempfile.mkdtemp(prefix = 'dashbench')
+    try:
+        files = generate_reports(f'{tmp}/raw_csv', devices, days, churn, seed = seed)
+        pandas_url = create_warehouse(f'{tmp}/pandas.db')
+        set_url = create_warehouse(f'{tmp}/setbased.db')
+        
+        start = time.perf_counter()
+        with DataPrep(pandas_url) as prep:
+            for file in files:
+                prep.ingest_report(file)
+        pandas_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        with DataPrep(set_url) as prep:
+            prep.updatedb_sql(f'{tmp}/raw_csv', loader = 'setbased')
+        set_seconds = time.perf_counter() - start
+        EngineRegistry.release(pandas_url)
+        EngineRegistry.release(set_url)
+        
+        same = same_warehouse(pandas_url, set_url, ignore = ())
+        return {'bench': 'set_based', 'devices': devices, 'days': days, 'churn': churn,
+                'pandas_seconds': round(pandas_seconds, 3), 'set_based_seconds': round(set_seconds, 3),
+                'speedup': round(pandas_seconds / set_seconds, 2), 
+                'identical': all(same.values()), 'tables': same}
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+
+def bench_procedures_vs_set_based(path: "directory with the asset-report csv files",
+                                  procedures_url: "empty MySQL warehouse with the stored procedures",
+                                  set_based_url: "empty warehouse with the same schema"):
+    """updatedb_sql with the stored procedures versus loader = 'setbased', timing and final state"""
+    import time
+    from dashtoolkit import DataPrep, EngineRegistry
+
+    seconds = {}
+    for loader, url in [('procedures', procedures_url), ('setbased', set_based_url)]:
+        start = time.perf_counter()
+        with DataPrep(url) as prep:
+            prep.updatedb_sql(path, loader = loader)
+        seconds[loader] = time.perf_counter() - start
+        EngineRegistry.release(url)
+    same = same_warehouse(procedures_url, set_based_url)
+    return {'bench': 'procedures_vs_set_based', 
+            'procedures_seconds': round(seconds['procedures'], 3), 
+            'set_based_seconds': round(seconds['setbased'], 3),
+            'identical': all(same.values()), 'tables': same}
+
+
+def table_bytes(url: "SQLite warehouse url",
+                tables: "table names"):
+    """{table: bytes of its pages and indexes}, None where SQLite was built without dbstat"""
+    import sqlite3
+    connection = sqlite3.connect(url[len('sqlite:///'):])
+    try:
+        rows = connection.execute("""
+        SELECT s.name, m.tbl_name, SUM(s.pgsize) FROM dbstat s 
+        JOIN sqlite_master m ON m.name = s.name GROUP BY s.name;""").fetchall()
+    except sqlite3.OperationalError:
+        return {t: None for t in tables}
+    finally:
+        connection.close()
+    return {t: sum(size for _, table, size in rows if table == t) for t in tables}
+
+
+def bench_interval_storage(devices: "devices per report" = 2000,
+                           days: "number of daily reports" = 365,
+                           churn: "share of devices retired and added per day" = 0.01,
+                           repeat: "timed runs of every scan, the best is kept" = 3,
+                           seed: "random seed" = 0):
+    """
+    fact_storage = 'daily' versus 'interval' on the same reports, loaded with SetBasedLoader: 
+    fact rows and bytes, load time, and the full scans behind the dashboard 
+    (DailyAggregates.rebuild over the fact_inventory table / view, and 
+    IntervalFacts.deployed from the interval ends), with a check that the 
+    aggregates are the same.
+    """
+    import time
+    import shutil
+    import tempfile
+    import pandas as pd
+    from sqlalchemy import create_engine
+    from dashtoolkit import DataPrep, EngineRegistry, IntervalFacts
+
+    def best(f):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            f()
+            seconds.append(time.perf_counter() - start)
+        return round(min(seconds), 3)
+
+    tmp = tempfile.mkdtemp(prefix = 'dashbench')
+    try:
+        generate_reports(f'{tmp}/raw_csv', devices, days, churn, seed = seed)
+        result = {'bench': 'interval_storage', 'devices': devices, 'days': days, 'churn': churn}
+        aggregates = {}
+        for storage in ['daily', 'interval']:
+            url = create_warehouse(f'{tmp}/{storage}.db')
+            if storage == 'interval':
+                engine = create_engine(url)
+                IntervalFacts(engine).migrate()
+                engine.dispose()
+            start = time.perf_counter()
+            with DataPrep(url, fact_storage = storage) as prep:
+                prep.updatedb_sql(f'{tmp}/raw_csv', loader = 'setbased')
+                result[f'{storage}_load_seconds'] = round(time.perf_counter() - start, 3)
+                result[f'{storage}_rebuild_seconds'] = best(prep.aggregates.rebuild)
+                if storage == 'interval':
+                    result['interval_deployed_seconds'] = best(lambda: prep.facts.deployed(by_type = True))
+                aggregates[storage] = pd.read_sql_query(f"SELECT * FROM {prep.aggregates.by_type} ORDER BY 1, 2;", 
+                                                        con = prep.engine)
+                tables = (['fact_inventory'] if storage == 'daily' else 
+                          [IntervalFacts.interval, IntervalFacts.event])
+                with prep.engine.connect() as connection:
+                    result[f'{storage}_fact_rows'] = sum(connection.execute(f"SELECT COUNT(*) FROM {t};").scalar() 
+                                                         for t in tables)
+            EngineRegistry.release(url)
+            sizes = table_bytes(url, tables)
+            result[f'{storage}_fact_bytes'] = None if None in sizes.values() else sum(sizes.values())
+        result['row_ratio'] = round(result['daily_fact_rows'] / result['interval_fact_rows'], 1)
+        if result['interval_fact_bytes']:
+            result['byte_ratio'] = round(result['daily_fact_bytes'] / result['interval_fact_bytes'], 1)
+        result['identical'] = aggregates['daily'].equals(aggregates['interval'])
+        return result
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
+
+
+def bench_update_by_keys(rows: "rows in the table" = 1000000,
+                         retired: "numbers of keys to update" = (100, 10000, 100000, 1000000),
+                         url: "database to create the scratch table in, a temporary SQLite file if None" = None,
+                         seed: "random seed" = 0):
+    """
+    expiring retired keys: the old f-string UPDATE ... IN (...) versus update_by_keys 
+    with chunked IN lists and with the temporary key table, every run rolled back
+    """
+    import time
+    import shutil
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from sqlalchemy import create_engine
+    from dashtoolkit import update_by_keys
+
+    tmp = tempfile.mkdtemp(prefix = 'dashbench')
+    engine = create_engine(url or f'sqlite:///{tmp}/keys.db')
+    try:
+        pd.DataFrame({'equipment_key': np.arange(1, rows + 1), 'retirement_date': '9999-12-31', 
+                      'last_update_date': '2021-01-01'}).to_sql('bench_keys', engine, index = False, 
+                                                                 if_exists = 'replace', chunksize = 100000)
+        with engine.begin() as connection:
+            connection.execute("CREATE UNIQUE INDEX ix_bench_keys ON bench_keys (equipment_key);")
+        rng = np.random.default_rng(seed)
+        values = {'retirement_date': '2021-01-02', 'last_update_date': '2021-01-02'}
+        
+        def legacy(connection, keys):
+            assignments = ', '.join(f"{col} = '{val}'" for col, val in values.items())
+            return connection.execute(f"""
+            UPDATE bench_keys SET {assignments} 
+            WHERE equipment_key in ({keys});""".replace('[', '').replace(']', '')).rowcount
+        
+        methods = {'in_list': legacy, 
+                   'chunked': lambda c, k: update_by_keys(c, 'bench_keys', 'equipment_key', k, values, 
+                                                          threshold = len(k)), 
+                   'key_table': lambda c, k: update_by_keys(c, 'bench_keys', 'equipment_key', k, values, 
+                                                            threshold = 0)}
+        results = []
+        for n in retired:
+            keys = rng.choice(np.arange(1, rows + 1), min(n, rows), replace = False).tolist()
+            result = {'bench': 'update_by_keys', 'rows': rows, 'keys': len(keys), 'dialect': engine.dialect.name}
+            for name, method in methods.items():
+                with engine.connect() as connection:
+                    transaction = connection.begin()
+                    start = time.perf_counter()
+                    try:
+                        updated = method(connection, keys)
+                        result[f'{name}_seconds'] = round(time.perf_counter() - start, 3)
+                        result[f'{name}_rows'] = updated
+                    except Exception as e:
+                        # e.g. max_allowed_packet for a long IN list on MySQL
+                        result[f'{name}_error'] = type(e).__name__
+                    transaction.rollback()
+            results.append(result)
+        return results
+    finally:
+        with engine.begin() as connection:
+            connection.execute("DROP TABLE IF EXISTS bench_keys;")
+        engine.dispose()
+        shutil.rmtree(tmp, ignore_errors = True)
+
+
+def environment():
+    """versions recorded with the results"""
+    import platform
+    import subprocess
+    import datetime
+    import numpy as np
+    import pandas as pd
+    import sqlalchemy
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, 
+                                  text = True, timeout = 10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {'created': datetime.datetime.now().isoformat(timespec = 'seconds'), 
+            'revision': revision, 'python': platform.python_version(), 'platform': platform.platform(), 
+            'numpy': np.__version__, 'pandas': pd.__version__, 'sqlalchemy': sqlalchemy.__version__}
+
+
+def save_results(path: "json results file", 
+                 results: "list of benchmark dicts",
+                 label: "name of this run, e.g. a version" = None):
+    import json
+    with open(path, 'w') as f:
+        json.dump({'label': label, 'environment': environment(), 'results': results}, f, indent = 1)
+
+
+def compare(baseline: "results file of the old version", 
+            current: "results file of the new version",
+            threshold: "slowdown ratio reported as a regression" = 1.1):
+    """
+    ratio current / baseline of every *_seconds value of the runs both files have, 
+    runs are matched on bench, devices, days, churn and chunksize
+    """
+    import json
+    
+    def runs(path):
+        with open(path) as f:
+            results = json.load(f)['results']
+        return {(r.get('bench'), r.get('devices'), r.get('days'), r.get('churn'), r.get('chunksize')): r 
+                for r in results}
+
+    old, new = runs(baseline), runs(current)
+    rows = []
+    for key in sorted(set(old) & set(new), key = str):
+        for metric, value in new[key].items():
+            if metric.endswith('_seconds') and old[key].get(metric):
+                ratio = value / old[key][metric]
+                rows.append({'bench': key[0], 'devices': key[1], 'days': key[2], 'metric': metric, 
+                             'baseline': old[key][metric], 'current': value, 'ratio': round(ratio, 3), 
+                             'regression': ratio > threshold})
+    return rows
+
+
+def main(argv: "command line arguments, sys.argv[1:] if None" = None):
+    import json
+    import argparse
+    
+    parser = argparse.ArgumentParser(description = 'dashtoolkit benchmarks')
+    commands = parser.add_subparsers(dest = 'command')
+    e2e = commands.add_parser('e2e', help = 'end-to-end runs on generated reports and a SQLite warehouse')
+    e2e.add_argument('--devices', type = int, nargs = '+', default = [1000, 10000])
+    e2e.add_argument('--days', type = int, nargs = '+', default = [1, 30])
+    e2e.add_argument('--churn', type = float, default = 0.01)
+    e2e.add_argument('--chunksize', type = int, default = None)
+    e2e.add_argument('--seed', type = int, default = 0)
+    e2e.add_argument('--out', default = None, help = 'results json file')
+    e2e.add_argument('--label', default = None)
+    setbased = commands.add_parser('setbased', help = 'pandas path versus the set based loader on SQLite')
+    setbased.add_argument('--devices', type = int, nargs = '+', default = [10000])
+    setbased.add_argument('--days', type = int, nargs = '+', default = [10])
+    setbased.add_argument('--out', default = None, help = 'results json file')
+    intervals = commands.add_parser('intervals', help = 'daily fact rows versus interval storage')
+    intervals.add_argument('--devices', type = int, nargs = '+', default = [2000])
+    intervals.add_argument('--days', type = int, nargs = '+', default = [365])
+    intervals.add_argument('--out', default = None, help = 'results json file')
+    keys = commands.add_parser('keys', help = 'expiring key sets: IN list versus update_by_keys')
+    keys.add_argument('--rows', type = int, default = 1000000)
+    keys.add_argument('--keys', type = int, nargs = '+', default = [100, 10000, 100000, 1000000])
+    keys.add_argument('--url', default = None, help = 'database for the scratch table, SQLite if omitted')
+    keys.add_argument('--out', default = None, help = 'results json file')
+    cmp = commands.add_parser('compare', help = 'compare two results files')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--threshold', type = float, default = 1.1)
+    args = parser.parse_args(argv)
+
+    if args.command == 'e2e':
+        results = []
+        for devices in args.devices:
+            for days in args.days:
+                result = bench_end_to_end(devices, days, args.churn, args.chunksize, seed = args.seed)
+                print(json.dumps({k: v for k, v in result.items() if k != 'stages'}))
+                results.append(result)
+        if args.out:
+            save_results(args.out, results, args.label)
+        return results
+    if args.command == 'setbased':
+        results = [bench_set_based(devices, days) for devices in args.devices for days in args.days]
+        for result in results:
+            print(json.dumps(result))
+        if args.out:
+            save_results(args.out, results)
+        return results
+    if args.command == 'intervals':
+        results = [bench_interval_storage(devices, days) for devices in args.devices for days in args.days]
+        for result in results:
+            print(json.dumps(result))
+        if args.out:
+            save_results(args.out, results)
+        return results
+    if args.command == 'keys':
+        results = bench_update_by_keys(args.rows, args.keys, args.url)
+        for result in results:
+            print(json.dumps(result))
+        if args.out:
+            save_results(args.out, results)
+        return results
+    if args.command == 'compare':
+        rows = compare(args.baseline, args.current, args.threshold)
+        for r in rows:
+            print(f"{r['bench']:<14}{r['devices']:>9}{r['days']:>5}  {r['metric']:<20}"
+                  f"{r['baseline']:>10}{r['current']:>10}{r['ratio']:>8}{'  slower' if r['regression'] else ''}")
+        return rows
+    print(bench_equipment_diff())
+    print(bench_stacked_bar_shaping())
+    print(bench_compact_schema())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,2014 @@
+class EngineRegistry:
+    """
+    One pooled sqlalchemy engine per connection string, shared by DataPrep and CreateDash.
+    
+    Engines are reference counted: acquire() when an owner is created, release() 
+    when it is closed; the pool is disposed once the last owner releases it. 
+    Every owner of an engine has to ask for the same pool settings.
+    """
+    import threading
+    _lock = threading.Lock()
+    del threading
+    _engines = {}
+    _owners = {}
+    _settings = {}
+    _connects = {}
+
+    @classmethod
+    def acquire(cls, 
+                engineStr: "database connection, for sqlalchemy engine",
+                pool_size: "connections kept open in the pool" = 5,
+                max_overflow: "extra connections allowed above pool_size" = 5,
+                pool_pre_ping: "test connections before handing them out" = True,
+                pool_recycle: "seconds before a pooled connection is replaced" = 3600):
+        """Return the shared engine for engineStr, creating it on first use."""
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.pool import QueuePool
+        settings = dict(pool_size = pool_size, max_overflow = max_overflow, 
+                        pool_pre_ping = pool_pre_ping, pool_recycle = pool_recycle)
+        with cls._lock:
+            if engineStr in cls._engines and cls._settings[engineStr] != settings:
+                raise ValueError(f"the engine of {engineStr} is shared with {cls._settings[engineStr]}, "
+                                 f"not {settings}; release it first or ask for the same pool")
+            if engineStr not in cls._engines:
+                kwargs = dict(pool_pre_ping = pool_pre_ping, 
+                              pool_recycle = pool_recycle)
+                if engineStr.startswith('sqlite'):
+                    # in-memory sqlite keeps its single-connection pool
+                    if ':memory:' not in engineStr and engineStr.rstrip('/') != 'sqlite:':
+                        kwargs.update(poolclass = QueuePool,
+                                      pool_size = pool_size, 
+                                      max_overflow = max_overflow,
+                                      connect_args = {'check_same_thread': False})
+                else:
+                    kwargs.update(pool_size = pool_size, 
+                                  max_overflow = max_overflow)
+                engine = create_engine(engineStr, **kwargs)
+                cls._connects.setdefault(engineStr, 0)
+                event.listen(engine, 'connect', 
+                             lambda dbapi_con, record: cls.__count_connect(engineStr))
+                cls._engines[engineStr] = engine
+                cls._owners[engineStr] = 0
+                cls._settings[engineStr] = settings
+            cls._owners[engineStr] += 1
+            return cls._engines[engineStr]
+
+    @classmethod
+    def release(cls, 
+                engineStr: "database connection, for sqlalchemy engine"):
+        """Drop one owner of the engine, dispose of the pool when nobody uses it anymore."""
+        with cls._lock:
+            if engineStr not in cls._engines:
+                return
+            cls._owners[engineStr] -= 1
+            if cls._owners[engineStr] <= 0:
+                cls._engines.pop(engineStr).dispose()
+                cls._owners.pop(engineStr)
+                cls._settings.pop(engineStr)
+
+    @classmethod
+    def connections_opened(cls, 
+                           engineStr: "database connection, None for all" = None):
+        """Number of physical DBAPI connections opened so far."""
+        if engineStr is None:
+            return sum(cls._connects.values())
+        return cls._connects.get(engineStr, 0)
+
+    @classmethod
+    def reset_counters(cls):
+        """Start counting connections from zero, e.g. at the beginning of a run."""
+        for k in cls._connects:
+            cls._connects[k] = 0
+
+    @classmethod
+    def __count_connect(cls, engineStr):
+        cls._connects[engineStr] += 1
+
+
+def peak_rss_kb():
+    """peak resident set size of this process in KB, None where the resource module is missing"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Tracer:
+    """
+    Stage spans for the ETL pipeline and the dashboard.
+    
+    span(stage) measures wall time, the SQL round-trips of the engines passed to 
+    attach() and RSS: process_peak_rss_kb is the high-water mark of the whole process, 
+    rss_growth_kb how far the span raised it. Code inside the span adds rows and 
+    bytes with annotate(). traced_peak_bytes of a span covers its nested spans. 
+    Every finished span is a dict handed to each sink, e.g. JsonLinesSink or MemorySink. 
+    profile and trace_memory turn on cProfile / tracemalloc for the named stages 
+    (True for every stage); profiles are dumped to profile_dir.
+    
+    Round-trips are counted per tracer, so spans running at the same time in 
+    different threads see each other's statements.
+    """
+
+    def __init__(self, 
+                 sinks: "list of sinks with a write(record) method" = None,
+                 profile: "stages to run under cProfile, True for all" = (),
+                 trace_memory: "stages to trace with tracemalloc, True for all" = (),
+                 profile_dir: "directory for the .prof files" = 'profiles'):
+        import threading
+        self.sinks = list(sinks or [])
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.round_trips = 0
+        self._local = threading.local()
+        self._engines = []
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def attach(self, 
+               engine: "sqlalchemy engine whose statements are counted"):
+        """count the statements engine sends to the database"""
+        from sqlalchemy import event
+        if any(e is engine for e in self._engines):
+            return self
+        event.listen(engine, 'before_cursor_execute', self.__count)
+        self._engines.append(engine)
+        return self
+
+    def detach(self):
+        """stop counting statements"""
+        from sqlalchemy import event
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self.__count)
+        self._engines = []
+
+    def span(self, 
+             stage: "stage name, e.g. 'update_equipment'",
+             **attrs):
+        """context manager recording one span, yields the record"""
+        from contextlib import contextmanager, nullcontext
+        if not self.enabled:
+            return nullcontext({})
+        return contextmanager(self.__span)(stage, attrs)
+
+    def annotate(self, **values):
+        """add to the numbers (rows, bytes, ...) of the innermost open span of this thread"""
+        stack = getattr(self._local, 'stack', None)
+        if not stack:
+            return
+        record = stack[-1]
+        for k, v in values.items():
+            record[k] = (record.get(k) or 0) + v
+
+    def __span(self, stage, attrs):
+        import os
+        import time
+        import cProfile
+        import tracemalloc
+        
+        stack = self._local.__dict__.setdefault('stack', [])
+        # tracemalloc peaks of the open traced spans, innermost last
+        peaks = self._local.__dict__.setdefault('peaks', [])
+        record = {'stage': stage, 'start': time.time(), 
+                  'parent': stack[-1]['stage'] if stack else None, 
+                  'rows': None, 'bytes': None, 'attrs': attrs}
+        profiler = None
+        if self.__wanted(self.profile, stage) and not getattr(self._local, 'profiling', False):
+            profiler = cProfile.Profile()
+            self._local.profiling = True
+        tracing = self.__wanted(self.trace_memory, stage)
+        started_tracing = tracing and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif tracing:
+            # keep what the enclosing span has seen so far before the reset wipes it
+            if peaks:
+                peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if tracing:
+            peaks.append(0)
+        
+        rss_start = peak_rss_kb()
+        stack.append(record)
+        round_trips = self.round_trips
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._local.profiling = False
+                os.makedirs(self.profile_dir, exist_ok = True)
+                record['profile'] = f'{self.profile_dir}/{stage}-{os.getpid()}-{int(record["start"] * 1000)}.prof'
+                profiler.dump_stats(record['profile'])
+            record['wall_seconds'] = round(time.perf_counter() - start, 6)
+            record['sql_round_trips'] = self.round_trips - round_trips
+            record['process_peak_rss_kb'] = peak_rss_kb()
+            record['rss_growth_kb'] = (None if rss_start is None 
+                                       else record['process_peak_rss_kb'] - rss_start)
+            if tracing:
+                peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['traced_peak_bytes'] = peak
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+                if started_tracing:
+                    tracemalloc.stop()
+            stack.pop()
+            for sink in self.sinks:
+                sink.write(record)
+
+    @staticmethod
+    def __wanted(option, stage):
+        return option is True or stage in (option or ())
+
+    def __count(self, *args):
+        self.round_trips += 1
+
+
+class JsonLinesSink:
+    """appends every span as one json line to path"""
+
+    def __init__(self, 
+                 path: "trace file, e.g. trace.jsonl"):
+        import threading
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        import json
+        line = json.dumps(record, default = str)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+class MemorySink:
+    """keeps the spans in memory, for tests, notebooks and metrics endpoints"""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(dict(record))
+
+    def totals(self):
+        """{stage: {'count', 'wall_seconds', 'rows', 'bytes', 'sql_round_trips'}} over the recorded spans"""
+        totals = {}
+        for r in self.records:
+            t = totals.setdefault(r['stage'], {'count': 0, 'wall_seconds': 0.0, 'rows': 0, 
+                                               'bytes': 0, 'sql_round_trips': 0})
+            t['count'] += 1
+            for k in ['wall_seconds', 'rows', 'bytes', 'sql_round_trips']:
+                t[k] += r.get(k) or 0
+        return totals
+
+
+def traced(stage: "stage name of the span"):
+    """
+    decorator for methods of objects with a tracer attribute: runs the method in a span, 
+    with the length of the first dataFrame argument as rows
+    """
+    import functools
+
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer = getattr(self, 'tracer', None)
+            if tracer is None or not tracer.enabled:
+                return method(self, *args, **kwargs)
+            with tracer.span(stage):
+                for arg in list(args) + list(kwargs.values()):
+                    if hasattr(arg, 'columns') and hasattr(arg, 'index'):
+                        tracer.annotate(rows = len(arg))
+                        break
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class StageLoader:
+    """
+    Bulk load a raw report frame into the stage table.
+    
+    The stage schema is created once and emptied between files instead of 
+    being dropped and recreated. Subclasses implement insert() for one backend.
+    """
+    backend = None
+
+    def __init__(self, 
+                 engine: "sqlalchemy engine",
+                 table: "name of the stage table" = 'stage',
+                 chunksize: "rows sent per round-trip" = 10000):
+        self.engine = engine
+        self.table = table
+        self.chunksize = chunksize
+        self.columns = None
+        self.stats = []
+
+    @staticmethod
+    def for_engine(engine: "sqlalchemy engine",
+                   backend: "'auto', 'executemany', 'bulkfile' or 'sqlite'" = 'auto',
+                   **kwargs):
+        """Pick the stage loader for backend, 'auto' chooses by dialect."""
+        backends = {'executemany': ExecuteManyStageLoader, 
+                    'bulkfile': BulkFileStageLoader, 
+                    'sqlite': SQLiteStageLoader}
+        if backend == 'auto':
+            backend = 'sqlite' if engine.dialect.name == 'sqlite' else 'executemany'
+        if backend not in backends:
+            raise ValueError(f"unknown stage backend {backend}, choose from {list(backends)}")
+        return backends[backend](engine, **kwargs)
+
+    def load(self, 
+             df: "pandas dataFrame created from raw csv",
+             label: "file name, used in the report" = None,
+             truncate: "empty the stage table first, False appends" = True):
+        """Load df into the stage table, returns the rows/sec stats of this load."""
+        import time
+        
+        start = time.perf_counter()
+        columns = ['index'] + [str(c) for c in df.columns]
+        with self.engine.begin() as connection:
+            if columns != self.columns:
+                self.__prepare(df, columns, connection)
+            elif truncate:
+                self.truncate(connection)
+            for i in range(0, len(df), self.chunksize):
+                self.insert(df.iloc[i:i + self.chunksize], connection)
+        seconds = time.perf_counter() - start
+        stats = {'file': label, 
+                 'backend': self.backend, 
+                 'rows': len(df), 
+                 'seconds': round(seconds, 4), 
+                 'rows_per_sec': round(len(df) / seconds, 1) if seconds else None}
+        self.stats.append(stats)
+        print(f"Stage table ready for {label}... {stats['rows']} rows at {stats['rows_per_sec']} rows/sec ({self.backend})")
+        return stats
+
+    def truncate(self, connection):
+        """Remove every row of the stage table, keep the schema."""
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql(f"DELETE FROM {self.quote(self.table)}")
+        else:
+            connection.exec_driver_sql(f"TRUNCATE TABLE {self.quote(self.table)}")
+
+    def insert(self, chunk, connection):
+        raise NotImplementedError
+
+    def quote(self, name):
+        return self.engine.dialect.identifier_preparer.quote(name)
+
+    def rows(self, chunk):
+        """chunk as a list of tuples, index first, NaN as None."""
+        return driver_rows(chunk.reset_index())
+
+    def insert_sql(self):
+        return driver_insert(self.engine.dialect, self.quote(self.table), 
+                             [self.quote(c) for c in self.columns])
+
+    def __prepare(self, df, columns, connection):
+        """Create the stage table once, reuse it if the existing schema already matches."""
+        from sqlalchemy import inspect
+        existing = None
+        if inspect(connection).has_table(self.table):
+            existing = [c['name'] for c in inspect(connection).get_columns(self.table)]
+        if existing == columns:
+            self.truncate(connection)
+        else:
+            df.head(0).to_sql(name = self.table, con = connection, 
+                              if_exists = 'replace', index = True)
+        self.columns = columns
+
+
+class ExecuteManyStageLoader(StageLoader):
+    """Chunked executemany, the driver sends each chunk as multi-row inserts."""
+    backend = 'executemany'
+
+    def insert(self, chunk, connection):
+        connection.exec_driver_sql(self.insert_sql(), self.rows(chunk))
+
+
+class BulkFileStageLoader(StageLoader):
+    """
+    Server-side bulk file load with MySQL LOAD DATA LOCAL INFILE.
+    
+    The engine needs local_infile enabled, e.g. create_engine(..., connect_args={'local_infile': 1}).
+    """
+    backend = 'bulkfile'
+
+    @staticmethod
+    def escape(chunk: "dataFrame about to be written to the load file"):
+        """double the backslashes, the LOAD DATA escape character, in every text column"""
+        import pandas as pd
+        def column(col):
+            # categoricals (ReportSchema) hold text too
+            if not (pd.api.types.is_object_dtype(col) or pd.api.types.is_categorical_dtype(col)):
+                return col
+            return col.astype(object).map(lambda v: v.replace('\\', '\\\\') if isinstance(v, str) else v)
+        return chunk.apply(column)
+
+    def insert(self, chunk, connection):
+        import os
+        import tempfile
+        if connection.dialect.name != 'mysql':
+            raise ValueError(f"bulk file load is not supported for {connection.dialect.name}")
+        chunk = self.escape(chunk)
+        fd, tmp = tempfile.mkstemp(suffix = '.csv')
+        os.close(fd)
+        try:
+            chunk.to_csv(tmp, index = True, header = False, na_rep = '\\N')
+            connection.exec_driver_sql(
+                f"""LOAD DATA LOCAL INFILE '{tmp}' INTO TABLE {self.quote(self.table)} 
+                CHARACTER SET utf8mb4 
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' 
+                LINES TERMINATED BY '\\n' 
+                ({', '.join(self.quote(c) for c in self.columns)})""")
+        finally:
+            os.remove(tmp)
+
+
+class SQLiteStageLoader(StageLoader):
+    """Fast local path, executemany straight on the sqlite3 cursor, skipping sqlalchemy's execution layer."""
+    backend = 'sqlite'
+
+    def insert(self, chunk, connection):
+        cursor = connection.connection.cursor()
+        cursor.executemany(self.insert_sql(), self.rows(chunk))
+        cursor.close()
+
+
+REPORT_DTYPES = {
+    'location': 'object', 'bldg': 'object', 'asset_tag': 'object', 'barcode': 'object', 
+    'device_name': 'object', 'device_type': 'object', 'ip_address': 'object', 
+    'make': 'object', 'model': 'object', 'serial_number': 'object', 
+    'simple_model': 'object', 'port_count': 'float64', 'primary_purpose': 'object', 
+    'category': 'object', 'purpose_id': 'float64', 'rack_room_number': 'object', 
+    'replacement_cost': 'float64'
+}
+
+EQUIPMENT_COLUMNS = ['equipment_id', 'location_key', 'asset_tag', 'barcode', 
+                     'device_name', 'device_type', 'ip_address', 'make', 'model', 
+                     'serial_number', 'simple_model', 'port_count', 'primary_purpose', 
+                     'category', 'purpose_id', 'rack_room_number', 'replacement_cost']
+
+
+EQUIPMENT_TRACKED = EQUIPMENT_COLUMNS[1:]
+
+EQUIPMENT_NUMERIC = ['location_key', 'port_count', 'purpose_id', 'replacement_cost']
+
+
+def row_fingerprint(df: "dataFrame with the tracked columns",
+                    columns: "tracked columns" = EQUIPMENT_TRACKED,
+                    numeric: "columns compared as numbers" = EQUIPMENT_NUMERIC):
+    """
+    64-bit hash of the tracked attributes of every row, as int64.
+    
+    Values are normalized first (numbers as float, everything else as str, missing as NaN), 
+    so a row read back from the database hashes like the same row from the csv.
+    """
+    import pandas as pd
+    canonical = pd.DataFrame(index = df.index)
+    for col in columns:
+        if col in numeric:
+            canonical[col] = pd.to_numeric(df[col], errors = 'coerce').astype('float64')
+        else:
+            values = df[col].astype(object)
+            if pd.api.types.infer_dtype(values, skipna = True) not in ('string', 'empty'):
+                values = values.where(values.isna(), values.astype(str))
+            canonical[col] = values
+    return pd.util.hash_pandas_object(canonical, index = False).astype('int64')
+
+
+REPORT_CATEGORIES = ['location', 'bldg', 'device_type', 'make', 'model', 'simple_model', 
+                     'primary_purpose', 'category', 'Loading_Date', 
+                     'effective_dt', 'expiration_dt', 'effective_date', 'retirement_date', 'last_update_date']
+
+
+class ReportSchema:
+    """
+    Shared categorical dtypes for the low-cardinality report and dimension columns.
+    
+    apply() gives every frame the same CategoricalDtype per column, location_name 
+    sharing location's and building bldg's, so joins between the csv and the dimension 
+    frames compare integer codes. Categories only grow, new values are appended. 
+    Integer *_key columns are downcast to int32 when they fit. Dates are parsed once 
+    into categories of their values, datetime64 can not hold 9999-12-31.
+    """
+    aliases = {'location_name': 'location', 'building': 'bldg'}
+
+    def __init__(self, 
+                 columns: "columns stored as categoricals" = REPORT_CATEGORIES):
+        self.columns = list(columns)
+        self.dtypes = {}
+
+    def dtype(self, 
+              column: "column name, aliases resolved",
+              values: "series whose values are added to the categories" = None):
+        """the shared CategoricalDtype of column"""
+        import pandas as pd
+        name = self.aliases.get(column, column)
+        current = self.dtypes.get(name)
+        if values is not None:
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                seen = values.cat.categories
+            else:
+                seen = pd.Index(values.dropna().unique())
+            known = current.categories if current is not None else pd.Index([], dtype = object)
+            new = seen.difference(known, sort = False) if len(known) else seen
+            if current is None or len(new):
+                current = pd.CategoricalDtype(known.append(new))
+                self.dtypes[name] = current
+        return current
+
+    def apply(self, 
+              df: "report or dimension dataFrame"):
+        """df with the shared dtypes, df itself when nothing changes"""
+        import numpy as np
+        import pandas as pd
+        changes = {}
+        for col in df.columns:
+            if self.aliases.get(col, col) in self.columns:
+                dtype = self.dtype(col, df[col])
+                if not (isinstance(df[col].dtype, pd.CategoricalDtype) and 
+                        df[col].dtype.categories.equals(dtype.categories)):
+                    changes[col] = dtype
+            elif str(col).endswith('_key') and df[col].dtype != np.int32:
+                # keys read with coerce_float = False come back as python ints
+                if not (pd.api.types.is_integer_dtype(df[col].dtype) or df[col].dtype == object):
+                    continue
+                keys = pd.to_numeric(df[col], errors = 'coerce')
+                if (pd.api.types.is_integer_dtype(keys.dtype) and 
+                    (len(keys) == 0 or (keys.min() >= np.iinfo(np.int32).min and 
+                                        keys.max() <= np.iinfo(np.int32).max))):
+                    changes[col] = np.int32
+        return df.astype(changes) if changes else df
+
+
+def numeric_text_stats(column: "text column of a report"):
+    """
+    (all numbers, any missing, any fraction) over the values of column, combined 
+    across chunks with and/or/or; numeric_text_format turns them into a format
+    """
+    import pandas as pd
+    values = pd.Series(column.dropna().unique())
+    if len(values) == 0:
+        return (True, column.isna().any(), False)
+    try:
+        numbers = pd.to_numeric(values.astype(str))
+    except (ValueError, TypeError):
+        return (False, column.isna().any(), False)
+    return (True, bool(column.isna().any()), bool((numbers % 1 != 0).any()))
+
+
+def numeric_text_format(stats: "numeric_text_stats of a whole file"):
+    """
+    how read_csv without dtypes would have printed the column: 'int', 'float' 
+    (numbers with missing values or fractions, e.g. 112345.0) or None for text
+    """
+    numbers, missing, fraction = stats
+    if not numbers:
+        return None
+    return 'float' if missing or fraction else 'int'
+
+
+def numeric_text(column: "text column of a report",
+                 fmt: "from numeric_text_format"):
+    """column with its numbers printed as fmt, missing values stay missing"""
+    import pandas as pd
+    if fmt is None or column.notna().sum() == 0:
+        return column
+    values = pd.Series(column.dropna().unique())
+    numbers = pd.to_numeric(values.astype(str))
+    text = numbers.astype('float64').astype(str) if fmt == 'float' else numbers.astype('int64').astype(str)
+    return column.astype(object).map(dict(zip(values, text)))
+
+
+def read_report(file: "path to an asset-report csv file",
+                date: "adds a Loading_Date column when given" = None,
+                chunksize: "rows per chunk, None reads the whole file" = None,
+                schema: "ReportSchema for categorical columns, None reads them as str" = None):
+    """
+    Read an asset report with the fixed REPORT_DTYPES schema, column names use '_' instead of spaces.
+    
+    The float columns are read as text and converted with to_numeric, values that 
+    are not numbers become NaN. Text columns holding only numbers are printed the 
+    way read_csv without dtypes did (numeric_text), e.g. serial 112345 of a column 
+    with blanks stays 112345.0, so equipment_id and the stored rows keep matching 
+    the ones loaded before the fixed schema.
+    
+    Returns a dataFrame, or an iterator of dataFrames when chunksize is set; 
+    both parse every chunk the same way so the streamed and whole-file loads agree, 
+    the text formats of a chunked read come from a first pass over the text columns.
+    """
+    import pandas as pd
+    header = pd.read_csv(file, nrows = 0, index_col = False).columns
+    dtype = {c: 'object' for c in header if c.replace(' ', '_') in REPORT_DTYPES}
+    if schema is not None:
+        dtype.update({c: 'category' for c in dtype if c.replace(' ', '_') in schema.columns})
+    numbers = [c for c in dtype if REPORT_DTYPES[c.replace(' ', '_')] == 'float64']
+    texts = [c for c in dtype if REPORT_DTYPES[c.replace(' ', '_')] == 'object']
+
+    def normalize(df, formats):
+        for c in numbers:
+            df[c] = pd.to_numeric(df[c], errors = 'coerce')
+        for c, fmt in formats.items():
+            if fmt is not None:
+                df[c] = numeric_text(df[c], fmt)
+        df.columns = [i.replace(' ', '_') for i in df.columns]
+        if date is not None:
+            df['Loading_Date'] = date
+        return df if schema is None else schema.apply(df)
+
+    if chunksize is None:
+        df = pd.read_csv(file, index_col = False, dtype = dtype)
+        return normalize(df, {c: numeric_text_format(numeric_text_stats(df[c])) for c in texts})
+    
+    stats = {c: (True, False, False) for c in texts}
+    for chunk in pd.read_csv(file, index_col = False, dtype = 'object', usecols = texts, chunksize = chunksize):
+        for c in texts:
+            a, b = stats[c], numeric_text_stats(chunk[c])
+            stats[c] = (a[0] and b[0], a[1] or b[1], a[2] or b[2])
+    formats = {c: numeric_text_format(v) for c, v in stats.items()}
+    return (normalize(chunk, formats) for chunk in pd.read_csv(file, index_col = False, dtype = dtype, 
+                                                               chunksize = chunksize))
+
+
+def equipment_ids(df: "report dataFrame, columns with '_'"):
+    """
+    Derive equipment_id in one vectorized pass.
+    
+    device name (before the first dot) + serial number, or rack/room number 
+    when the serial number is missing; spaces in the suffix become '_' and 
+    every 'nan' is removed from the result.
+    """
+    import numpy as np
+    import pandas as pd
+    device_name = df['device_name'].astype(str).str.split('.', n=1).str[0]
+    serial = df['serial_number']
+    suffix = pd.Series(np.where(pd.isna(serial), 
+                                df['rack_room_number'].astype(str), 
+                                serial.astype(str)),
+                       index = df.index)
+    return (device_name + suffix.str.replace(' ', '_', regex=False)).str.replace('nan', '', regex=False)
+
+
+def file_sha1(path: "file to hash, read in 1 MiB blocks"):
+    """hex sha1 of a file, as box reports it, without reading the whole file in memory"""
+    import hashlib
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ReportStore:
+    """
+    Where the daily asset reports come from.
+    
+    list_reports() returns dicts with name, size, etag and sha1 (None when unknown), 
+    fetch() writes one report into an open binary file.
+    """
+    def list_reports(self):
+        raise NotImplementedError
+
+    def fetch(self, 
+              report: "one dict from list_reports()", 
+              fileobj: "binary file to write into"):
+        raise NotImplementedError
+
+
+class BoxReportStore(ReportStore):
+    """Reports in a box folder."""
+    def __init__(self, 
+                 authPath: "path to your box config file, a json file", 
+                 folderID: "the id of the folder on box drive containing the csv files"):
+        from boxsdk import JWTAuth
+        from boxsdk import Client
+        self.client = Client(JWTAuth.from_settings_file(authPath))
+        self.folderID = folderID
+
+    def list_reports(self):
+        items = self.client.folder(folder_id = self.folderID).get_items(fields = ['name', 'size', 'sha1', 'etag'])
+        return [{'name': item.name, 'id': item.id, 'size': item.size, 
+                 'etag': item.etag, 'sha1': item.sha1}
+                for item in items if item.type == 'file']
+
+    def fetch(self, report, fileobj):
+        self.client.file(file_id = report['id']).download_to(fileobj)
+
+
+class LocalReportStore(ReportStore):
+    """Reports in a local directory, stands in for box in tests and benchmarks."""
+    def __init__(self, 
+                 directory: "directory containing the csv files"):
+        self.directory = directory
+
+    def list_reports(self):
+        import os
+        reports = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                reports.append({'name': entry.name, 'id': entry.path, 'size': stat.st_size, 
+                                'etag': f'{stat.st_mtime_ns}-{stat.st_size}', 'sha1': None})
+        return reports
+
+    def fetch(self, report, fileobj):
+        import shutil
+        with open(report['id'], 'rb') as source:
+            shutil.copyfileobj(source, fileobj)
+
+
+class ReportDownloader:
+    """
+    Download reports from a ReportStore with a thread pool.
+    
+    Files already on disk are skipped when the manifest (or the size and sha1) 
+    says they are unchanged, downloads go to a temp file that is renamed when 
+    complete, and failed downloads are retried with exponential backoff.
+    """
+    manifest_name = '.manifest.json'
+
+    def __init__(self, 
+                 store: "a ReportStore",
+                 dest: "directory to download into",
+                 max_workers: "concurrent downloads" = 4,
+                 retries: "attempts per file" = 3,
+                 backoff: "seconds before the first retry, doubled every retry" = 1.0):
+        import os
+        import threading
+        self.store = store
+        self.dest = dest
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.__lock = threading.Lock()
+        os.makedirs(dest, exist_ok = True)
+        self.manifest = self.__read_manifest()
+
+    def download(self, 
+                 dates: "date str or list of date str, matched against the file names"):
+        """Download the reports for dates, returns {file name: 'downloaded' or 'skipped'}."""
+        from concurrent.futures import ThreadPoolExecutor
+        if isinstance(dates, str):
+            dates = [dates]
+        reports = [r for r in self.store.list_reports() 
+                   if any(d in r['name'] for d in dates)]
+        with ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+            status = dict(zip([r['name'] for r in reports], 
+                              pool.map(self.__download_one, reports)))
+        return status
+
+    def unchanged(self, 
+                  report: "one dict from list_reports()"):
+        """True if the local copy of report matches the manifest, or its size and sha1."""
+        import os
+        path = os.path.join(self.dest, report['name'])
+        if not os.path.exists(path) or os.path.getsize(path) != report['size']:
+            return False
+        seen = self.manifest.get(report['name'])
+        if seen is not None and seen.get('size') == report['size']:
+            if report['etag'] is not None and seen.get('etag') == report['etag']:
+                return True
+            if report['sha1'] is not None and seen.get('sha1') == report['sha1']:
+                return True
+        return report['sha1'] is not None and file_sha1(path) == report['sha1']
+
+    def __download_one(self, report):
+        import os
+        import time
+        if self.unchanged(report):
+            self.__record(report, None)
+            return 'skipped'
+        path = os.path.join(self.dest, report['name'])
+        tmp = os.path.join(self.dest, f".{report['name']}.{os.getpid()}.part")
+        for attempt in range(self.retries):
+            try:
+                with open(tmp, 'wb') as output_file:
+                    self.store.fetch(report, output_file)
+                sha1 = file_sha1(tmp)
+                if report['sha1'] is not None and sha1 != report['sha1']:
+                    raise IOError(f"checksum mismatch for {report['name']}")
+                os.replace(tmp, path)
+                break
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+        self.__record(report, sha1)
+        return 'downloaded'
+
+    def __record(self, report, sha1):
+        with self.__lock:
+            entry = {'size': report['size'], 'etag': report['etag'], 
+                     'sha1': sha1 or report['sha1'] or self.manifest.get(report['name'], {}).get('sha1')}
+            self.manifest[report['name']] = entry
+            self.__write_manifest()
+
+    def __read_manifest(self):
+        import os
+        import json
+        path = os.path.join(self.dest, self.manifest_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def __write_manifest(self):
+        import os
+        import json
+        path = os.path.join(self.dest, self.manifest_name)
+        with open(path + '.part', 'w') as f:
+            json.dump(self.manifest, f, indent = 1, sort_keys = True)
+        os.replace(path + '.part', path)
+
+
+def null_safe_eq(dialect: "sqlalchemy dialect name",
+                 a: "sql expression",
+                 b: "sql expression"):
+    """null-safe equality, NULL matches NULL like pandas merges NaN keys"""
+    if dialect == 'mysql':
+        return f"{a} <=> {b}"
+    if dialect == 'sqlite':
+        return f"{a} IS {b}"
+    return f"{a} IS NOT DISTINCT FROM {b}"
+
+
+def temporary_table(connection: "open connection, temporary tables live as long as it",
+                    table: "temporary table name",
+                    definition: "'(column TYPE, ...)' or 'AS SELECT ...', None only drops the table" = None,
+                    params: "bound parameters of an AS SELECT definition" = None):
+    """drop table if it exists and create it again as a temporary table, returns table"""
+    from sqlalchemy import text
+    dialect = connection.dialect.name
+    drop = "DROP TEMPORARY TABLE IF EXISTS" if dialect == 'mysql' else "DROP TABLE IF EXISTS"
+    connection.execute(text(f"{drop} {table}"))
+    if definition is not None:
+        create = "CREATE TEMP TABLE" if dialect == 'sqlite' else "CREATE TEMPORARY TABLE"
+        connection.execute(text(f"{create} {table} {definition}"), params or {})
+    return table
+
+
+def driver_insert(dialect: "sqlalchemy dialect of the connection",
+                  table: "table name, quoted if needed",
+                  columns: "column names, quoted if needed"):
+    """INSERT statement for executemany on the driver, in the driver's paramstyle"""
+    mark = '?' if dialect.paramstyle == 'qmark' else '%s'
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([mark] * len(columns))})"
+
+
+def driver_rows(df: "dataFrame of the rows to insert"):
+    """rows of df as a list of tuples for executemany on the driver, NaN as None"""
+    import pandas as pd
+    df = df.astype(object)
+    return list(df.where(pd.notna(df), None).itertuples(index = False, name = None))
+
+
+def insert_rows(connection: "open connection",
+                table: "table name",
+                df: "dataFrame whose columns are columns of table",
+                chunksize: "rows per executemany round-trip, None for all" = None):
+    """executemany the rows of df into table on the driver, NaN as NULL"""
+    sql = driver_insert(connection.dialect, table, list(df.columns))
+    chunksize = chunksize or max(len(df), 1)
+    for start in range(0, len(df), chunksize):
+        connection.exec_driver_sql(sql, driver_rows(df.iloc[start:start + chunksize]))
+
+
+def update_by_keys(connection: "open connection, the update runs in its transaction",
+                   table: "table to update",
+                   key: "integer key column",
+                   keys: "key values of the rows to update",
+                   values: "dict of column -> value to set, e.g. {'expiration_dt': date}",
+                   threshold: "more keys than this go through a temporary key table" = 1000,
+                   chunksize: "keys per statement below the threshold, and per insert into the key table" = 1000):
+    """
+    Set values on the rows of table whose key is in keys, returns the number of rows updated.
+    
+    Values and keys are bound parameters. Up to threshold keys run as 
+    UPDATE ... WHERE key IN (...) in chunks; larger sets are inserted into a 
+    temporary table tmp_update_keys and applied by one UPDATE ... JOIN on MySQL, 
+    UPDATE ... WHERE key IN (SELECT ...) elsewhere, so the statement text stays 
+    small whatever the number of keys.
+    """
+    from sqlalchemy import text, bindparam
+    # a key repeated in another chunk would be counted twice
+    keys = sorted({int(k) for k in keys})
+    if len(keys) == 0:
+        return 0
+    dialect = connection.dialect.name
+    params = {f'value_{i}': v for i, v in enumerate(values.values())}
+    
+    if len(keys) <= threshold:
+        assignments = ', '.join(f"{col} = :value_{i}" for i, col in enumerate(values))
+        update = text(f"UPDATE {table} SET {assignments} WHERE {key} IN :keys").bindparams(
+            bindparam('keys', expanding = True))
+        return sum(connection.execute(update, {**params, 'keys': keys[i:i + chunksize]}).rowcount 
+                   for i in range(0, len(keys), chunksize))
+    
+    temporary_table(connection, 'tmp_update_keys', f"({key} BIGINT NOT NULL PRIMARY KEY)")
+    insert = driver_insert(connection.dialect, 'tmp_update_keys', [key])
+    for i in range(0, len(keys), chunksize):
+        connection.exec_driver_sql(insert, [(k,) for k in keys[i:i + chunksize]])
+    if dialect == 'mysql':
+        assignments = ', '.join(f"t.{col} = :value_{i}" for i, col in enumerate(values))
+        update = f"""
+        UPDATE {table} t JOIN tmp_update_keys k ON t.{key} = k.{key}
+        SET {assignments}"""
+    else:
+        assignments = ', '.join(f"{col} = :value_{i}" for i, col in enumerate(values))
+        update = f"""
+        UPDATE {table} SET {assignments}
+        WHERE {key} IN (SELECT {key} FROM tmp_update_keys)"""
+    updated = connection.execute(text(update), params).rowcount
+    temporary_table(connection, 'tmp_update_keys')
+    return updated
+
+
+class DimensionCache:
+    """
+    In-memory copy of a slowly changing dimension table.
+    
+    Nothing is read until the rows are first used. Then only the current rows 
+    (expiration column = 9999-12-31) are read, filtered by the database and projected 
+    to columns; the history is read only when asked for. Inserts and expirations are 
+    applied in memory as they are written, and a hash index on the natural key 
+    answers "is this key current" without a merge. With a fingerprint function the 
+    fingerprints of the current rows are computed once and follow the same updates.
+    """
+    current_date = '9999-12-31'
+
+    def __init__(self, 
+                 engine: "sqlalchemy engine",
+                 table: "dimension table name",
+                 surrogate_key: "auto_increment key column",
+                 natural_key: "list of columns identifying a member",
+                 expiration_col: "column set to 9999-12-31 on current rows",
+                 columns: "columns to load, a list or a function of the table's columns, None for all" = None,
+                 schema: "function applied to the cached frames, e.g. ReportSchema.apply" = None,
+                 fingerprint: "function of rows giving one int64 per row, e.g. row_fingerprint" = None):
+        self.engine = engine
+        self.table = table
+        self.surrogate_key = surrogate_key
+        self.natural_key = natural_key
+        self.expiration_col = expiration_col
+        self.columns = columns
+        self.schema = schema
+        self.fingerprint = fingerprint
+        self._current = None
+        self._history = None
+        self.__key_index = None
+        self.__fingerprints = None
+
+    @property
+    def loaded(self):
+        return self._current is not None
+
+    @property
+    def current(self):
+        """current rows indexed by surrogate key, read on first use"""
+        if self._current is None:
+            self.load()
+        if self.schema is not None:
+            self._current = self.schema(self._current)
+        return self._current
+
+    @current.setter
+    def current(self, rows):
+        self._current = rows
+
+    @property
+    def history(self):
+        """expired rows indexed by surrogate key, read on first use"""
+        if self._history is None:
+            self._history = self.__read(f"{self.expiration_col} <> '{self.current_date}' OR {self.expiration_col} IS NULL")
+        if self.schema is not None:
+            self._history = self.schema(self._history)
+        return self._history
+
+    @history.setter
+    def history(self, rows):
+        self._history = rows
+
+    def reset(self):
+        """forget the cached rows, e.g. after the table was changed in the database; read again on next use"""
+        self._current = None
+        self._history = None
+        self.__key_index = None
+        self.__fingerprints = None
+
+    def load(self):
+        """(Re)read the current rows; the history is dropped and read again when asked for."""
+        from sqlalchemy import text
+        self._current = self.__read(f"{self.expiration_col} = '{self.current_date}'")
+        self._history = None
+        with self.engine.connect() as connection:
+            max_key = connection.execute(text(f"select max({self.surrogate_key}) from {self.table};")).scalar()
+        self.max_key = int(max_key) if max_key is not None else 0
+        self.__key_index = None
+        self.__fingerprints = None
+
+    def projection(self):
+        """the loaded columns, surrogate key, natural key and expiration column always included"""
+        from sqlalchemy import inspect
+        if self.columns is None:
+            return None
+        if callable(self.columns):
+            columns = self.columns([c['name'] for c in inspect(self.engine).get_columns(self.table)])
+        else:
+            columns = self.columns
+        required = [self.surrogate_key] + self.natural_key + [self.expiration_col]
+        return required + [c for c in columns if c not in required]
+
+    def fetch(self, 
+              keys: "surrogate keys",
+              columns: "columns to read, every column if None" = None):
+        """rows of keys straight from the database, indexed by surrogate key"""
+        import pandas as pd
+        from sqlalchemy import bindparam
+        keys = [int(k) for k in keys]
+        # one expanding parameter per chunk, as update_by_keys
+        frames = [self.__read(f"{self.surrogate_key} in :keys", columns or ['*'], 
+                              {'keys': keys[i:i + 1000]}, [bindparam('keys', expanding = True)]) 
+                  for i in range(0, len(keys), 1000)]
+        return pd.concat(frames) if frames else self.__read("1 = 0", columns or ['*'])
+
+    def __read(self, where, columns = None, params = None, bindparams = ()):
+        import pandas as pd
+        from sqlalchemy import text
+        columns = columns or self.projection() or ['*']
+        query = text(f"select {', '.join(columns)} from {self.table} where {where};").bindparams(*bindparams)
+        rows = pd.read_sql_query(query, 
+                                 con = self.engine, 
+                                 params = params,
+                                 coerce_float = False)
+        rows.index = rows[self.surrogate_key].astype('int64').values
+        return rows
+
+    @property
+    def key_index(self):
+        """hash index of the natural keys of the current rows, aligned with self.current."""
+        if self.__key_index is None:
+            self.__key_index = self.keys(self.current)
+        return self.__key_index
+
+    def keys(self, 
+             df: "dataFrame with the natural key columns"):
+        """natural keys of df as a pandas index"""
+        import pandas as pd
+        if len(self.natural_key) == 1:
+            return pd.Index(df[self.natural_key[0]])
+        return pd.MultiIndex.from_frame(df.loc[:, self.natural_key])
+
+    def is_current(self, 
+                   df: "dataFrame with the natural key columns"):
+        """boolean array, True where the natural key of a df row is current"""
+        return self.keys(df).isin(self.key_index)
+
+    @property
+    def fingerprints(self):
+        """fingerprint of the current rows by natural key, the last row of a duplicated key wins"""
+        if self.__fingerprints is None:
+            self.__fingerprints = self.__fingerprint_rows(self.current)
+        return self.__fingerprints
+
+    def __fingerprint_rows(self, rows):
+        import pandas as pd
+        hashes = pd.Series(pd.Series(self.fingerprint(rows)).astype('int64').values, index = self.keys(rows))
+        return hashes[~hashes.index.duplicated(keep = 'last')]
+
+    def frame(self):
+        """every row, current and history, in surrogate key order; reads the history"""
+        import pandas as pd
+        return pd.concat([self.history, self.current]).sort_index()
+
+    def expire(self, 
+               keys: "surrogate keys to expire",
+               values: "dict of column -> value to set, e.g. {'expiration_dt': date}"):
+        """expire rows in the database and move them from current to history"""
+        import pandas as pd
+        keys = [int(float(i)) for i in keys]
+        if len(keys) == 0:
+            return
+        with self.engine.begin() as connection:
+            update_by_keys(connection, self.table, self.surrogate_key, keys, values)
+        expired = self.current.loc[keys].copy()
+        for col, val in values.items():
+            if col in expired.columns:
+                expired[col] = val
+        self.current = self.current.drop(keys)
+        # history not read yet will come from the database with these rows
+        if self._history is not None:
+            self._history = pd.concat([self._history, expired])
+        self.__key_index = None
+        if self.__fingerprints is not None:
+            self.__fingerprints = self.__fingerprints[~self.__fingerprints.index.isin(self.keys(expired))]
+
+    def insert(self, 
+               records: "dataFrame of new rows without the surrogate key"):
+        """append records to the table and to the current rows, keys are read back from the database"""
+        import pandas as pd
+        if len(records) == 0:
+            return
+        current = self.current
+        records.to_sql(name = self.table, 
+                       con = self.engine, 
+                       if_exists = 'append', 
+                       index = False)
+        new_rows = self.__read(f"{self.surrogate_key} > {self.max_key}")
+        self.current = pd.concat([current, new_rows])
+        self.max_key = int(new_rows.index.max())
+        self.__key_index = None
+        if self.__fingerprints is not None:
+            added = self.__fingerprint_rows(new_rows)
+            self.__fingerprints = pd.concat([self.__fingerprints[~self.__fingerprints.index.isin(added.index)], 
+                                             added])
+
+    def verify(self):
+        """compare the cache with the database on the loaded columns, returns the surrogate keys that differ (empty if consistent)"""
+        cached = self.frame()
+        db = self.__read("1 = 1")
+        keys = cached.index.symmetric_difference(db.index).tolist()
+        both = cached.index.intersection(db.index)
+        a = cached.loc[both, db.columns].astype(str)
+        b = db.loc[both].astype(str)
+        keys += both[(a != b).any(axis = 1)].tolist()
+        return sorted(keys)
+
+
+def report_files(path: "directory containing the csv files"):
+    """sorted list of (date, file name) for the asset-report-YYYY-MM-DD files in path, one file per date"""
+    import os
+    import re
+    reports = {}
+    for file in os.listdir(path):
+        date = re.findall(r'asset-report-(\d{4}-\d{2}-\d{2})', file)
+        if date and date[0] not in reports:
+            reports[date[0]] = file
+    return sorted(reports.items())
+
+
+class ReportArchive:
+    """
+    Columnar archive of the raw asset reports.
+    
+    Every daily csv becomes one zstd compressed parquet file under date_key=YYYY-MM-DD/, 
+    with the fixed REPORT_DTYPES schema plus the derived equipment_id and row_hash, 
+    so reprocessing and ad-hoc analytics read a few typed columns instead of re-parsing csv.
+    row_hash is row_fingerprint over the report columns, location and bldg in place of location_key.
+    """
+    columns = list(REPORT_DTYPES)
+    derived = ['equipment_id', 'row_hash']
+    tracked = ['location', 'bldg'] + EQUIPMENT_TRACKED[1:]
+
+    def __init__(self, 
+                 directory: "root directory of the archive"):
+        import os
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+    @classmethod
+    def schema(cls):
+        """the fixed arrow schema of every partition"""
+        import pyarrow as pa
+        fields = [pa.field(c, pa.float64() if t == 'float64' else pa.string()) 
+                  for c, t in REPORT_DTYPES.items()]
+        return pa.schema(fields + [pa.field('equipment_id', pa.string()), 
+                                   pa.field('row_hash', pa.int64())])
+
+    def path(self, 
+             date: "iso date str, format YYYY-MM-DD"):
+        return f'{self.directory}/date_key={date}/part-0.parquet'
+
+    def dates(self):
+        """sorted dates in the archive"""
+        import os
+        return sorted(d[len('date_key='):] for d in os.listdir(self.directory) 
+                      if d.startswith('date_key=') and os.path.exists(self.path(d[len('date_key='):])))
+
+    def ingest(self, 
+               file: "path to one asset-report-YYYY-MM-DD csv file",
+               date: "iso date str, taken from the file name if None" = None,
+               overwrite: "rewrite even if the csv is unchanged" = False):
+        """
+        convert one report to its partition, returns 'written' or 'skipped'
+        
+        A partition is skipped when it was written from a csv with the same sha1.
+        """
+        import os
+        import re
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        if date is None:
+            date = re.findall(r'asset-report-(\d{4}-\d{2}-\d{2})', file)[0]
+        sha1 = file_sha1(file)
+        path = self.path(date)
+        if not overwrite and os.path.exists(path):
+            metadata = pq.read_schema(path).metadata or {}
+            if metadata.get(b'source_sha1', b'').decode() == sha1:
+                return 'skipped'
+
+        df = read_report(file)
+        for col in self.columns:
+            if col not in df.columns:
+                df[col] = None
+        df = df.loc[:, self.columns]
+        df['equipment_id'] = equipment_ids(df)
+        df['row_hash'] = row_fingerprint(df, self.tracked)
+        schema = self.schema().with_metadata({'source_sha1': sha1, 'source': os.path.basename(file)})
+        table = pa.Table.from_pandas(df, schema = schema, preserve_index = False)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        pq.write_table(table, f'{path}.part', compression = 'zstd')
+        os.replace(f'{path}.part', path)
+        return 'written'
+
+    def ingest_dir(self, 
+                   path: "directory containing the csv files",
+                   overwrite: "rewrite even if the csv is unchanged" = False):
+        """ingest every report in path, returns {date: 'written' or 'skipped'}"""
+        return {date: self.ingest(f'{path}/{file}', date, overwrite) 
+                for date, file in report_files(path)}
+
+    def read(self, 
+             date: "iso date str, format YYYY-MM-DD",
+             columns: "columns to read, the report columns if None" = None):
+        """one report as the dataFrame read_report(file, date) gives, Loading_Date included"""
+        import pyarrow.parquet as pq
+        df = pq.read_table(self.path(date), columns = columns or self.columns).to_pandas()
+        df['Loading_Date'] = date
+        return df
+
+    def scan(self, 
+             columns: "columns to read",
+             start: "first date, None for the earliest" = None,
+             end: "last date, None for the latest" = None):
+        """(date, dataFrame) per date between start and end, reading only columns"""
+        for date in self.dates():
+            if (start is None or date >= str(start)) and (end is None or date <= str(end)):
+                yield date, self.read(date, columns)
+
+    def counts(self, 
+               start: "first date, None for the earliest" = None,
+               end: "last date, None for the latest" = None):
+        """
+        deployed and changed devices by date and device type: date, deviceType, deployed, changes
+        
+        changes follow fact_inventory: devices of the previous report that are gone 
+        or differ in this one, counted under their previous device type.
+        """
+        import pandas as pd
+        
+        frames = []
+        previous = None
+        scan_start = None
+        if start is not None:
+            before = [d for d in self.dates() if d < str(start)]
+            scan_start = before[-1] if before else None
+        for date, df in self.scan(['equipment_id', 'device_type', 'row_hash'], scan_start, end):
+            df = df.drop_duplicates('equipment_id', keep = 'last')
+            deployed = df.groupby(df['device_type'].fillna(''), sort = False).size()
+            if previous is None:
+                changes = pd.Series(dtype = 'int64')
+            else:
+                current = pd.Series(df['row_hash'].values, index = df['equipment_id'].values)
+                gone = previous['equipment_id'].map(current) != previous['row_hash']
+                changes = previous[gone.values].groupby(previous['device_type'].fillna(''), sort = False).size()
+            previous = df
+            if start is not None and date < str(start):
+                continue
+            frames.append(pd.DataFrame({'deployed': deployed, 'changes': changes})
+                            .fillna(0).astype('int64')
+                            .rename_axis('deviceType').reset_index()
+                            .assign(date = date))
+        if not frames:
+            return pd.DataFrame(columns = ['date', 'deviceType', 'deployed', 'changes'])
+        return pd.concat(frames, ignore_index = True).loc[:, ['date', 'deviceType', 'deployed', 'changes']]
+
+    def frames(self, 
+               start: "first date, None for the earliest" = None,
+               end: "last date, None for the latest" = None):
+        """
+        CreateDash.queries results computed from the archive, keyed like CreateDash.queries, 
+        e.g. dash.stacked_bar(archive.frames()['change_by_type'], ...)
+        """
+        counts = self.counts(start, end)
+        daily = counts.groupby('date', as_index = False)[['deployed', 'changes']].sum()
+        by_type = counts[counts['changes'] > 0].sort_values(['date', 'changes'], ascending = [True, False])
+        return {
+            'change_by_type': by_type.loc[:, ['date', 'deviceType', 'changes']].reset_index(drop = True),
+            'change_by_date': daily.loc[:, ['date', 'changes']],
+            'deployed_by_date': daily.loc[:, ['date', 'deployed']],
+            'confidence_difference': daily.assign(diff = daily['changes'] / daily['deployed'], 
+                                                  conf = 1 - daily['changes'] / daily['deployed'])
+                                          .loc[:, ['date', 'diff', 'conf']]
+        }
+
+
+class DailyAggregates:
+    """
+    Per-date summaries of fact_inventory, kept up to date by DataPrep.
+    
+    agg_inventory_daily holds deployed and changed devices per date_key, 
+    agg_inventory_daily_type the same per date_key and device_type; 
+    refresh() recomputes a single date, rebuild() every date. 
+    facts is fact_inventory, the daily table or the view of IntervalFacts.
+    """
+    daily = 'agg_inventory_daily'
+    by_type = 'agg_inventory_daily_type'
+
+    def __init__(self, 
+                 engine: "sqlalchemy engine",
+                 facts: "table or view with the daily fact rows" = 'fact_inventory'):
+        self.engine = engine
+        self.facts = facts
+
+    def create(self):
+        """create the aggregate tables if they do not exist, and fill them when they were just created"""
+        from sqlalchemy import inspect
+        if inspect(self.engine).has_table(self.daily) and inspect(self.engine).has_table(self.by_type):
+            return
+        with self.engine.begin() as connection:
+            connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.daily} (
+                date_key DATE NOT NULL PRIMARY KEY,
+                num_deployed INTEGER NOT NULL,
+                num_changes INTEGER NOT NULL
+            );""")
+            connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.by_type} (
+                date_key DATE NOT NULL,
+                device_type VARCHAR(255) NOT NULL DEFAULT '',
+                num_deployed INTEGER NOT NULL,
+                num_changes INTEGER NOT NULL,
+                PRIMARY KEY (date_key, device_type)
+            );""")
+        self.rebuild()
+
+    def refresh(self, 
+                date: "date_key to recompute",
+                connection: "open connection to run in, a new transaction if None" = None):
+        """recompute the aggregates of one date from fact_inventory"""
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.refresh(date, connection)
+        self.__fill(connection, "WHERE fi.date_key = :date", {'date': date})
+
+    def rebuild(self):
+        """recompute the aggregates of every date"""
+        with self.engine.begin() as connection:
+            self.__fill(connection, "", {})
+
+    def check(self):
+        """compare the aggregates with fact_inventory, returns the date_keys that differ (empty if consistent)"""
+        import pandas as pd
+        stored = pd.read_sql_query(f"""
+        SELECT date_key, device_type, num_deployed, num_changes 
+        FROM {self.by_type};""", con = self.engine)
+        stored['total'] = False
+        daily = pd.read_sql_query(f"""
+        SELECT date_key, num_deployed, num_changes 
+        FROM {self.daily};""", con = self.engine)
+        daily['device_type'], daily['total'] = '', True
+        fresh_type = pd.read_sql_query(self.__by_type_select(""), con = self.engine)
+        fresh_type['total'] = False
+        fresh_daily = pd.read_sql_query(self.__daily_select(""), con = self.engine)
+        fresh_daily['device_type'], fresh_daily['total'] = '', True
+        keys = ['date_key', 'device_type', 'total']
+        merged = (pd.concat([stored, daily])
+                    .astype({'date_key': str})
+                    .merge(pd.concat([fresh_type, fresh_daily]).astype({'date_key': str}), 
+                           how = 'outer', on = keys, suffixes = ['', '_fresh']))
+        differs = ((merged['num_deployed'] != merged['num_deployed_fresh']) | 
+                   (merged['num_changes'] != merged['num_changes_fresh']))
+        return sorted(merged.loc[differs, 'date_key'].unique().tolist())
+
+    def __daily_select(self, where):
+        return f"""
+        SELECT fi.date_key, SUM(fi.is_deployed) as num_deployed, SUM(fi.has_changed) as num_changes
+        FROM {self.facts} fi
+        {where}
+        GROUP BY fi.date_key"""
+
+    def __by_type_select(self, where):
+        return f"""
+        SELECT fi.date_key, COALESCE(de.device_type, '') as device_type, 
+               SUM(fi.is_deployed) as num_deployed, SUM(fi.has_changed) as num_changes
+        FROM {self.facts} fi
+        JOIN dim_equipment de
+        ON fi.equipment_key = de.equipment_key
+        {where}
+        GROUP BY fi.date_key, COALESCE(de.device_type, '')"""
+
+    def __fill(self, connection, where, params):
+        from sqlalchemy import text
+        delete_where = where.replace('fi.', '')
+        for table, select in [(self.daily, self.__daily_select(where)), 
+                              (self.by_type, self.__by_type_select(where))]:
+            connection.execute(text(f"DELETE FROM {table} {delete_where}"), params)
+            connection.execute(text(f"INSERT INTO {table} (date_key, {'device_type, ' if table == self.by_type else ''}num_deployed, num_changes) {select}"), 
+                               params)
+
+
+class IntervalFacts:
+    """
+    Run-length storage of fact_inventory, for DataPrep(fact_storage = 'interval').
+    
+    A device deployed on consecutive loads is one fact_inventory_interval row 
+    (equipment_key, location_key, from_date, to_date, copies), open while to_date 
+    is 9999-12-31; copies is the number of report rows of the device, usually 1. 
+    Every other fact row (the has_changed rows of retired devices) goes to 
+    fact_inventory_event as it is. The view fact_inventory gives the daily rows 
+    back under the old name, with is_deployed = copies, so sums match the daily 
+    table; deployed() computes the daily counts from the interval ends without 
+    expanding them.
+    
+    A warehouse is switched once, by the operator, with migrate() (or 
+    refresh.py --migrate-facts): the daily table is moved into intervals, 
+    checked, and renamed to fact_inventory_daily to make room for the view.
+    
+    Intervals are closed and opened against the latest loaded date, so dates 
+    have to be written in order, as updatedb_sql and the load ledger do.
+    """
+    interval = 'fact_inventory_interval'
+    event = 'fact_inventory_event'
+    view = 'fact_inventory'
+    daily = 'fact_inventory_daily'
+    stage_table = 'tmp_fact_day'
+    open_date = '9999-12-31'
+
+    def __init__(self, 
+                 engine: "sqlalchemy engine"):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+
+    def create(self):
+        """create the interval and event tables if they do not exist"""
+        from sqlalchemy import inspect
+        if inspect(self.engine).has_table(self.interval):
+            return
+        with self.engine.begin() as connection:
+            connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.interval} (
+                equipment_key BIGINT NOT NULL,
+                location_key BIGINT,
+                from_date DATE NOT NULL,
+                to_date DATE NOT NULL,
+                copies INTEGER NOT NULL
+            );""")
+            connection.execute(f"CREATE INDEX ix_{self.interval}_to ON {self.interval} (to_date, equipment_key);")
+            connection.execute(f"CREATE INDEX ix_{self.interval}_from ON {self.interval} (from_date);")
+            connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.event} (
+                equipment_key BIGINT NOT NULL,
+                location_key BIGINT,
+                date_key DATE NOT NULL,
+                has_changed INTEGER NOT NULL,
+                is_deployed INTEGER NOT NULL
+            );""")
+            connection.execute(f"CREATE INDEX ix_{self.event}_date ON {self.event} (date_key);")
+
+    def migrated(self):
+        """True when fact_inventory is the view of the intervals, False while it is the daily table"""
+        from sqlalchemy import inspect
+        return self.view in inspect(self.engine).get_view_names()
+
+    def migrate(self):
+        """
+        switch the warehouse to intervals: write the dates of the daily fact_inventory 
+        table in order, check that every date has as many fact rows and deployed 
+        devices as before, empty the table and rename it to fact_inventory_daily, 
+        then create the view fact_inventory. A failed check rolls the intervals back 
+        and leaves the daily table as it was. Refuses when the intervals already hold 
+        dates, as they could not be written after them. Returns the dates moved.
+        """
+        import pandas as pd
+        from sqlalchemy import inspect
+        if self.migrated():
+            return []
+        self.create()
+        dates = []
+        if inspect(self.engine).has_table(self.view):
+            with self.engine.begin() as connection:
+                dates = [str(date) for (date,) in connection.execute(
+                    f"SELECT DISTINCT date_key FROM {self.view} ORDER BY date_key;")]
+                written = connection.execute(
+                    f"SELECT (SELECT COUNT(*) FROM {self.interval}) + (SELECT COUNT(*) FROM {self.event});").scalar()
+                if dates and written:
+                    raise ValueError(f"{self.view} and {self.interval} both hold facts, "
+                                     f"delete one of them before migrating")
+                for date in dates:
+                    self.write(date, connection, source = self.view)
+                # an interval row stands for copies daily rows, an event row for one
+                before = pd.read_sql_query(f"""
+                SELECT date_key, COUNT(*) AS fact_rows, SUM(is_deployed) AS deployed 
+                FROM {self.view} GROUP BY date_key ORDER BY date_key;""", con = connection)
+                after = pd.read_sql_query(f"""
+                SELECT date_key, SUM(n) AS fact_rows, SUM(deployed) AS deployed
+                FROM ({self.__days('i.copies AS n, i.copies AS deployed', '1 AS n, is_deployed AS deployed')}) f
+                GROUP BY date_key ORDER BY date_key;""", con = connection)
+                counts = {'date_key': str, 'fact_rows': 'int64', 'deployed': 'int64'}
+                if not before.astype(counts).equals(after.astype(counts)):
+                    raise ValueError(f"the intervals do not give back the rows of {self.view}, nothing was migrated")
+                connection.execute(f"DELETE FROM {self.view};")
+            with self.engine.begin() as connection:
+                connection.execute(f"ALTER TABLE {self.view} RENAME TO {self.daily};")
+        with self.engine.begin() as connection:
+            connection.execute(f"""
+            CREATE VIEW {self.view} AS 
+            {self.__days('0 AS has_changed, i.copies AS is_deployed', 'has_changed, is_deployed')};""")
+        return dates
+
+    def __days(self, interval_columns, event_columns):
+        """daily rows of the intervals and the events, one row per interval and calendar date"""
+        return f"""
+            SELECT i.equipment_key, i.location_key, c.date_key, {interval_columns}
+            FROM {self.interval} i
+            JOIN (SELECT DISTINCT date_key FROM dim_date_calendar) c
+            ON c.date_key >= i.from_date AND c.date_key <= i.to_date
+            UNION ALL
+            SELECT equipment_key, location_key, date_key, {event_columns}
+            FROM {self.event}"""
+
+    def stage(self, 
+              connection: "open connection, the staging table is temporary"):
+        """create the empty staging table for the fact rows of one date, returns its name"""
+        return temporary_table(connection, self.stage_table, """
+        (equipment_key BIGINT, location_key BIGINT, date_key DATE, has_changed INTEGER, is_deployed INTEGER)""")
+
+    def write(self, 
+              date: "the date_key, later than every date written before",
+              connection: "open connection to run in, a new transaction if None" = None,
+              rows: "dataFrame of fact_inventory rows of date, None if they are in source" = None,
+              source: "table holding the fact rows of date, the staging table if None" = None):
+        """
+        turn the fact rows of date into events and interval changes: open intervals 
+        of devices no longer deployed with the same copies are closed on the previous 
+        date, deployed devices without an open interval open one on date
+        """
+        from sqlalchemy import text
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.write(date, connection, rows, source)
+        if rows is not None:
+            source = self.stage(connection)
+            insert_rows(connection, source, 
+                        rows.loc[:, ['equipment_key', 'location_key', 'date_key', 'has_changed', 'is_deployed']])
+        source = source or self.stage_table
+        params = {'date': date, 'open': self.open_date}
+        
+        connection.execute(text(f"""
+        INSERT INTO {self.event} (equipment_key, location_key, date_key, has_changed, is_deployed)
+        SELECT equipment_key, location_key, date_key, has_changed, is_deployed FROM {source}
+        WHERE date_key = :date AND NOT (is_deployed = 1 AND has_changed = 0);"""), params)
+        temporary_table(connection, 'tmp_deployed', f"""AS
+        SELECT equipment_key, location_key, COUNT(*) AS copies FROM {source}
+        WHERE date_key = :date AND is_deployed = 1 AND has_changed = 0
+        GROUP BY equipment_key, location_key""", params)
+        connection.execute("CREATE INDEX ix_tmp_deployed ON tmp_deployed (equipment_key);")
+        
+        same = f"""t.equipment_key = {self.interval}.equipment_key 
+                   AND {null_safe_eq(self.dialect, 't.location_key', f'{self.interval}.location_key')} 
+                   AND t.copies = {self.interval}.copies"""
+        previous = connection.execute(text("SELECT MAX(date_key) FROM dim_date_calendar WHERE date_key < :date"), 
+                                      params).scalar()
+        if previous is not None:
+            connection.execute(text(f"""
+            UPDATE {self.interval} SET to_date = :previous
+            WHERE to_date = :open
+            AND NOT EXISTS (SELECT 1 FROM tmp_deployed t WHERE {same});"""), 
+                               {**params, 'previous': str(previous)})
+        connection.execute(text(f"""
+        INSERT INTO {self.interval} (equipment_key, location_key, from_date, to_date, copies)
+        SELECT t.equipment_key, t.location_key, :date, :open, t.copies
+        FROM tmp_deployed t
+        WHERE NOT EXISTS (SELECT 1 FROM {self.interval} 
+                          WHERE {self.interval}.to_date = :open AND {same})
+        ORDER BY t.equipment_key;"""), params)
+        temporary_table(connection, 'tmp_deployed')
+        if source == self.stage_table:
+            temporary_table(connection, self.stage_table)
+
+    def purge(self, 
+              date: "the latest written date_key",
+              connection: "open connection to run in, a new transaction if None" = None):
+        """undo write(date): delete its events and the intervals it opened, reopen the ones it closed"""
+        from sqlalchemy import text
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.purge(date, connection)
+        params = {'date': date, 'open': self.open_date}
+        connection.execute(text(f"DELETE FROM {self.event} WHERE date_key = :date"), params)
+        connection.execute(text(f"DELETE FROM {self.interval} WHERE from_date = :date"), params)
+        previous = connection.execute(text("SELECT MAX(date_key) FROM dim_date_calendar WHERE date_key < :date"), 
+                                      params).scalar()
+        if previous is not None:
+            connection.execute(text(f"UPDATE {self.interval} SET to_date = :open WHERE to_date = :previous"), 
+                               {**params, 'previous': str(previous)})
+
+    def deployed(self, 
+                 by_type: "one row per date_key and device_type, else per date_key" = False):
+        """
+        deployed devices per loaded date from the interval ends: copies added on 
+        from_date, removed after to_date. Reads intervals, not devices x days.
+        """
+        import pandas as pd
+        keys = ['date_key'] + (['device_type'] if by_type else [])
+        device_type = "COALESCE(de.device_type, '') AS device_type," if by_type else ""
+        join = f"JOIN dim_equipment de ON i.equipment_key = de.equipment_key" if by_type else ""
+        group = ", COALESCE(de.device_type, '')" if by_type else ""
+        dates = pd.read_sql_query("SELECT DISTINCT date_key FROM dim_date_calendar ORDER BY date_key;", 
+                                  con = self.engine)['date_key'].astype(str)
+        starts = pd.read_sql_query(f"""
+        SELECT i.from_date AS date_key, {device_type} SUM(i.copies) AS copies
+        FROM {self.interval} i {join}
+        GROUP BY i.from_date{group};""", con = self.engine)
+        ends = pd.read_sql_query(f"""
+        SELECT i.to_date AS date_key, {device_type} SUM(i.copies) AS copies
+        FROM {self.interval} i {join}
+        WHERE i.to_date <> '{self.open_date}'
+        GROUP BY i.to_date{group};""", con = self.engine)
+        # an interval ending on a date stops counting on the next loaded date
+        following = dict(zip(dates, dates.shift(-1)))
+        ends['date_key'] = ends['date_key'].astype(str).map(following)
+        ends['copies'] = -ends['copies']
+        deltas = (pd.concat([starts.astype({'date_key': str}), ends.dropna(subset = ['date_key'])])
+                    .groupby(keys)['copies'].sum())
+        if not by_type:
+            counts = deltas.reindex(dates, fill_value = 0).cumsum()
+            return counts.rename('num_deployed').rename_axis('date_key').reset_index()
+        counts = deltas.unstack('device_type', fill_value = 0).reindex(dates, fill_value = 0).cumsum()
+        counts = counts.stack().rename('num_deployed').reset_index()
+        return counts[counts['num_deployed'] != 0].reset_index(drop = True)
+
+
+class LoadLedger:
+    """
+    One row per loaded report date in etl_load_ledger: file, sha1, size, mtime, rows and status.
+    
+    plan() compares the reports on disk with the ledger and says what to do with each date: 
+    'load' new dates, 'reload' the latest date if its load failed or its file changed, 
+    'skip' loaded ones. A changed, failed or new file older than the latest loaded 
+    date is 'stale' or 'late' and left alone, the dimensions have moved on since; 
+    rewind() to replay from there. The sha1 is only computed when size or mtime 
+    differ from the ledger.
+    """
+    table = 'etl_load_ledger'
+
+    def __init__(self, 
+                 engine: "sqlalchemy engine",
+                 aggregates: "DailyAggregates refreshed when a date is purged, None to skip" = None,
+                 facts: "IntervalFacts when the facts are stored as intervals, None for fact_inventory" = None):
+        self.engine = engine
+        self.aggregates = aggregates
+        self.facts = facts
+        self.__ready = False
+
+    def create(self):
+        """create the ledger if missing, adopting the dates already in fact_inventory as loaded"""
+        from sqlalchemy import inspect
+        if self.__ready:
+            return
+        if not inspect(self.engine).has_table(self.table):
+            with self.engine.begin() as connection:
+                connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    date_key DATE NOT NULL PRIMARY KEY,
+                    file_name VARCHAR(255),
+                    checksum VARCHAR(40),
+                    file_size BIGINT,
+                    file_mtime DOUBLE,
+                    row_count BIGINT,
+                    status VARCHAR(16) NOT NULL,
+                    started_at VARCHAR(32),
+                    finished_at VARCHAR(32),
+                    error TEXT
+                );""")
+                facts = 'fact_inventory' if self.facts is None else self.facts.view
+                if inspect(connection).has_table(facts) or facts in inspect(connection).get_view_names():
+                    connection.execute(f"""
+                    INSERT INTO {self.table} (date_key, status)
+                    SELECT DISTINCT date_key, 'loaded' FROM {facts};""")
+        self.__ready = True
+
+    def entries(self):
+        """{date_key: ledger row as dict}"""
+        import pandas as pd
+        self.create()
+        rows = pd.read_sql_query(f"SELECT * FROM {self.table};", con = self.engine)
+        rows['date_key'] = rows['date_key'].astype(str)
+        return {r['date_key']: r for r in rows.to_dict('records')}
+
+    def plan(self, 
+             reports: "list of (date, path) in date order",
+             force: "reload dates already loaded" = False):
+        """one dict per report: date, file, path, size, mtime, checksum and action"""
+        import os
+        entries = self.entries()
+        last = max(entries) if entries else None
+        plan = []
+        for date, path in reports:
+            stat = os.stat(path)
+            item = {'date': date, 'file': os.path.basename(path), 'path': path, 
+                    'size': stat.st_size, 'mtime': stat.st_mtime, 'checksum': None}
+            row = entries.get(date)
+            if row is None:
+                action = 'load' if force or last is None or date > last else 'late'
+            elif force:
+                action = 'reload'
+            elif row['status'] != 'loaded':
+                action = 'reload' if date == last else 'stale'
+            elif (row['checksum'] is None or 
+                  (row['file_size'] == item['size'] and row['file_mtime'] == item['mtime'])):
+                action = 'skip'
+            else:
+                item['checksum'] = file_sha1(path)
+                if item['checksum'] == row['checksum']:
+                    action = 'skip'
+                else:
+                    action = 'reload' if date == last else 'stale'
+            if action in ('load', 'reload') and item['checksum'] is None:
+                item['checksum'] = file_sha1(path)
+            item['action'] = action
+            plan.append(item)
+        return plan
+
+    def start(self, 
+              item: "one dict from plan()"):
+        """record the load of item as running"""
+        self.__write(item, 'running')
+
+    def finish(self, 
+               item: "one dict from plan()",
+               rows: "report rows loaded",
+               connection: "connection of the load transaction, a new transaction if None" = None):
+        """record item as loaded, inside the load's transaction when connection is given"""
+        self.__write(item, 'loaded', rows = rows, connection = connection)
+
+    def fail(self, 
+             item: "one dict from plan()",
+             error: "the exception"):
+        """record item as failed, it is reloaded by the next run"""
+        self.__write(item, 'failed', error = repr(error)[:1000])
+
+    def purge(self, 
+              date: "the latest loaded date_key, to clear before a reload",
+              connection: "open connection to run in, a new transaction if None" = None):
+        """
+        undo the load of date: delete its facts, calendar row and the dimension rows 
+        it added, and make current again the ones it expired. Only right for the 
+        latest date, later loads would build on the rows it removes.
+        """
+        from sqlalchemy import text
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.purge(date, connection)
+        if self.facts is None:
+            connection.execute(text("DELETE FROM fact_inventory WHERE date_key = :date"), {'date': date})
+        else:
+            self.facts.purge(date, connection)
+        for sql in ["DELETE FROM dim_equipment WHERE effective_date = :date", 
+                    """UPDATE dim_equipment SET retirement_date = '9999-12-31', last_update_date = effective_date 
+                    WHERE retirement_date = :date""", 
+                    "DELETE FROM dim_location WHERE effective_dt = :date", 
+                    "UPDATE dim_location SET expiration_dt = '9999-12-31' WHERE expiration_dt = :date", 
+                    "DELETE FROM dim_date_calendar WHERE date_key = :date"]:
+            connection.execute(text(sql), {'date': date})
+        if self.aggregates is not None:
+            self.aggregates.refresh(date, connection)
+
+    def rewind(self, 
+               date: "first date_key to forget"):
+        """purge every date in the ledger from date on, latest first, and drop their ledger rows"""
+        from sqlalchemy import text
+        dates = sorted((d for d in self.entries() if d >= date), reverse = True)
+        with self.engine.begin() as connection:
+            for d in dates:
+                self.purge(d, connection)
+            connection.execute(text(f"DELETE FROM {self.table} WHERE date_key >= :date"), {'date': date})
+        return dates
+
+    def __write(self, item, status, rows = None, error = None, connection = None):
+        import datetime
+        from sqlalchemy import text
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.__write(item, status, rows, error, connection)
+        now = datetime.datetime.now().isoformat(timespec = 'microseconds')
+        previous = connection.execute(text(f"SELECT started_at FROM {self.table} WHERE date_key = :date"), 
+                                      {'date': item['date']}).fetchone()
+        connection.execute(text(f"DELETE FROM {self.table} WHERE date_key = :date"), {'date': item['date']})
+        connection.execute(text(f"""
+        INSERT INTO {self.table} (date_key, file_name, checksum, file_size, file_mtime, row_count, 
+                                  status, started_at, finished_at, error)
+        VALUES (:date, :file, :checksum, :size, :mtime, :rows, :status, :started, :finished, :error)"""), 
+                           {'date': item['date'], 'file': item['file'], 'checksum': item['checksum'], 
+                            'size': item['size'], 'mtime': item['mtime'], 'rows': rows, 'status': status, 
+                            'started': now if status == 'running' or previous is None else previous[0], 
+                            'finished': None if status == 'running' else now, 'error': error})
+
+
+class SetBasedLoader:
+    """
+    Applies one daily snapshot to the warehouse with set-based SQL in a single transaction.
+    
+    The snapshot goes into temporary tables (tmp_location, tmp_snapshot) chunk by 
+    chunk as it is read, then INSERT ... SELECT / UPDATE statements do what the stored procedures, or 
+    update_date/update_location/update_equipment/update_fact, do row by row: 
+    expire locations and devices that are gone or changed, insert the new versions, 
+    write the deployed and retired fact rows and refresh the daily aggregates. 
+    Runs on MySQL and SQLite; changes are detected by row_hash when dim_equipment 
+    has it, by comparing the tracked columns otherwise. With facts (IntervalFacts) 
+    the fact rows are staged and written as intervals instead of to fact_inventory.
+    """
+    text_type = {'mysql': 'VARCHAR(255)', 'sqlite': 'TEXT'}
+
+    def __init__(self, 
+                 engine: "sqlalchemy engine",
+                 aggregates: "DailyAggregates refreshed in the same transaction, None to skip" = None,
+                 chunksize: "rows per insert round-trip into the temporary tables" = 10000,
+                 facts: "IntervalFacts to write the fact rows to, None for fact_inventory" = None):
+        self.engine = engine
+        self.aggregates = aggregates
+        self.chunksize = chunksize
+        self.facts = facts
+        self.dialect = engine.dialect.name
+
+    def load(self, 
+             date: "iso date str, format YYYY-MM-DD",
+             df: "report dataFrame from read_report, or an iterator of chunks",
+             connection: "open connection to run in, a new transaction if None" = None):
+        """apply the snapshot of date, returns {'locations_expired', 'locations_added', 'retired', 'added', 'facts', 'rows'}"""
+        import datetime
+        from sqlalchemy import inspect
+        
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.load(date, df, connection)
+        chunks = [df] if hasattr(df, 'columns') else df
+        has_row_hash = 'row_hash' in [c['name'] for c in inspect(self.engine).get_columns('dim_equipment')]
+        day = datetime.date.fromisoformat(date)
+        self.__create_temporary(connection)
+        connection.execute(self.__sql(f"""
+        INSERT INTO dim_date_calendar (date_key, cal_year, cal_month, cal_week_of_year)
+        SELECT :date, :year, :month, :week {'FROM DUAL' if self.dialect == 'mysql' else ''}
+        WHERE NOT EXISTS (SELECT 1 FROM dim_date_calendar WHERE date_key = :date);"""), 
+                           {'date': date, 'year': day.year, 'month': day.month, 
+                            'week': day.isocalendar()[1]})
+        # each chunk goes into tmp_location / tmp_snapshot as it is read, only one is in memory
+        rows, added, locations = 0, 0, None
+        for chunk in chunks:
+            chunk = chunk.reset_index(drop = True)
+            chunk.index += rows
+            new, locations = self.__locations(connection, date, chunk, locations)
+            added += new
+            self.__snapshot(connection, chunk, locations)
+            rows += len(chunk)
+        stats = {'locations_expired': self.__expire_locations(connection, date), 'locations_added': added}
+        stats.update(self.__equipment(connection, date, has_row_hash))
+        if self.facts is not None:
+            self.facts.write(date, connection)
+        stats['rows'] = rows
+        if self.aggregates is not None:
+            self.aggregates.refresh(date, connection)
+        self.__drop_temporary(connection)
+        return stats
+
+    def __locations(self, connection, date, chunk, locations):
+        """
+        stage the locations of chunk and add the ones without a current row, 
+        returns the number added and the current locations (location_key, location_name, building)
+        """
+        import pandas as pd
+        first = int(chunk.index[0]) if len(chunk) else 0
+        staged = (chunk.loc[:, ['location', 'bldg']].astype(object)
+                       .assign(row_no = chunk.index)
+                       .drop_duplicates(['location', 'bldg'])
+                       .rename(columns = {'location': 'location_name', 'bldg': 'building'}))
+        insert_rows(connection, 'tmp_location', staged, self.chunksize)
+        # locations kept by the snapshot keep their current row, so new ones can be added 
+        # chunk by chunk; the ones that are gone are expired once every chunk is staged
+        added = connection.execute(self.__sql(f"""
+        INSERT INTO dim_location (location_name, building, effective_dt, expiration_dt)
+        SELECT t.location_name, t.building, :date, '9999-12-31'
+        FROM tmp_location t
+        WHERE t.row_no >= :first
+        AND NOT EXISTS (SELECT 1 FROM dim_location d 
+                        WHERE d.expiration_dt = '9999-12-31' 
+                        AND {null_safe_eq(self.dialect, 'd.location_name', 't.location_name')} 
+                        AND {null_safe_eq(self.dialect, 'd.building', 't.building')})
+        ORDER BY t.row_no;"""), {'date': date, 'first': first}).rowcount
+        if locations is None or added:
+            locations = pd.read_sql_query("""
+            SELECT location_key, location_name, building FROM dim_location 
+            WHERE expiration_dt = '9999-12-31';""", con = connection)
+        return added, locations
+
+    def __expire_locations(self, connection, date):
+        return connection.execute(self.__sql(f"""
+        UPDATE dim_location SET expiration_dt = :date
+        WHERE expiration_dt = '9999-12-31'
+        AND NOT EXISTS (SELECT 1 FROM tmp_location t 
+                        WHERE {null_safe_eq(self.dialect, 't.location_name', 'dim_location.location_name')} 
+                        AND {null_safe_eq(self.dialect, 't.building', 'dim_location.building')});"""), {'date': date}).rowcount
+
+    def __snapshot(self, connection, chunk, locations):
+        """stage the rows of chunk with their location_key and fingerprint in tmp_snapshot"""
+        rows = (chunk.loc[:, ['location', 'bldg'] + EQUIPMENT_TRACKED[1:]].astype(object)
+                     .rename(columns = {'location': 'location_name', 'bldg': 'building'}))
+        rows.insert(0, 'equipment_id', equipment_ids(chunk).values)
+        rows.insert(0, 'row_no', chunk.index)
+        rows = (rows.merge(locations, how = 'left', on = ['location_name', 'building'])
+                    .dropna(subset = ['location_key'])
+                    .astype({'location_key': 'int64'}))
+        rows['row_hash'] = row_fingerprint(rows)
+        rows['is_new'] = 0
+        insert_rows(connection, 'tmp_snapshot', rows.loc[:, ['row_no', 'equipment_id', 'is_new', 'row_hash'] + EQUIPMENT_TRACKED], 
+                    self.chunksize)
+
+    def __equipment(self, connection, date, has_row_hash):
+        same = ' AND '.join(null_safe_eq(self.dialect, f'd.{c}', f'tmp_snapshot.{c}') for c in EQUIPMENT_TRACKED)
+        if has_row_hash:
+            same = f"(d.row_hash = tmp_snapshot.row_hash OR (d.row_hash IS NULL AND {same}))"
+        # new or modified: no current version with the same attributes
+        connection.execute(f"""
+        UPDATE tmp_snapshot SET is_new = 1
+        WHERE NOT EXISTS (SELECT 1 FROM dim_equipment d 
+                          WHERE d.retirement_date = '9999-12-31' 
+                          AND d.equipment_id = tmp_snapshot.equipment_id 
+                          AND {same});""")
+        # retired or modified: no unchanged row in the report
+        connection.execute("""
+        INSERT INTO tmp_retired (equipment_key, location_key)
+        SELECT d.equipment_key, d.location_key FROM dim_equipment d
+        WHERE d.retirement_date = '9999-12-31'
+        AND NOT EXISTS (SELECT 1 FROM tmp_snapshot s 
+                        WHERE s.equipment_id = d.equipment_id AND s.is_new = 0)
+        ORDER BY d.equipment_key;""")
+        if self.dialect == 'mysql':
+            retired = connection.execute(self.__sql("""
+            UPDATE dim_equipment d JOIN tmp_retired r ON d.equipment_key = r.equipment_key
+            SET d.retirement_date = :date, d.last_update_date = :date;"""), {'date': date}).rowcount
+        else:
+            retired = connection.execute(self.__sql("""
+            UPDATE dim_equipment SET retirement_date = :date, last_update_date = :date
+            WHERE equipment_key IN (SELECT equipment_key FROM tmp_retired);"""), {'date': date}).rowcount
+        
+        columns = ', '.join(EQUIPMENT_COLUMNS + (['row_hash'] if has_row_hash else []))
+        values = ', '.join(f's.{c}' for c in EQUIPMENT_COLUMNS + (['row_hash'] if has_row_hash else []))
+        added = connection.execute(self.__sql(f"""
+        INSERT INTO dim_equipment ({columns}, effective_date, retirement_date, last_update_date)
+        SELECT {values}, :date, '9999-12-31', :date
+        FROM tmp_snapshot s WHERE s.is_new = 1
+        ORDER BY s.row_no;"""), {'date': date}).rowcount
+        
+        # deployed rows in report order, then the retired ones
+        facts = 'fact_inventory' if self.facts is None else self.facts.stage(connection)
+        deployed = connection.execute(self.__sql(f"""
+        INSERT INTO {facts} (equipment_key, location_key, date_key, has_changed, is_deployed)
+        SELECT d.equipment_key, d.location_key, :date, 0, 1
+        FROM tmp_snapshot s JOIN dim_equipment d 
+        ON d.equipment_id = s.equipment_id AND d.retirement_date = '9999-12-31'
+        ORDER BY s.row_no, d.equipment_key;"""), {'date': date}).rowcount
+        connection.execute(self.__sql(f"""
+        INSERT INTO {facts} (equipment_key, location_key, date_key, has_changed, is_deployed)
+        SELECT equipment_key, location_key, :date, 1, 0
+        FROM tmp_retired ORDER BY equipment_key;"""), {'date': date})
+        return {'retired': retired, 'added': added, 'facts': deployed + retired}
+
+    def __create_temporary(self, connection):
+        text = self.text_type.get(self.dialect, 'VARCHAR(255)')
+        tracked = ', '.join(f"{c} {'DOUBLE' if c in EQUIPMENT_NUMERIC and c != 'location_key' else 'BIGINT' if c == 'location_key' else text}" 
+                            for c in EQUIPMENT_TRACKED)
+        temporary_table(connection, 'tmp_location', f"(row_no BIGINT, location_name {text}, building {text})")
+        temporary_table(connection, 'tmp_snapshot', 
+                        f"(row_no BIGINT, equipment_id {text}, is_new INTEGER, row_hash BIGINT, {tracked})")
+        temporary_table(connection, 'tmp_retired', "(equipment_key BIGINT, location_key BIGINT)")
+        connection.execute("CREATE INDEX ix_tmp_snapshot_id ON tmp_snapshot (equipment_id);")
+
+    def __drop_temporary(self, connection):
+        for table in ['tmp_location', 'tmp_snapshot', 'tmp_retired']:
+            temporary_table(connection, table)
+
+    @staticmethod
+    def __sql(query):
+        from sqlalchemy import text
+        return text(query)
+
+
 class DataPrep:
     """
     Downloading csv files from the box.
@@ -5,73 +2016,249 @@ class DataPrep:
     Update the database.
     """    
     def __init__(self, 
-                 engineStr: "database connection, for sqlalchemy engine"):
-        import pandas as pd
-        from sqlalchemy import create_engine
+                 engineStr: "database connection, for sqlalchemy engine",
+                 pool_size: "connections kept open in the pool" = 5,
+                 pool_pre_ping: "test connections before handing them out" = True,
+                 pool_recycle: "seconds before a pooled connection is replaced" = 3600,
+                 tracer: "Tracer recording a span per stage, None records nothing" = None,
+                 fact_storage: "'daily' rows in fact_inventory, 'interval' IntervalFacts" = 'daily'):
         self.engineStr = engineStr
-        self.query_dim_equipment = """
-        select *
-        from dim_equipment
-        ;
-        """
-        self.query_dim_location = """
-        select *
-        from dim_location
-        ;
-        """
-        self.query_dim_date = """
-        select * 
-        from dim_date_calendar
-        ;
-        """
-        engine = create_engine(engineStr)
-        self.dim_equipment = pd.read_sql_query(self.query_dim_equipment, 
-                                               con = engine, 
-                                               coerce_float=False)
-        self.dim_location = pd.read_sql_query(self.query_dim_location, 
-                                              con = engine, 
-                                              coerce_float=False)
+        self.engine = EngineRegistry.acquire(engineStr, 
+                                             pool_size = pool_size, 
+                                             pool_pre_ping = pool_pre_ping, 
+                                             pool_recycle = pool_recycle)
+        try:
+            self.tracer = Tracer() if tracer is None else tracer.attach(self.engine)
+            self.query_dim_date = """
+            select * 
+            from dim_date_calendar
+            ;
+            """
+            # categories shared by the reports and the dimension frames
+            self.schema = ReportSchema()
+            # dimensions are read on first use, current rows and merge columns only
+            self.locations = DimensionCache(self.engine, 'dim_location', 'location_key', 
+                                            ['location_name', 'building'], 'expiration_dt', 
+                                            columns = [], schema = self.schema.apply)
+            self.equipment = DimensionCache(self.engine, 'dim_equipment', 'equipment_key', 
+                                            ['equipment_id'], 'retirement_date', 
+                                            columns = self.__equipment_columns, schema = self.schema.apply, 
+                                            fingerprint = self.__fingerprint)
+            # deployed devices as intervals plus change events, read back through the fact_inventory view
+            if fact_storage not in ('daily', 'interval'):
+                raise ValueError(f"fact_storage is 'daily' or 'interval', not {fact_storage!r}")
+            facts = IntervalFacts(self.engine)
+            if facts.migrated() != (fact_storage == 'interval'):
+                raise ValueError("fact_inventory is the daily table, switch the warehouse to intervals with "
+                                 "IntervalFacts(engine).migrate() or refresh.py --migrate-facts first" 
+                                 if fact_storage == 'interval' else 
+                                 "fact_inventory is the view of the intervals, load with fact_storage = 'interval'")
+            self.facts = facts if fact_storage == 'interval' else None
+            if self.facts is not None:
+                self.facts.create()
+            # deployed fact rows of the date being loaded, written as intervals with the retired ones
+            self.__day_facts = []
+            self.aggregates = DailyAggregates(self.engine, 'fact_inventory')
+            self.aggregates.create()
+            # what was loaded from which file, read by updatedb_sql and ingest_report
+            self.ledger = LoadLedger(self.engine, self.aggregates, self.facts)
+        except BaseException:
+            # nothing owns the engine if construction failed
+            self.close()
+            raise
+
+    @staticmethod
+    def __equipment_columns(table_columns):
+        """location_key and row_hash when dim_equipment has row hashes, else the tracked columns to compute them"""
+        if 'row_hash' in table_columns:
+            return ['location_key', 'row_hash']
+        return EQUIPMENT_COLUMNS
+
+    @property
+    def dim_location(self):
+        """every dim_location row in the cache's columns, reads the history"""
+        return self.locations.frame()
 
+    @property
+    def dim_equipment(self):
+        """every dim_equipment row in the cache's columns, reads the history"""
+        return self.equipment.frame()
+
+    def close(self):
+        """Release the shared engine."""
+        if self.engine is not None:
+            EngineRegistry.release(self.engineStr)
+            self.engine = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @traced('download')
     def downloadcsv(self, 
                     authPath: "path to your box config file, a json file", 
                     folderID: "the id of the folder on box drive containing the csv files", 
-                    date: "the date taht the csv file was created"):
-        """Download the csv file from box."""
-        from boxsdk import JWTAuth
-        from boxsdk import Client
+                    date: "the date taht the csv file was created, or a list of dates",
+                    max_workers: "concurrent downloads" = 4,
+                    store: "a ReportStore to use instead of box, e.g. LocalReportStore" = None):
+        """Download the csv files from box into raw_csv/, skipping the ones already there."""
         import os
 
-        sdk = JWTAuth.from_settings_file(authPath)
-        client = Client(sdk)
-        items = client.folder(folder_id=folderID).get_items()
-        dir = os.getcwd()
-        for item in items:
-            if date in item.name:
-                item_id = item.id
-                box_file = client.file(file_id= item_id).get()
-                output_file = open(f'{os.getcwd()}/raw_csv/{box_file.name}', 'wb')
-                box_file.download_to(output_file)
-                output_file.close()
+        if store is None:
+            store = BoxReportStore(authPath, folderID)
+        downloader = ReportDownloader(store, 
+                                      f'{os.getcwd()}/raw_csv', 
+                                      max_workers = max_workers)
+        status = downloader.download(date)
+        self.tracer.annotate(rows = sum(v == 'downloaded' for v in status.values()),
+                             bytes = sum(os.path.getsize(f'{downloader.dest}/{k}') 
+                                         for k, v in status.items() if v == 'downloaded'))
+        return status
 
+    @traced('updatedb_sql')
     def updatedb_sql(self,
-                     path: "path to direcotry contain all csv files"):
+                     path: "path to direcotry contain all csv files",
+                     backend: "stage loader, 'auto', 'executemany', 'bulkfile' or 'sqlite'" = 'auto',
+                     chunksize: "rows per stage insert round-trip" = 10000,
+                     read_chunksize: "rows per csv chunk to stream into stage, None reads whole files" = None,
+                     workers: "threads/processes parsing upcoming csv files, 0 parses inline" = 0,
+                     queue_depth: "parsed files waiting for the database at most" = 2,
+                     executor: "'thread' or 'process' pool for the parsers" = 'thread',
+                     loader: "'procedures' runs the stored procedures, 'setbased' the SetBasedLoader" = 'procedures',
+                     skip_loaded: "skip the dates the load ledger has as loaded, False reloads every file" = True):
         """
         update the database with stored precedures, reads and update for multiple csv files, if necessary.
+        
+        With loader = 'setbased' each snapshot is applied by SetBasedLoader in one 
+        transaction instead, no stage table or stored procedures needed (e.g. SQLite).
+        
+        With read_chunksize every csv is streamed into the stage table chunk by chunk 
+        before the procedures run, so memory is bounded by the chunk size.
+        
+        With workers the backfill is pipelined: upcoming csv files are parsed in a 
+        pool while the database steps run in date order, and at most queue_depth 
+        parsed files are held in memory.
+        
+        Rows/sec of every stage load are kept in self.stage_loader.stats.
+        
+        path may also be a ReportArchive, then the reports are read from its parquet files.
+        
+        Every load is recorded in the LoadLedger, so a rerun only loads the new dates, 
+        the ones that failed and the latest one if its file changed; dates already 
+        loaded are purged from fact_inventory before they are reloaded. 
+        Returns {date: action} with the action of the ledger plan for every report.
         """
         import os
-        import re
-        import pandas as pd
-        from sqlalchemy import create_engine
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        
+        engine = self.engine
+        if loader == 'procedures' and self.facts is not None:
+            raise ValueError("the stored procedures write the daily fact_inventory table, "
+                             "load a warehouse with interval facts with loader = 'setbased'")
+        if loader == 'setbased':
+            self.set_loader = SetBasedLoader(engine, self.aggregates, chunksize = chunksize, facts = self.facts)
+        elif getattr(self, 'stage_loader', None) is None or backend not in ('auto', self.stage_loader.backend):
+            self.stage_loader = StageLoader.for_engine(engine, backend, chunksize = chunksize)
+        self.loader = loader
+        if isinstance(path, ReportArchive):
+            plan = self.ledger.plan([(date, path.path(date)) for date in path.dates()], 
+                                    force = not skip_loaded)
+            for item in self.__report_plan(plan, not skip_loaded):
+                self.__load_snapshot(item, self.schema.apply(path.read(item['date'])))
+            return {item['date']: item['action'] for item in plan}
+        plan = self.ledger.plan([(date, f'{path}/{file}') for date, file in report_files(path)], 
+                                force = not skip_loaded)
+        items = {item['date']: item for item in plan}
+        reports = [(item['date'], item['file']) for item in self.__report_plan(plan, not skip_loaded)]
+        
+        if read_chunksize is not None or not workers:
+            for date, file in reports:
+                if read_chunksize is None:
+                    with self.tracer.span('parse', file = file):
+                        snapshot = read_report(f'{path}/{file}', date = date, schema = self.schema)
+                        self.tracer.annotate(rows = len(snapshot), bytes = os.path.getsize(f'{path}/{file}'))
+                else:
+                    snapshot = read_report(f'{path}/{file}', date = date, chunksize = read_chunksize, 
+                                           schema = self.schema)
+                self.__load_snapshot(items[date], snapshot)
+            return {item['date']: item['action'] for item in plan}
+        
+        # producer parses ahead in the pool, consumer loads in date order
+        Pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        reports = deque(reports)
+        pending = deque()
+        with Pool(max_workers = workers) as pool:
+            def submit():
+                date, file = reports.popleft()
+                pending.append((date, file, pool.submit(read_report, f'{path}/{file}', date, None, self.schema)))
+            
+            while reports and len(pending) < queue_depth:
+                submit()
+            while pending:
+                date, file, future = pending.popleft()
+                # parsing runs in the pool, the span is the time the loader waits for it
+                with self.tracer.span('parse_wait', file = file):
+                    # categories found by the worker join the shared ones
+                    snapshot = self.schema.apply(future.result())
+                    self.tracer.annotate(rows = len(snapshot), bytes = os.path.getsize(f'{path}/{file}'))
+                # refill the queue before the database work so parsing overlaps it
+                if reports:
+                    submit()
+                self.__load_snapshot(items[date], snapshot)
+                del snapshot
+        return {item['date']: item['action'] for item in plan}
+
+    def __report_plan(self, 
+                      plan: "items from LoadLedger.plan",
+                      replay: "rewind the ledger to the first report, for skip_loaded = False" = False):
+        """the plan items to load, reports left alone are printed"""
+        for item in plan:
+            if item['action'] == 'late':
+                print(f"{item['file']} is older than the last loaded date, not loaded")
+            elif item['action'] == 'stale':
+                print(f"{item['file']} changed or failed before later dates were loaded, not reloaded")
+        items = [item for item in plan if item['action'] in ('load', 'reload')]
+        if replay and items:
+            # later dates build on earlier ones, replay everything from the first report on
+            self.ledger.rewind(min(item['date'] for item in items))
+            self.locations.reset()
+            self.equipment.reset()
+        return items
+
+    @traced('load_snapshot')
+    def __load_snapshot(self, 
+                        item: "LoadLedger plan item of the report",
+                        snapshot: "dataFrame, or iterator of dataFrame chunks"):
+        """
+        load one report into stage and run the stored procedures on it, or apply it with the set based loader.
+        
+        The ledger row is written as loaded in the same transaction as the load, 
+        as failed if the load raises.
+        """
+        date, file = item['date'], item['file']
+        self.ledger.start(item)
+        try:
+            self.__apply_snapshot(date, file, snapshot, item)
+        except Exception as e:
+            self.ledger.fail(item, e)
+            raise
+
+    def __apply_snapshot(self, date, file, snapshot, item):
         import datetime
         
-        engine = create_engine(self.engineStr)
-        date_lst = []
-        files = os.listdir(path)
-        for file in files:    
-            date = re.findall(r'asset-report-(\d{4}-\d{2}-\d{2})', file)
-            if date:
-                date_lst.append(date[0])
-        date_lst.sort()
+        if getattr(self, 'loader', 'procedures') == 'setbased':
+            with self.engine.begin() as connection:
+                if item['action'] == 'reload':
+                    self.ledger.purge(date, connection)
+                stats = self.set_loader.load(date, snapshot, connection)
+                self.ledger.finish(item, stats['rows'], connection)
+            # the dimension caches are read again on next use
+            self.locations.reset()
+            self.equipment.reset()
+            return
         
         # loading data using prestored procedures
         procedures = ['UpdateDates()', 
@@ -79,31 +2266,42 @@ class DataPrep:
                       'UpdateEquipment()', 
                       'updateFact()'
                       ]
-        for date in date_lst:
-            for file in files:
-                if ("asset-report-" + date) in file:
-                    df = pd.read_csv(f'{path}/{file}', index_col=False)
-                    df.columns = [i.replace(' ', '_') for i in df.columns]
-                    df['Loading_Date'] = date
-                    df.to_sql(name = 'stage', con = engine, 
-                              if_exists = 'replace', index = True)
-                    print(f"Stage table ready for {file}...")
+        rows = 0
+        with self.tracer.span('stage', file = file):
+            if hasattr(snapshot, 'columns'):
+                self.stage_loader.load(snapshot, label = file)
+                rows = len(snapshot)
+            else:
+                for i, df in enumerate(snapshot):
+                    self.stage_loader.load(df, label = file, truncate = i == 0)
+                    rows += len(df)
+            self.tracer.annotate(rows = rows)
 
-                    with engine.begin() as connection:
-                        for p in procedures:
-                            time1 = datetime.datetime.now()
-                            connection.execute(f"CALL {p};")
-                            print(f"{p} finished for {file}! Took {datetime.datetime.now() - time1} time")
-                    break
+        with self.engine.begin() as connection:
+            if item['action'] == 'reload':
+                self.ledger.purge(date, connection)
+            for p in procedures:
+                time1 = datetime.datetime.now()
+                with self.tracer.span('procedure', procedure = p, file = file):
+                    connection.execute(f"CALL {p};")
+                print(f"{p} finished for {file}! Took {datetime.datetime.now() - time1} time")
+            with self.tracer.span('aggregates', date = date):
+                self.aggregates.refresh(date, connection)
+            self.ledger.finish(item, rows, connection)
 
+    @traced('update_date')
     def update_date(self, 
                     dateStr: "string of the date of that the csv file was created"):
-        """update dim_date_calendar dimension table."""
+        """update dim_date_calendar dimension table, dates already there are left alone."""
         from datetime import date
-        from sqlalchemy import create_engine
         import pandas as pd
+        from sqlalchemy import text
         
-        engine = create_engine(self.engineStr)        
+        engine = self.engine
+        with engine.connect() as connection:
+            if connection.execute(text("SELECT 1 FROM dim_date_calendar WHERE date_key = :date"), 
+                                  {'date': dateStr}).fetchone() is not None:
+                return
         date_key = date(int(dateStr[0:4]), int(dateStr[5:7]), int(dateStr[8:]))
         dateDict = {"date_key": [dateStr], 
             "cal_year": [int(dateStr[0:4])], 
@@ -119,85 +2317,45 @@ class DataPrep:
                   index = False)
         self.dim_date = pd.read_sql_query(self.query_dim_date, engine)
     
+    @traced('update_location')
     def update_location(self, 
                         date: "iso date str, format YYYY-MM-DD",
                         raw_df: "pandas dataFrame created from raw csv"):
         """update dim_location"""
-        import pandas as pd
-        from sqlalchemy import create_engine
-        engine = create_engine(self.engineStr)
-        
         # raw_df, get distinct location and building and rename
         df_new = raw_df.loc[:, ['location', 'bldg']].drop_duplicates().copy()
         df_new.columns = ["location_name", "building"]
         df_new['effective_dt'] = date
         df_new['expiration_dt'] = '9999-12-31'
-        df_new['location_key'] = [i for i in range(1, len(df_new) + 1)]
-
-        # location_key_new = NaN, locations exipired on this date, set exipration date to date
-        df_merge = df_new.merge(self.dim_location.loc[self.dim_location['expiration_dt'].apply(str) == '9999-12-31'], 
-                                how = 'outer', 
-                                on=['location_name', 'building'],
-                                suffixes = ["_new", "_current"])
-        expired_records = df_merge[pd.isna(df_merge['location_key_new'])]
-        with engine.begin() as connection:
-            keys = [int(float(i)) for i in expired_records['location_key_current'].tolist()]
-            if len(keys) != 0:
-                query = f"""
-                UPDATE dim_location
-                SET expiration_dt = '{date}'
-                WHERE location_key in ({keys});""".replace('[', '').replace(']', '')
-                connection.execute(query)
+        df_new = self.schema.apply(df_new)
+
+        # current locations not in raw_df exipired on this date, set exipration date to date
+        current = self.locations.current
+        in_report = self.locations.keys(current).isin(self.locations.keys(df_new))
+        self.locations.expire(current.loc[~in_report, 'location_key'], 
+                              {'expiration_dt': date})
                 
-        # if only in new raw_df, location_key_current = NaN after outer join; insert them into dim_location
-        new_records = (
-            df_merge[pd.isna(df_merge['location_key_current'])]
-            .loc[:, ['location_name', 
-                     'building', 
-                     'effective_dt_new', 
-                     'expiration_dt_new']]
-            .rename(columns={'effective_dt_new': 'effective_dt',
-                    'expiration_dt_new': 'expiration_dt'})
-                       )
-        
-        # add location_key, not needed if primary key is auto_increment
-        # new_records.insert(loc = 0,
-        #             column = 'location_key', 
-        #             value = [i for i in range(len(self.dim_location) + 1, 
-        #                                       len(self.dim_location) + len(new_records) + 1)])
-        
-        new_records.to_sql(name = 'dim_location', 
-                con = engine, 
-                if_exists = 'append', 
-                index = False)
-        
-        self.dim_location = (pd.read_sql_query(self.query_dim_location, 
-                                               con = engine, coerce_float=False)
-                                .drop_duplicates(subset=['location_name', 'building'], 
-                                                 keep='last'))
+        # if only in new raw_df, insert them into dim_location
+        new_records = df_new[~self.locations.is_current(df_new)]
+        self.locations.insert(new_records)
     
     def __get_equipmentid(self, 
                           df: "pandas dataFrame"):
-        import pandas as pd
-        f = lambda x: str(x).replace(' ', '_')
-        device_name = [name.split('.')[0] for name in df.loc[:, 'device_name']]
-        id = []
-        for i in range(len(df)):
-            a = device_name[i]
-            b = df.loc[:, 'serial_number'][i]
-            c = df.loc[:, 'rack_room_number'][i]
-            id.append((lambda x, y, z:x + f(z) if pd.isna(y) else x + f(y))(a, b, c).replace('nan', ''))
-        return id
+        """equipment_id of every row, see equipment_ids"""
+        return equipment_ids(df)
+
+    def __equipmentid(self, 
+                      raw_df: "pandas dataFrame created from raw csv"):
+        """equipment_id for raw_df, computed once per file and shared by update_equipment and update_fact."""
+        if 'equipment_id' not in raw_df.columns:
+            raw_df.insert(loc = 0,
+                          column = 'equipment_id', 
+                          value = self.__get_equipmentid(raw_df))
+        return raw_df['equipment_id']
     
-    def update_equipment(self, 
-                         date: "iso date str, format YYYY-MM-DD",
+    def __equipment_rows(self, 
                          raw_df: "pandas dataFrame created from raw csv"):
-        """update the dim_equipment dimension table."""
-        import pandas as pd
-        from sqlalchemy import create_engine
-        engine = create_engine(self.engineStr)
-        
-        # get the columns
+        """equipment attributes of raw_df with dim_equipment column names, plus equipment_id."""
         df = (raw_df.loc[:, ['location', 'bldg', 'asset_tag', 'barcode', 
                            'device_name', 'device_type', 
                            'ip_address', 'make', 'model', 
@@ -211,42 +2369,50 @@ class DataPrep:
         ## add equipment_id
         df.insert(loc = 0,
                        column = 'equipment_id', 
-                       value = self.__get_equipmentid(df))
-        # insert location_key
-        temp_df = df.merge(self.dim_location, 
-                           how = "inner",
-                           on=['location_name', 'building'], 
-                           suffixes = ["", "_current"])
-        temp_df = pd.concat([temp_df.loc[:, ['equipment_id', 'location_key']], 
-                             temp_df.iloc[:, 3:18]], axis = 1)
-                
-        # compare with currently deployed dim_equipment
-        temp_df = temp_df.merge(self.dim_equipment[self.dim_equipment['retirement_date'].apply(str) == '9999-12-31'], 
-                                how = 'outer', 
-                                on=['equipment_id'],
-                                suffixes = ["", "_current"])
-        
-        # changed/retired devices
-        self.retired_devices = temp_df[pd.isna(temp_df.device_name)]
-        # set retirement_date/last_update_date to date
-        with engine.begin() as connection:
-            keys = [int(float(i)) for i in self.retired_devices['equipment_key'].tolist()]
-            if len(keys) != 0:
-                query = f"""
-                UPDATE dim_equipment
-                SET retirement_date = '{date}',
-                    last_update_date = '{date}'
-                WHERE equipment_key in ({keys});""".replace('[', '').replace(']', '')
-                connection.execute(query)
-        
-        # new devices
-        new_records = temp_df[pd.isna(temp_df.device_name_current)].iloc[:, 0:17]
-        
-        # set equipment_key, not needed if primary key is auto_increment
-        # new_records.insert(loc = 0,
-        #     column = 'equipment_key', 
-        #     value = [i for i in range(len(self.dim_equipment) + 1, 
-        #                                 len(self.dim_equipment) + len(new_records) + 1)])
+                       value = self.__equipmentid(raw_df))
+        return df
+
+    @traced('update_equipment')
+    def update_equipment(self, 
+                         date: "iso date str, format YYYY-MM-DD",
+                         raw_df: "pandas dataFrame created from raw csv"):
+        """update the dim_equipment dimension table."""
+        df = self.__equipment_rows(raw_df)
+        self.__apply_equipment(date, df, self.equipment.current['equipment_id'].isin(df['equipment_id']).values)
+
+    def __apply_equipment(self, 
+                          date: "iso date str, format YYYY-MM-DD",
+                          df: "equipment rows that may be new, from __equipment_rows",
+                          present: "boolean array over the current rows, True for devices in the report"):
+        """
+        retire current devices not present, insert the devices of df that are not current yet.
+        
+        A device whose tracked attributes changed (row fingerprint differs) is both: 
+        its current row is retired and a new version is inserted.
+        """
+        # insert location_key and the fingerprint of the reported attributes
+        df = (self.schema.apply(df).merge(self.locations.current.loc[:, ['location_name', 'building', 'location_key']], 
+                       how = "left",
+                       on=['location_name', 'building'])
+                .dropna(subset = ['location_key'])
+                .astype({'location_key': 'int64'}))
+        df['row_hash'] = row_fingerprint(df)
+        
+        # compare id + fingerprint with currently deployed dim_equipment
+        current = self.equipment.current
+        matched = df['equipment_id'].map(self.equipment.fingerprints)
+        modified = matched.notna() & (matched != df['row_hash'])
+        
+        # changed/retired devices, set retirement_date/last_update_date to date
+        self.retired_devices = current[~present | 
+                                       current['equipment_id'].isin(df.loc[modified, 'equipment_id'])].copy()
+        self.modified_devices = df.loc[modified, 'equipment_id']
+        
+        # new and modified devices, keep the report order
+        columns = EQUIPMENT_COLUMNS + (['row_hash'] if 'row_hash' in current.columns else [])
+        new_records = df.loc[matched.isna() | modified, columns]
+        self.equipment.expire(self.retired_devices['equipment_key'], 
+                              {'retirement_date': date, 'last_update_date': date})
         
         # set effective_date to date
         new_records['effective_date'] = date
@@ -255,43 +2421,76 @@ class DataPrep:
         # set last_update_date to date
         new_records['last_update_date'] = date
         # insert new records into database
-        new_records.to_sql(name = 'dim_equipment', 
-                con = engine, 
-                if_exists = 'append', 
-                index = False)
-
-        self.dim_equipment = (pd.read_sql_query(self.query_dim_equipment, engine).
-                                drop_duplicates(subset=['equipment_id'], keep='last'))
+        self.equipment.insert(new_records)
         
+    def __fingerprint(self, 
+                      rows: "dim_equipment rows indexed by equipment_key"):
+        """row_hash of dim_equipment rows, computed for rows stored without one"""
+        if 'row_hash' not in rows.columns:
+            return row_fingerprint(rows)
+        hashes = rows['row_hash']
+        missing = hashes.isna()
+        if missing.any():
+            # e.g. rows written by the stored procedures, their attributes are not loaded
+            fetched = self.equipment.fetch(rows.index[missing], ['equipment_key'] + EQUIPMENT_COLUMNS)
+            hashes = hashes.astype(object)
+            hashes[missing] = row_fingerprint(fetched.loc[rows.index[missing]])
+        return hashes
+
+    def add_row_hash(self):
+        """add the row_hash column to dim_equipment and fill it for the current rows"""
+        from sqlalchemy import text
+        current = self.equipment.fetch(self.equipment.current.index, ['equipment_key'] + EQUIPMENT_COLUMNS)
+        with self.engine.begin() as connection:
+            if 'row_hash' not in self.equipment.current.columns:
+                connection.execute("ALTER TABLE dim_equipment ADD COLUMN row_hash BIGINT;")
+            hashes = row_fingerprint(current)
+            connection.execute(text("UPDATE dim_equipment SET row_hash = :h WHERE equipment_key = :k"),
+                               [{'h': int(h), 'k': int(k)} for h, k in zip(hashes, current['equipment_key'])])
+        self.equipment.load()
+
+    @traced('update_fact')
     def update_fact(self, 
                     date: "date the csv file is created",
                     df: "pandas dataFrame created from raw csv"):
-        """Update fact table"""
-        import pandas as pd
-        from sqlalchemy import create_engine
-        engine = create_engine(self.engineStr)
+        """Update fact table and its daily aggregates"""
+        self.__deployed_facts(date, df)
+        self.__retired_facts(date)
+        self.aggregates.refresh(date)
+
+    def __deployed_facts(self, 
+                         date: "date the csv file is created",
+                         df: "pandas dataFrame created from raw csv, or one chunk of it"):
+        """insert is_deployed rows for every device of df"""
+        engine = self.engine
         
         # insert equipment_id then equipment_key 
-        df.insert(loc = 0,
-                column = 'equipment_id', 
-                value = self.__get_equipmentid(df))
-        df = (df.merge(self.dim_equipment, 
-                      how = 'inner', 
+        self.__equipmentid(df)
+        # left joins keep the report order, so chunked and whole-file loads write the same rows
+        df = (df.merge(self.equipment.current, 
+                      how = 'left', 
                       on = ['equipment_id'],
                       suffixes = ["", "_dim_eq"])
+                .dropna(subset = ['equipment_key'])
+                .astype({'equipment_key': 'int64'})
                 .rename(columns = {'location': 'location_name', 
                                        'bldg': 'building'})
             )
         # insert location_key
-        df = df.merge(self.dim_location, 
-                      how = 'inner', 
+        df = (self.schema.apply(df).merge(self.locations.current, 
+                      how = 'left', 
                       on = ['location_name', 'building'], 
                       suffixes = ['', '_dim_loc'])
+                .dropna(subset = ['location_key_dim_loc']))
         # insert date_key
         df['date_key'] = date
         # insert is_deployed as 1, and has_changed as 0
         df['is_deployed'] = 1
         df['has_changed'] = 0
+        if self.facts is not None:
+            self.__day_facts.append(df.loc[:, ['equipment_key', 'location_key', 
+                                               'date_key', 'has_changed', 'is_deployed']])
+            return
         (df.loc[:, ['equipment_key', 'location_key',
                                      'date_key', 'has_changed',
                                      'is_deployed']]
@@ -300,10 +2499,23 @@ class DataPrep:
                 if_exists = 'append', 
                 index = False)
         )
+
+    def __retired_facts(self, 
+                        date: "date the csv file is created"):
+        """insert has_changed rows for the devices retired by update_equipment"""
+        import pandas as pd
+        engine = self.engine
         # retired devices: insert has_changed as 1, is_deployed as 0, date_key as date
         self.retired_devices['date_key'] = date
         self.retired_devices['has_changed'] = 1
         self.retired_devices['is_deployed'] = 0        
+        if self.facts is not None:
+            rows = pd.concat(self.__day_facts + [self.retired_devices.loc[:, ['equipment_key', 'location_key', 
+                                                                              'date_key', 'has_changed', 
+                                                                              'is_deployed']]])
+            self.__day_facts = []
+            self.facts.write(date, rows = rows)
+            return
         (self.retired_devices.loc[:, ['equipment_key', 'location_key',
                                      'date_key', 'has_changed',
                                      'is_deployed']]
@@ -313,88 +2525,757 @@ class DataPrep:
                 index = False)
         )
 
-class CreateDash:
-    """Creating Bokeh Plots"""
-    def __init__(self,
-                 engineStr: "database connection, for sqlalchemy engine"):
-        self.engineStr = engineStr
-    
-    def stacked_bar(self, 
-                    query: "query to get the data for stacked bar plot, col1=date, col2=deviceType, col3=changes",
-                    title: "String of plot title",
-                    num_date: "number of weeks needed on plot, default 52/1 year" = 52,
-                    plot_width = 900,
-                    plot_height = 1600):
-        """Create the stacked bar chart for change by type & date plot"""
+    def __maybe_changed(self, 
+                        rows: "equipment rows from __equipment_rows"):
+        """
+        boolean array, True for rows that are new or modified against the current dimension
+        
+        Locations not current yet give no location_key, which always counts as a change.
+        """
+        rows = self.schema.apply(rows).merge(self.locations.current.loc[:, ['location_name', 'building', 'location_key']], 
+                          how = "left",
+                          on=['location_name', 'building'])
+        matched = rows['equipment_id'].map(self.equipment.fingerprints)
+        return (matched.isna() | (matched != row_fingerprint(rows))).values
+
+    @traced('ingest_report')
+    def ingest_report(self, 
+                      file: "path to one asset-report-YYYY-MM-DD csv file",
+                      date: "iso date str, taken from the file name if None" = None,
+                      chunksize: "rows per chunk to stream the csv, None reads the whole file" = None,
+                      skip_loaded: "skip the report if the load ledger has it as loaded" = True):
+        """
+        Load one report with update_date, update_location, update_equipment and update_fact.
+        
+        The load is recorded in the LoadLedger and, like updatedb_sql, a report 
+        already loaded is skipped. Returns the action of the ledger plan, 'load', 
+        'reload', 'skip', 'late' or 'stale'. These steps run in separate transactions, 
+        a load that fails halfway is marked failed and purged and reloaded by the next run, 
+        but dimension rows it wrote stay.
+        
+        With chunksize the csv is read twice in chunks: the first pass collects the 
+        distinct locations, which current devices are present and the devices that are 
+        new or changed, the second pass writes the fact rows. Besides the chunk, memory 
+        holds one flag per current device and the new or changed rows: little on a daily 
+        load, but every row of the file on a first load or a backfill. The database 
+        ends up the same as with the whole file.
+        """
+        import re
         
-        from bokeh.io import output_file, show, save
-        from bokeh.models import ColumnDataSource
-        from bokeh.palettes import viridis, d3
-        from bokeh.plotting import figure
-        from bokeh.layouts import gridplot
-        from sqlalchemy import create_engine
+        if date is None:
+            date = re.findall(r'asset-report-(\d{4}-\d{2}-\d{2})', file)[0]
+        item, = self.ledger.plan([(date, file)], force = not skip_loaded)
+        if not self.__report_plan([item], not skip_loaded):
+            return item['action']
+        if item['action'] == 'reload':
+            self.ledger.purge(date)
+            self.locations.reset()
+            self.equipment.reset()
+        self.ledger.start(item)
+        try:
+            self.ledger.finish(item, self.__ingest(file, date, chunksize))
+        except Exception as e:
+            self.ledger.fail(item, e)
+            raise
+        return item['action']
+
+    def __ingest(self, file, date, chunksize):
+        """the steps of ingest_report, returns the number of report rows"""
+        import os
+        import numpy as np
         import pandas as pd
-        import os        
-        engine = create_engine(self.engineStr)
-                
-        # get the df
-        df_change_type = pd.read_sql_query(query, con = engine)
-        df_change_type.date = df_change_type.date.astype('str')
         
-        # get changes dict
-        dates = sorted(list(set(df_change_type.date.tolist())), 
-                       reverse = True)[0:num_date]
-        device_type = list(set(df_change_type.deviceType.tolist()))
-        changes = {}
-        for dt in device_type:
-            changes[dt] = []
-        for dt in device_type:
-            for d in dates:
-                subset = df_change_type.query('date == @d')
-                try:
-                    changes[dt].append(subset.query('deviceType == @dt').changes.values[0])
-                except IndexError:
-                    changes[dt].append(0)
-        changes['dates'] = dates
+        self.update_date(date)
+        if chunksize is None:
+            with self.tracer.span('parse', file = file):
+                df = read_report(file, schema = self.schema)
+                self.tracer.annotate(rows = len(df), bytes = os.path.getsize(file))
+            self.update_location(date, df)
+            self.update_equipment(date, df)
+            self.update_fact(date, df)
+            return len(df)
         
-        # create stacked bar plot
-        output_file(f"{os.getcwd().replace('/private', '')}/static/plots/change_by_type.html")
-        source = ColumnDataSource(changes)
-        stack = figure(y_range = dates, 
-                       plot_height = plot_height, 
-                       plot_width = plot_width,
-                       title = title,
-                       tools = 'ypan,box_zoom,wheel_zoom,reset,save,undo',
-                       toolbar_location = 'right', 
-                       tooltips="$name: @$name"
-                       )
+        # first pass, distinct locations, present devices and new or changed rows only
+        current_ids = self.equipment.current['equipment_id']
+        present = np.zeros(len(current_ids), dtype = bool)
+        locations, candidates = None, []
+        rows = 0
+        for chunk in read_report(file, chunksize = chunksize, schema = self.schema):
+            rows += len(chunk)
+            locations = (pd.concat([locations, chunk.loc[:, ['location', 'bldg']]])
+                           .drop_duplicates(ignore_index = True))
+            equipment = self.__equipment_rows(chunk)
+            present |= current_ids.isin(equipment['equipment_id']).values
+            candidates.append(self.schema.apply(equipment[self.__maybe_changed(equipment)]))
+        self.update_location(date, self.schema.apply(locations))
+        self.__apply_equipment(date, self.schema.apply(pd.concat(candidates)), present)
+        
+        # second pass, facts
+        for chunk in read_report(file, chunksize = chunksize, schema = self.schema):
+            self.__deployed_facts(date, chunk)
+        self.__retired_facts(date)
+        self.aggregates.refresh(date)
+        return rows
+
+
+def shape_series(df: "long query result",
+                 index: "column that becomes the rows, e.g. date",
+                 values: "column, or list of columns, with the numbers",
+                 columns: "column spread into one series per value, None keeps values as they are" = None,
+                 index_values: "rows to return in this order, None returns every index value sorted" = None,
+                 aggfunc: "how duplicate cells are combined" = 'sum',
+                 fill_value: "value for missing cells" = 0):
+    """
+    Shape a long query result into one row per index value in a single pass.
+    
+    Cells with no data get fill_value, so every series has the same length as index_values.
+    """
+    if columns is None:
+        wide = df.groupby(index, sort = True)[values].agg(aggfunc)
+    else:
+        wide = (df.groupby([index, columns], sort = True)[values].agg(aggfunc)
+                  .unstack(columns, fill_value = fill_value))
+    if index_values is not None:
+        wide = wide.reindex(index_values, fill_value = fill_value)
+    return wide
+
+
+BUCKETS = {'day': 'D', 'week': 'W', 'month': 'M'}
+
+
+def bucket_series(df: "one row per date, e.g. from shape_series(...).reset_index()",
+                  x: "date column",
+                  values: "list of value columns",
+                  max_points: "most rows to return",
+                  aggfunc: "how the dates of a bucket are combined, e.g. 'sum' for changes, 'last' for levels" = 'sum'):
+    """
+    Aggregate df by day, week or month, the finest whose buckets over the date 
+    range of df fit in max_points; months are used when nothing fits.
+    
+    x comes back as the first date of each bucket, YYYY-MM-DD, or YYYY-MM for months. 
+    Returns (frame, bucket name).
+    """
+    import pandas as pd
+    dates = pd.to_datetime(df[x])
+    for bucket, freq in BUCKETS.items():
+        if len(pd.period_range(dates.min(), dates.max(), freq = freq)) <= max_points:
+            break
+    periods = dates.dt.to_period(freq)
+    out = df.loc[:, values].groupby(periods.values, sort = True).agg(aggfunc)
+    fmt = '%Y-%m' if bucket == 'month' else '%Y-%m-%d'
+    out.insert(0, x, [p.start_time.strftime(fmt) for p in out.index])
+    return out.reset_index(drop = True), bucket
+
+
+def lttb(x: "numeric x values, sorted",
+         y: "y values",
+         max_points: "points to keep, at least 3"):
+    """
+    Largest-Triangle-Three-Buckets: indices of max_points points of (x, y) that keep 
+    the visual shape of the line, first and last point included.
+    """
+    import numpy as np
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    # inner points split into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    keep = np.empty(max_points, dtype = int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket, the last point for the last bucket
+        if i < max_points - 3:
+            following = slice(edges[i + 1], edges[i + 2])
+            cx, cy = x[following].mean(), y[following].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        keep[i + 1] = a
+    return keep
+
+
+def _plot_source(data: "dict of columns",
+                 data_url: "url of the json payload, None embeds data"):
+    """ColumnDataSource with data, or an AjaxDataSource that fetches data_url once on page load"""
+    from bokeh.models import AjaxDataSource, ColumnDataSource
+    if data_url is None:
+        return ColumnDataSource(data)
+    return AjaxDataSource(data_url = data_url, method = 'GET', polling_interval = None, 
+                          mode = 'replace', data = {k: [] for k in data})
+
+
+def _json_columns(data: "dict of columns"):
+    """data with NaN values as None, so the payload is valid json (null) for the page"""
+    import math
+    return {k: [None if isinstance(v, float) and math.isnan(v) else v for v in column] 
+            for k, column in data.items()}
+
+
+def _follow_factors(plot_range, source, column):
+    """keep the factors of a categorical range equal to a column of an ajax source"""
+    from bokeh.models import CustomJS
+    source.js_on_change('data', CustomJS(args = dict(r = plot_range, s = source), 
+                                         code = f"r.factors = s.data['{column}'].map(String);"))
+
+
+def stacked_bar_figure(data: "dict with dates plus one list of changes per device type",
+                       title: "String of plot title",
+                       plot_width = 900,
+                       plot_height = 1600,
+                       data_url: "json payload url, None embeds data" = None):
+    """stacked bar chart for change by type & date"""
+    from bokeh.palettes import viridis, d3
+    from bokeh.plotting import figure
+    from bokeh.layouts import gridplot
+    
+    device_type = [k for k in data if k != 'dates']
+    source = _plot_source(data, data_url)
+    stack = figure(y_range = list(data['dates']), 
+                   plot_height = plot_height, 
+                   plot_width = plot_width,
+                   title = title,
+                   tools = 'ypan,box_zoom,wheel_zoom,reset,save,undo',
+                   toolbar_location = 'right', 
+                   tooltips="$name: @$name"
+                   )
+    # Category20c starts at 3 colors, a first day may have fewer device types or none
+    n = len(device_type)
+    if n:
         stack.hbar_stack(device_type, y='dates', 
                         height=0.9, 
                         line_color="white",
-                        color= (lambda x: x <= 20 and d3['Category20c'][x] or viridis(x))(len(device_type)),
+                        color= d3['Category20c'][max(3, n)][:n] if n <= 20 else viridis(n),
                         source=source, 
                         legend_label=[f"{x}" for x in device_type]
                         )
+    if data_url is not None:
+        _follow_factors(stack.y_range, source, 'dates')
 
-        stack.y_range.range_padding = 0.1
-        stack.ygrid.grid_line_color = None
-        stack.legend.location = "top_right"
-        stack.axis.minor_tick_line_color = None
-        stack.outline_line_color = None
-        stack.title.text_font_size = '25px'
-        stack.outline_line_color = None
+    stack.y_range.range_padding = 0.1
+    stack.ygrid.grid_line_color = None
+    stack.axis.minor_tick_line_color = None
+    stack.outline_line_color = None
+    stack.title.text_font_size = '25px'
+    stack.outline_line_color = None
 
+    if n:
+        stack.legend.location = "top_right"
         new_legend = stack.legend[0]
         stack.add_layout(new_legend, 'right')
-        grid = gridplot([[stack]], 
+    return gridplot([[stack]], 
+                    toolbar_location='right', 
+                    merge_tools=True,
+                    toolbar_options=dict(logo=None),
+                    sizing_mode='stretch_both')
+
+
+def bar_figure(data: "dict of columns x and y",
+               title: "String of plot title",
+               x: "string, colomn name for x values",
+               y: "string, column name for y values",
+               plot_width = 800, 
+               plot_height = 600,
+               data_url: "json payload url, None embeds data" = None,
+               labels: "draw the value above every bar" = True):
+    """bar chart of change by date or deployed by date"""
+    from bokeh.models import LabelSet
+    from bokeh.plotting import figure
+    from bokeh.layouts import gridplot
+    
+    source = _plot_source(data, data_url)
+    deployed_by_date = figure(plot_width = plot_width, 
+                              plot_height = plot_height, 
+                              x_range = list(data[x]), 
+                              tools = "xpan,box_zoom,wheel_zoom,reset,undo,save", 
+                              title = title, 
+                              tooltips = [("# Device", f"@{y}"), 
+                                          ("Date", f"@{x}")])
+
+    deployed_by_date.vbar(x = x, 
+                          top = y, 
+                          width = 0.5, 
+                          source = source, 
+                          color = (lambda x: '#fd8d3c' if y == 'changes' else '#6baed6')(y)
+                          )
+    if data_url is not None:
+        _follow_factors(deployed_by_date.x_range, source, x)
+
+    deployed_by_date.y_range.start = 0
+    deployed_by_date.yaxis.axis_label = "Number of Devices"
+
+    deployed_by_date.x_range.range_padding = 0.05
+    deployed_by_date.xgrid.grid_line_color = None
+    deployed_by_date.xaxis.axis_label = "Date"
+    deployed_by_date.xaxis.major_label_orientation = 1.57
+
+    deployed_by_date.outline_line_color = None
+    deployed_by_date.title.text_font_size = '25px'
+
+    label = LabelSet(x = x,
+                    y = y, 
+                    text = y,
+                    level = 'glyph',
+                    x_offset = (lambda x: -9 if y == 'changes' else -12)(y), 
+                    y_offset = 0,
+                    text_font_size = (lambda x: '9px' if y == 'changes' else '7px')(y),
+                    source = source,
+                    render_mode = 'canvas'
+                    )
+    if labels:
+        deployed_by_date.add_layout(label)
+
+    return gridplot([[deployed_by_date]], 
+                    toolbar_location = 'right', 
+                    merge_tools = True,
+                    toolbar_options = dict(logo=None),
+                    sizing_mode = 'stretch_both')
+
+
+def line_figure(data: "dict of columns x (epoch milliseconds), y and label",
+                title: "String of plot title",
+                x: "string, colomn name for x values",
+                y: "string, column name for y values",
+                name: "string, axis and tooltip name, e.g. difference",
+                plot_width = 800, 
+                plot_height = 600,
+                data_url: "json payload url, None embeds data" = None,
+                labels: "draw the percent next to every point" = True):
+    """difference or confidence line plot"""
+    from bokeh.models import LabelSet, NumeralTickFormatter
+    from bokeh.plotting import figure
+    from bokeh.layouts import gridplot
+    from bokeh.models.tools import HoverTool
+    
+    conf_diff = figure(plot_width = plot_width, 
+                  plot_height = plot_height, 
+                  title = title, 
+                  x_axis_type = "datetime",
+                  tools="pan,box_zoom,wheel_zoom,undo,reset,save")
+    
+    source = _plot_source(data, data_url)
+    color = '#756bb1' if y == 'diff' else '#31a354'
+    
+    conf_diff.circle(x, 
+                     y, 
+                     source=source,
+                     size=10, 
+                     alpha=0.8,
+                     color=color
+                     )
+    conf_diff.line(x, 
+                   y,
+                   source=source, 
+                   line_width=2, 
+                   line_alpha = 0.3,
+                   color=color
+                   )
+    conf_diff.add_tools(HoverTool(tooltips=[("Date", f"@{x}{{%F}}"), 
+                                    (f"Inventory {name.capitalize()}", "@label")],
+                            formatters={f'@{x}': 'datetime'}
+                            ))
+
+    conf_diff.yaxis.axis_label = name.capitalize()
+    conf_diff.xaxis.axis_label = "Date"
+
+    conf_diff.yaxis.formatter = NumeralTickFormatter(format='%0.0f %%')
+
+    conf_diff.outline_line_color = None
+    conf_diff.title.text_font_size = '25px'
+
+    label = LabelSet(x = x, 
+                     y = y, 
+                     text = 'label',
+                     x_offset = -10, 
+                     y_offset = 5,
+                     text_font_size = '10px',
+                     source = source,
+                     render_mode = 'canvas'
+                     )
+    if labels:
+        conf_diff.add_layout(label)
+
+    return gridplot([[conf_diff]], 
                     toolbar_location='right', 
                     merge_tools=True,
                     toolbar_options=dict(logo=None),
                     sizing_mode='stretch_both')
+
+
+PLOT_FIGURES = {'stacked_bar': stacked_bar_figure, 'bar': bar_figure, 'line': line_figure}
+
+
+def render_plot(kind: "key of PLOT_FIGURES",
+                data: "dict of columns for the figure",
+                options: "keyword arguments of the figure function",
+                path: "html file to write",
+                data_url: "json payload url, None embeds data" = None):
+    """build one figure and save it as a standalone html file; module level so a process pool can run it"""
+    import os
+    from bokeh.io import save
+    from bokeh.resources import CDN
+    
+    part = f'{path}.{os.getpid()}.part'
+    save(PLOT_FIGURES[kind](data, data_url = data_url, **options), 
+         filename = part, resources = CDN, title = options.get('title', kind))
+    os.replace(part, path)
+    return path
+
+
+class QueryCache:
+    """
+    LRU cache of query results for CreateDash.
+    
+    Entries are keyed by the normalized sql, its parameters and the load watermark, 
+    so a new load makes every older entry unreachable. Memory is bounded by entry 
+    count and bytes; with disk_dir, results are also kept as parquet files.
+    """
+    def __init__(self, 
+                 max_entries: "results kept in memory" = 64,
+                 max_bytes: "memory budget for cached results" = 256 * 1024 ** 2,
+                 disk_dir: "directory for the parquet tier, None for memory only" = None):
+        import os
+        import threading
+        from collections import OrderedDict
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.__watermark = None
+        self.__lock = threading.Lock()
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok = True)
+
+    @staticmethod
+    def key(query: "sql text",
+            params: "query parameters or None",
+            watermark: "load watermark the result belongs to"):
+        """cache key, whitespace and trailing ';' in the sql do not matter"""
+        import hashlib
+        import json
+        sql = ' '.join(query.split()).rstrip(';').strip()
+        payload = json.dumps([sql, params, watermark], sort_keys = True, default = str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get(self, 
+            key: "from QueryCache.key",
+            watermark: "current load watermark"):
+        """cached result for key or None; callers get a copy"""
+        import os
+        import pandas as pd
+        self.__expire(watermark)
+        with self.__lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key].copy()
+        path = self.__path(key)
+        if path is not None and os.path.exists(path):
+            df = pd.read_parquet(path)
+            self.disk_hits += 1
+            self.put(key, df, watermark, to_disk = False)
+            return df.copy()
+        with self.__lock:
+            self.misses += 1
+        return None
+
+    def put(self, 
+            key: "from QueryCache.key",
+            df: "query result",
+            watermark: "current load watermark",
+            to_disk: "also write the parquet tier" = True):
+        """store df, evicting the least recently used results beyond the limits"""
+        import os
+        self.__expire(watermark)
+        size = int(df.memory_usage(index = True, deep = True).sum())
+        with self.__lock:
+            if key in self.entries:
+                self.bytes -= self.__size(self.entries.pop(key))
+            self.entries[key] = df.copy()
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, old = self.entries.popitem(last = False)
+                self.bytes -= self.__size(old)
+        path = self.__path(key)
+        if to_disk and path is not None:
+            try:
+                df.to_parquet(path + '.part')
+                os.replace(path + '.part', path)
+            except ImportError:
+                # no parquet engine installed, keep the memory tier only
+                self.disk_dir = None
+
+    def clear(self):
+        """drop every memory and disk entry"""
+        import os
+        with self.__lock:
+            self.entries.clear()
+            self.bytes = 0
+        if self.disk_dir is not None:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    @property
+    def stats(self):
+        """hit/miss counters and current size"""
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 
+                'entries': len(self.entries), 'bytes': self.bytes}
+
+    def __expire(self, watermark):
+        """a new watermark means new data, older entries can never be hit again"""
+        if watermark != self.__watermark:
+            if self.__watermark is not None:
+                self.clear()
+            self.__watermark = watermark
+
+    def __path(self, key):
+        import os
+        if self.disk_dir is None:
+            return None
+        return os.path.join(self.disk_dir, f'{key}.parquet')
+
+    def __size(self, df):
+        return int(df.memory_usage(index = True, deep = True).sum())
+
+
+class InventorySummary:
+    """
+    Running totals behind the dashboard summary, folded from agg_inventory_daily rows in date order.
+    
+    Appending a date only needs that date's row; matches() tells whether the 
+    totals still agree with the table, e.g. after an older date was reloaded.
+    """
+    def __init__(self):
+        self.count = 0
+        self.deployed = 0
+        self.changes = 0
+        self.first_deployed = None
+        self.last_date = None
+        self.last_deployed = None
+
+    def add(self, 
+            rows: "(date_key, num_deployed, num_changes) rows after last_date, in date order"):
+        """fold rows into the totals"""
+        for date_key, num_deployed, num_changes in rows:
+            if self.count == 0:
+                self.first_deployed = int(num_deployed)
+            self.count += 1
+            self.deployed += int(num_deployed)
+            self.changes += int(num_changes)
+            self.last_date = str(date_key)
+            self.last_deployed = int(num_deployed)
+
+    def matches(self, 
+                count: "COUNT(*) of agg_inventory_daily",
+                deployed: "SUM(num_deployed)",
+                changes: "SUM(num_changes)"):
+        return (self.count == int(count or 0) and self.deployed == int(deployed or 0) 
+                and self.changes == int(changes or 0))
+
+    def metrics(self):
+        """avg_dev, avg_change, conf, diff and total_dev, rounded like the summary table"""
+        from decimal import Decimal, ROUND_HALF_UP
+        cent = Decimal('0.01')
+        avg_dev = float((Decimal(self.deployed) / self.count).quantize(cent, ROUND_HALF_UP))
+        avg_change = float((Decimal(self.changes) / self.count).quantize(cent, ROUND_HALF_UP))
+        # Average Operational Invertory Confidence and Average Inventory Difference
+        inventory_diff = round(avg_change / avg_dev * 100, 2)
+        inventory_conf = 100 - inventory_diff
+        ## Total number of Devices Deployed, formula from excel spreadsheet
+        total_num_device = self.last_deployed - self.first_deployed + 200
+        return {'avg_dev': avg_dev, 'avg_change': avg_change, 
+                'conf': inventory_conf, 'diff': inventory_diff, 
+                'total_dev': total_num_device}
+
+
+class CreateDash:
+    """Creating Bokeh Plots"""
+    # plot queries over the daily aggregates, e.g. dash.stacked_bar(CreateDash.queries['change_by_type'], ...)
+    queries = {
+        'change_by_type': """
+        SELECT date_key as `date`, device_type as deviceType, num_changes as changes
+        FROM agg_inventory_daily_type
+        WHERE num_changes > 0
+        ORDER BY `date`, changes desc
+        ;""",
+        'change_by_date': """
+        SELECT date_key as `date`, num_changes as changes
+        FROM agg_inventory_daily
+        ORDER BY `date`
+        ;""",
+        'deployed_by_date': """
+        SELECT date_key as `date`, num_deployed as deployed
+        FROM agg_inventory_daily
+        ORDER BY `date`
+        ;""",
+        'confidence_difference': """
+        SELECT date_key as `date`, num_changes * 1.0 / num_deployed as diff, 
+        1 - num_changes * 1.0 / num_deployed as conf
+        FROM agg_inventory_daily
+        ORDER BY `date`
+        ;"""
+    }
+    # plots of render_all: figure kind, query (a key of queries or sql text) and figure options; 
+    # bars over more than max_points dates are bucketed by week or month with aggfunc
+    plots = {
+        'change_by_type': {'kind': 'stacked_bar', 'query': 'change_by_type', 'num_date': 52,
+                           'options': {'title': 'Changes by Device Type'}},
+        'change_by_date': {'kind': 'bar', 'query': 'change_by_date', 'aggfunc': 'sum',
+                           'options': {'title': 'Changes by Date', 'x': 'date', 'y': 'changes'}},
+        'deployed': {'kind': 'bar', 'query': 'deployed_by_date', 'aggfunc': 'last',
+                     'options': {'title': 'Deployed Devices by Date', 'x': 'date', 'y': 'deployed'}},
+        'difference': {'kind': 'line', 'query': 'confidence_difference', 
+                       'options': {'title': 'Inventory Difference', 'x': 'date', 'y': 'diff', 'name': 'difference'}},
+        'confidence': {'kind': 'line', 'query': 'confidence_difference', 
+                       'options': {'title': 'Inventory Confidence', 'x': 'date', 'y': 'conf', 'name': 'confidence'}}
+    }
+
+    # most bars or line points sent to a page, and most points that still get a text label
+    max_points = 366
+    label_points = 60
+    # bar columns that are levels, a bucket shows its last date instead of the sum
+    levels = ('deployed',)
+
+    # csv reports for export_csv, bound to :start_date and :end_date
+    reports = {
+        'change_by_type_by_date': """
+        SELECT date_key as `date`, device_type as deviceType, num_changes as changes
+        FROM agg_inventory_daily_type
+        WHERE num_changes > 0
+        AND date_key between :start_date and :end_date
+        ORDER BY `date`, changes desc
+        ;""",
+        'change_by_date': """
+        SELECT date_key as `date`, num_changes as changes
+        FROM agg_inventory_daily
+        WHERE date_key between :start_date and :end_date
+        ORDER BY `date`
+        ;""",
+        'deployed': """
+        SELECT date_key as `date`, num_deployed as deployed
+        FROM agg_inventory_daily
+        WHERE date_key between :start_date and :end_date
+        ORDER BY `date`
+        ;""",
+        'confidence_difference': """
+        SELECT date_key as `date`, num_changes * 1.0 / num_deployed as difference, 
+        1 - num_changes * 1.0 / num_deployed as confidence
+        FROM agg_inventory_daily
+        WHERE date_key between :start_date and :end_date
+        ORDER BY `date`
+        ;"""
+    }
+
+    def __init__(self,
+                 engineStr: "database connection, for sqlalchemy engine",
+                 pool_size: "connections kept open in the pool" = 5,
+                 pool_pre_ping: "test connections before handing them out" = True,
+                 pool_recycle: "seconds before a pooled connection is replaced" = 3600,
+                 cache_entries: "query results kept in memory, 0 disables the cache" = 64,
+                 cache_dir: "directory for the on-disk parquet cache, None for memory only" = None,
+                 tracer: "Tracer recording a span per query and plot, None records nothing" = None):
+        from sqlalchemy import inspect
+
+        self.engineStr = engineStr
+        self.engine = EngineRegistry.acquire(engineStr, 
+                                             pool_size = pool_size, 
+                                             pool_pre_ping = pool_pre_ping, 
+                                             pool_recycle = pool_recycle)
+        try:
+            self.tracer = Tracer() if tracer is None else tracer.attach(self.engine)
+            # the queries read the daily aggregates, filled from the facts if no load created them yet
+            inspector = inspect(self.engine)
+            if inspector.has_table('fact_inventory') or 'fact_inventory' in inspector.get_view_names():
+                DailyAggregates(self.engine, 'fact_inventory').create()
+            self.cache = QueryCache(cache_entries, disk_dir = cache_dir) if cache_entries else None
+            self.summary = InventorySummary()
+        except BaseException:
+            # nothing owns the engine if construction failed
+            self.close()
+            raise
+
+    def watermark(self):
+        """
+        last loaded date_key, totals of the daily aggregates and the last finished load 
+        of the ledger; changes whenever a load changes the facts, also when a reload 
+        moves devices between types or locations and keeps the totals
+        """
+        from sqlalchemy import inspect
+        with self.engine.connect() as connection:
+            row = connection.execute("""
+            SELECT MAX(date_key), COUNT(*), SUM(num_deployed), SUM(num_changes)
+            FROM agg_inventory_daily;""").fetchone()
+            loads = ()
+            if inspect(connection).has_table(LoadLedger.table):
+                loads = connection.execute(f"""
+                SELECT MAX(finished_at), COUNT(*) FROM {LoadLedger.table};""").fetchone()
+        return [str(v) for v in tuple(row) + tuple(loads)]
+
+    @traced('query')
+    def read_sql(self, 
+                 query: "sql text, or a dataFrame already computed (e.g. ReportArchive.frames)",
+                 params: "dict of bound parameters" = None,
+                 watermark: "load watermark, read from the database if None" = None):
+        """run query through the result cache"""
+        import pandas as pd
+        from sqlalchemy import text
+        
+        if isinstance(query, pd.DataFrame):
+            return query.copy()
+        sql = query if params is None else text(query)
+        if self.cache is None:
+            df = pd.read_sql_query(sql, con = self.engine, params = params)
+        else:
+            if watermark is None:
+                watermark = self.watermark()
+            key = QueryCache.key(query, params, watermark)
+            df = self.cache.get(key, watermark)
+            if df is None:
+                df = pd.read_sql_query(sql, con = self.engine, params = params)
+                self.cache.put(key, df, watermark)
+        self.tracer.annotate(rows = len(df))
+        return df
+
+    def close(self):
+        """Release the shared engine."""
+        if self.engine is not None:
+            EngineRegistry.release(self.engineStr)
+            self.engine = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+    
+    @traced('stacked_bar')
+    def stacked_bar(self, 
+                    query: "query to get the data for stacked bar plot, col1=date, col2=deviceType, col3=changes",
+                    title: "String of plot title",
+                    num_date: "number of weeks needed on plot, default 52/1 year" = 52,
+                    plot_width = 900,
+                    plot_height = 1600):
+        """Create the stacked bar chart for change by type & date plot"""
+        from bokeh.io import output_file, save
+        import os
+        
+        data = self.__stacked_data(self.read_sql(query), num_date)
+        output_file(f"{os.getcwd().replace('/private', '')}/static/plots/change_by_type.html")
+        grid = stacked_bar_figure(data, title, plot_width, plot_height)
         save(grid)
         
         return grid
     
+    @traced('bar')
     def bar(self, 
             query: "query to get the data for bar plot",
             title: "String of plot title",
@@ -403,73 +3284,23 @@ class CreateDash:
             bar_label: "string, column name for y values or bar labels",
             file_name: "string, output file name",
             plot_width = 800, 
-            plot_height = 600):
+            plot_height = 600,
+            max_points: "most bars, longer ranges are bucketed by week or month; None for CreateDash.max_points, 0 draws every date" = None,
+            aggfunc: "how the dates of a bucket are combined, None for 'last' on levels (deployed), 'sum' otherwise" = None):
         """Create change by date and deployed by date bar plot"""
-        
-        from bokeh.io import output_file, show, save
-        from bokeh.models import ColumnDataSource, LabelSet
-        from bokeh.plotting import figure
-        from bokeh.layouts import gridplot
-        from sqlalchemy import create_engine
-        import pandas as pd
+        from bokeh.io import output_file, save
         import os
         
-        engine = create_engine(self.engineStr)
-        
-        df_device = pd.read_sql_query(query, con = engine)
-        df_device.date = df_device.date.astype('str')
-        
+        data = self.__bar_data(self.read_sql(query), x, y, 
+                               self.max_points if max_points is None else max_points, aggfunc)
         output_file(f"{os.getcwd().replace('/private', '')}/static/plots/{file_name}.html")
-        
-        deployed_by_date = figure(plot_width = plot_width, 
-                                  plot_height = plot_height, 
-                                  x_range = df_device.date.to_list(), 
-                                  tools = "xpan,box_zoom,wheel_zoom,reset,undo,save", 
-                                  title = title, 
-                                  tooltips = [("# Device", f"@{y}"), 
-                                              ("Date", "@date")])
-
-        deployed_by_date.vbar(x = x, 
-                              top = y, 
-                              width = 0.5, 
-                              source = df_device, 
-                              color = (lambda x: '#fd8d3c' if y == 'changes' else '#6baed6')(y)
-                              )
-
-        deployed_by_date.y_range.start = 0
-        deployed_by_date.yaxis.axis_label = "Number of Devices"
-
-        deployed_by_date.x_range.range_padding = 0.05
-        deployed_by_date.xgrid.grid_line_color = None
-        deployed_by_date.xaxis.axis_label = "Date"
-        deployed_by_date.xaxis.major_label_orientation = 1.57
-
-        deployed_by_date.outline_line_color = None
-        deployed_by_date.title.text_font_size = '25px'
-
-        source = ColumnDataSource(df_device)
-
-        label = LabelSet(x = x,
-                        y = y, 
-                        text = y,
-                        level = 'glyph',
-                        x_offset = (lambda x: -9 if y == 'changes' else -12)(y), 
-                        y_offset = 0,
-                        text_font_size = (lambda x: '9px' if y == 'changes' else '7px')(y),
-                        source = source,
-                        render_mode = 'canvas'
-                        )
-        deployed_by_date.add_layout(label)
-
-        grid = gridplot([[deployed_by_date]], 
-                    toolbar_location = 'right', 
-                    merge_tools = True,
-                    toolbar_options = dict(logo=None),
-                    sizing_mode = 'stretch_both')
+        grid = bar_figure(data, title, x, y, plot_width, plot_height, 
+                          labels = len(data[x]) <= self.label_points)
         save(grid)
         
         return grid
     
+    @traced('line')
     def line(self, 
             query: "query to get the data for difference and confidence",
             title: "String of plot title",
@@ -477,209 +3308,479 @@ class CreateDash:
             y: "string, column name for y values",
             file_name: "string, output file name",
             plot_width = 800, 
-            plot_height = 600):
+            plot_height = 600,
+            max_points: "most points, longer lines are reduced with lttb; None for CreateDash.max_points, 0 draws every date" = None):
         """Create difference and confidence line plot"""
-        from bokeh.io import output_file, show, save
-        from bokeh.models import ColumnDataSource, LabelSet, NumeralTickFormatter
-        from bokeh.plotting import figure
-        from bokeh.layouts import gridplot
-        from bokeh.models.tools import HoverTool
-        from sqlalchemy import create_engine
-        import pandas as pd
+        from bokeh.io import output_file, save
         import os
         
-        engine = create_engine(self.engineStr)
-        
-        df_con_diff = pd.read_sql_query(query, con = engine)
-        df_con_diff['date'] = pd.to_datetime(df_con_diff['date'])
-        # df_con_diff = df_con_diff.iloc[1:, :]
-        df_con_diff["label"] = [str(round(i*100, 2)) + "%" for i in df_con_diff[y].tolist()]
-        
+        data = self.__line_data(self.read_sql(query), x, y, 
+                                self.max_points if max_points is None else max_points)
         output_file(f"{os.getcwd().replace('/private', '')}/static/plots/{file_name}.html")
-        
-        conf_diff = figure(plot_width = plot_width, 
-                      plot_height = plot_height, 
-                      title = title, 
-                      x_axis_type = "datetime",
-                      tools="pan,box_zoom,wheel_zoom,undo,reset,save")
-        
-        source = ColumnDataSource(df_con_diff)
-        
-        conf_diff.circle(x=df_con_diff[x], 
-                         y=df_con_diff[y], 
-                         size=10, 
-                         alpha=0.8,
-                         color= (lambda x: '#756bb1' if y == 'diff' else '#31a354')(y)
-                         )
-        conf_diff.line(x, 
-                       y,
-                       source=source, 
-                       line_width=2, 
-                       line_alpha = 0.3,
-                       color= (lambda x: '#756bb1' if y == 'diff' else '#31a354')(y)
-                       )
-        conf_diff.add_tools(HoverTool(tooltips=[("Date", "@date{%F}"), 
-                                        (f"Inventory {file_name.capitalize()}", "@label")],
-                                formatters={'@date': 'datetime'}
-                                ))
-
-        conf_diff.yaxis.axis_label = file_name.capitalize()
-        conf_diff.xaxis.axis_label = "Date"
-
-        conf_diff.yaxis.formatter = NumeralTickFormatter(format='%0.0f %%')
-
-        conf_diff.outline_line_color = None
-        conf_diff.title.text_font_size = '25px'
-
-        label = LabelSet(x = x, 
-                         y = y, 
-                         text = 'label',
-                         x_offset = -10, 
-                         y_offset = 5,
-                         text_font_size = '10px',
-                         source = source,
-                         render_mode = 'canvas'
-                         )
-        conf_diff.add_layout(label)
-
-        grid = gridplot([[conf_diff]], 
-                        toolbar_location='right', 
-                        merge_tools=True,
-                        toolbar_options=dict(logo=None),
-                        sizing_mode='stretch_both')
+        grid = line_figure(data, title, x, y, file_name, plot_width, plot_height, 
+                           labels = len(data[x]) <= self.label_points)
         save(grid)
         
         return grid
-    
-    def update_summary(self):
-        """Prepare data for the summary table."""
-        import os
+
+    @staticmethod
+    def __stacked_data(df_change_type, num_date):
+        """changes dict, one series per device type over the latest num_date dates, plus dates"""
+        df_change_type.date = df_change_type.date.astype('str')
+        dates = sorted(df_change_type.date.unique().tolist(), 
+                       reverse = True)[0:num_date]
+        wide = shape_series(df_change_type, 'date', 'changes', 
+                            columns = 'deviceType', 
+                            index_values = dates)
+        changes = {dt: wide[dt].tolist() for dt in wide.columns}
+        changes['dates'] = dates
+        return changes
+
+    @staticmethod
+    def __bar_data(df_device, x, y, max_points = None, aggfunc = None):
+        """one bar per date, or per week or month when there are more than max_points dates"""
+        df_device[x] = df_device[x].astype('str')
+        df_device = shape_series(df_device, x, [y]).reset_index()
+        if aggfunc is None:
+            aggfunc = 'last' if y in CreateDash.levels else 'sum'
+        if max_points and len(df_device) > max_points:
+            df_device, _ = bucket_series(df_device, x, [y], max_points, aggfunc)
+        return {x: df_device[x].tolist(), y: df_device[y].tolist()}
+
+    @staticmethod
+    def __line_data(df_con_diff, x, y, max_points = None):
+        """x as epoch milliseconds, the way bokeh sends datetimes, plus a percent label; at most max_points by lttb"""
         import pandas as pd
-        from sqlalchemy import create_engine
+        df_con_diff[x] = pd.to_datetime(df_con_diff[x])
+        df_con_diff = shape_series(df_con_diff, x, [y], aggfunc = 'mean').reset_index()
+        if max_points and len(df_con_diff) > max_points:
+            df_con_diff = df_con_diff.iloc[lttb(df_con_diff[x].astype('int64'), df_con_diff[y], max_points)]
+        return {x: (df_con_diff[x].astype('int64') // 10**6).astype(float).tolist(), 
+                y: df_con_diff[y].tolist(),
+                'label': [str(round(i*100, 2)) + "%" for i in df_con_diff[y].tolist()]}
+
+    @traced('render_all')
+    def render_all(self, 
+                   plots: "dict of plot name to spec, CreateDash.plots if None" = None,
+                   max_workers: "queries and renders run at the same time" = 4,
+                   executor: "'process' or 'thread' pool for the renders" = 'process',
+                   data_url: "url of the payload directory, relative to the html pages" = 'data/'):
+        """
+        Render every plot as a cached html template plus a json data payload.
         
-        engine = create_engine(self.engineStr)
-        dir = os.getcwd().replace('private', '')
+        The plot queries run together in a thread pool. The data of each plot is written to 
+        static/plots/data/<name>.json, in ColumnDataSource form, and the page fetches it 
+        with an AjaxDataSource on load. A template is only rendered (in the pool) when its 
+        spec hash changes: kind, options, stacked device types or bokeh version, so a daily 
+        refresh rewrites the small json files only.
+        
+        Bars over more than max_points dates are bucketed by week or month (bucket_series) 
+        and lines reduced to max_points (lttb), so a page stays the same size however 
+        much history there is; above label_points the value labels are left out.
+        
+        A plot whose data or template fails is reported and skipped, its previous 
+        payload and template stay as they were.
+        
+        Returns {name: {'data': path, 'template': path, 'rendered': bool}}, plus 'error' for the failed plots.
+        """
+        import os
+        import json
+        import hashlib
+        import bokeh
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        
+        plots = self.plots if plots is None else plots
+        out = f"{os.getcwd().replace('/private', '')}/static/plots"
+        os.makedirs(f'{out}/data', exist_ok = True)
+        watermark = self.watermark() if self.cache is not None else None
+        queries = sorted({spec['query'] for spec in plots.values()})
 
-        # Average number of deployed of Device by date
-        query = '''
-        SELECT `date`, ROUND(AVG(num_device), 2) as avg_num_device
-        FROM (
-                SELECT date_key as `date`, SUM(is_deployed) as num_device
-                FROM fact_inventory fi 
-                group by date_key
-        ) as temp
-        ;
-        '''
-        df_num_device = pd.read_sql_query(query, con = engine)
-        
-        # Average number of Changes by date
-        query = '''
-        SELECT `date`, ROUND(AVG(num_changes), 2) as avg_num_changes
-        FROM (
-                SELECT date_key as `date`, SUM(has_changed) as num_changes
-                FROM fact_inventory fi 
-                group by date_key
-        ) as temp
-        ;
-        '''
-        df_num_changes = pd.read_sql_query(query, con = engine)
+        def run(query):
+            # a failed query fails its plots only
+            try:
+                return self.read_sql(self.queries.get(query, query), watermark = watermark)
+            except Exception as e:
+                return e
 
-        # Average Operational Invertory Confidence and Average Inventory Difference
-        inventory_diff = round(df_num_changes.iloc[0, 1] / df_num_device.iloc[0, 1] * 100, 2)
-        inventory_conf = 100 - inventory_diff
+        with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(queries)))) as pool:
+            results = dict(zip(queries, pool.map(run, queries)))
 
-        ## Total number of Devices Deployed, formula from excel spreadsheet
-        query = '''
-        SELECT date_key as `Date`, SUM(is_deployed) as num_deployed
-        FROM fact_inventory fi 
-        group by date_key 
-        ;
-        '''
-        df_deployed = pd.read_sql_query(query, con = engine)
-        total_num_device = df_deployed.iloc[df_deployed.shape[0] - 1, 1] - df_deployed.iloc[0, 1] + 200
+        manifest_path = f'{out}/data/templates.json'
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        shapes = {'stacked_bar': lambda df, spec: self.__stacked_data(df, spec.get('num_date', 52)),
+                  'bar': lambda df, spec: self.__bar_data(df, spec['options']['x'], spec['options']['y'], 
+                                                          spec.get('max_points', self.max_points), 
+                                                          spec.get('aggfunc')),
+                  'line': lambda df, spec: self.__line_data(df, spec['options']['x'], spec['options']['y'], 
+                                                            spec.get('max_points', self.max_points))}
+        rendered, todo = {}, []
+
+        def write_payload(path, data):
+            with open(f'{path}.part', 'w') as f:
+                json.dump(_json_columns(data), f, allow_nan = False)
+            os.replace(f'{path}.part', path)
+
+        def failed(name, e):
+            # one broken plot leaves its old files and does not stop the others
+            print(f"plot {name} not rendered, its previous files are kept: {e!r}")
+            rendered[name]['error'] = repr(e)
+
+        for name, spec in plots.items():
+            payload, template = f'{out}/data/{name}.json', f'{out}/{name}.html'
+            rendered[name] = {'data': payload, 'template': template, 'rendered': False}
+            try:
+                if isinstance(results[spec['query']], Exception):
+                    raise results[spec['query']]
+                data = shapes[spec['kind']](results[spec['query']].copy(), spec)
+                options = spec['options']
+                if spec['kind'] != 'stacked_bar':
+                    # labels only while they stay readable, the template changes with this flag
+                    options = dict(options, labels = len(data[options['x']]) <= spec.get('label_points', self.label_points))
+                stack = [k for k in data if k != 'dates'] if spec['kind'] == 'stacked_bar' else None
+                spec_hash = hashlib.sha1(json.dumps([spec['kind'], options, stack, 
+                                                     data_url, bokeh.__version__], 
+                                                    sort_keys = True).encode()).hexdigest()
+            except Exception as e:
+                failed(name, e)
+                continue
+            # the standalone plot methods write the same file names, so the mtime is checked too
+            if (not os.path.exists(template) or 
+                manifest.get(name) != [spec_hash, os.stat(template).st_mtime_ns]):
+                # the payload is written with its new template, the old one may not read it
+                todo.append((name, spec_hash, data, (spec['kind'], data, options, template, 
+                                                     f'{data_url}{name}.json')))
+            else:
+                write_payload(payload, data)
+
+        if todo:
+            Pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+            with Pool(max_workers = max(1, min(max_workers, len(todo)))) as pool:
+                futures = [(name, spec_hash, data, pool.submit(render_plot, *args)) 
+                           for name, spec_hash, data, args in todo]
+                with self.tracer.span('render', plots = [name for name, _, _, _ in todo]):
+                    for name, spec_hash, data, future in futures:
+                        try:
+                            manifest[name] = [spec_hash, os.stat(future.result()).st_mtime_ns]
+                        except Exception as e:
+                            failed(name, e)
+                            continue
+                        write_payload(rendered[name]['data'], data)
+                        rendered[name]['rendered'] = True
+            with open(f'{manifest_path}.part', 'w') as f:
+                json.dump(manifest, f, indent = 1)
+            os.replace(f'{manifest_path}.part', manifest_path)
+        return rendered
+    
+    @traced('update_summary')
+    def update_summary(self):
+        """
+        Prepare data for the summary table.
+        
+        The metrics come from one pass over agg_inventory_daily; later calls only 
+        fold in the dates appended since, and start over if older dates changed.
+        """
+        import os
+        from sqlalchemy import text
+        
+        dir = os.getcwd().replace('private', '')
+        summary = self.summary
+        with self.engine.connect() as connection:
+            count, deployed, changes = connection.execute("""
+            SELECT COUNT(*), SUM(num_deployed), SUM(num_changes)
+            FROM agg_inventory_daily
+            ;""").fetchone()
+            if summary.last_date is not None:
+                summary.add(connection.execute(text("""
+                SELECT date_key, num_deployed, num_changes
+                FROM agg_inventory_daily
+                WHERE date_key > :last_date
+                ORDER BY date_key
+                ;"""), {'last_date': summary.last_date}))
+            if not summary.matches(count, deployed, changes):
+                summary = self.summary = InventorySummary()
+                summary.add(connection.execute("""
+                SELECT date_key, num_deployed, num_changes
+                FROM agg_inventory_daily
+                ORDER BY date_key
+                ;"""))
+        if summary.count == 0:
+            return
+        metrics = summary.metrics()
 
         json_out = f'''var summary = [{{
-            'avg_dev': {df_num_device.iloc[0, 1]}, 
-            'avg_change': {df_num_changes.iloc[0, 1]}, 
-            'conf': "{inventory_conf}%", 
-            'diff': "{inventory_diff}%", 
-            'total_dev': {total_num_device}
+            'avg_dev': {metrics['avg_dev']}, 
+            'avg_change': {metrics['avg_change']}, 
+            'conf': "{metrics['conf']}%", 
+            'diff': "{metrics['diff']}%", 
+            'total_dev': {metrics['total_dev']}
         }}]
         '''
 
-        with open(f'{dir}/static/text/summary.js', 'w') as summary:
-            summary.write(json_out)
+        with open(f'{dir}/static/text/summary.js', 'w') as summary_file:
+            summary_file.write(json_out)
+
+    @traced('refresh')
+    def refresh(self, 
+                dates: "date_keys loaded or reloaded since the last refresh",
+                plots: "dict of plot name to spec, CreateDash.plots if None" = None,
+                **render: "keyword arguments of render_all"):
+        """
+        Render the plots whose data covers dates, then the summary; returns render_all's result.
+        
+        The bar and line plots show every date. The stacked bar only shows its 
+        latest num_date dates, so a reloaded older date leaves it alone.
+        """
+        from sqlalchemy import text
+        
+        plots = self.plots if plots is None else plots
+        dates = sorted(str(d) for d in dates)
+        if not dates:
+            return {}
+        affected = {}
+        with self.engine.connect() as connection:
+            for name, spec in plots.items():
+                if spec['kind'] == 'stacked_bar':
+                    shown = connection.execute(text("""
+                    SELECT date_key FROM agg_inventory_daily 
+                    ORDER BY date_key DESC LIMIT :n;"""), {'n': spec.get('num_date', 52)}).fetchall()
+                    if shown and dates[-1] < str(shown[-1][0]):
+                        continue
+                affected[name] = spec
+        rendered = self.render_all(affected, **render) if affected else {}
+        self.update_summary()
+        return rendered
     
+    @traced('export_csv')
     def export_csv(self, 
                    start_date: "selected start date",
                    end_date: "selected end date",
-                   click: "nth time the submit button is clicked",
-                   rand: "a 5-digit random number"):
-        """Creat csv files for downloading"""
-        import pandas as pd
-        from sqlalchemy import create_engine
+                   click: "nth time the submit button is clicked, None for no per-click copies" = None,
+                   rand: "a 5-digit random number" = None,
+                   bundle: "also pack the reports into one zip archive" = False,
+                   chunksize: "rows fetched from the cursor per write" = 50000,
+                   max_workers: "report queries run at the same time" = 4):
+        """
+        Creat csv files for downloading.
+        
+        The reports run concurrently and stream from a server side cursor to csv in chunks.
+        Files are named by date range and data watermark, so an identical export already
+        on disk is reused. With click and rand the legacy per-click names are linked to them.
+        Returns {report name: path}, plus 'bundle' for the zip archive.
+        """
         import os
+        import hashlib
+        from concurrent.futures import ThreadPoolExecutor
         
-        engine = create_engine(self.engineStr)
         dir = os.getcwd().replace('private', '/static/csv_reports/')
-        
-        ## change by type by date
-        query = f'''
-        SELECT fi.date_key as `date`, de.device_type as deviceType, SUM(fi.has_changed) as changes
-        FROM fact_inventory fi 
-        join dim_equipment de
-        on fi.equipment_key = de.equipment_key
-        WHERE fi.has_changed = 1
-        AND fi.date_key between '{start_date}' and '{end_date}'
-        GROUP BY fi.date_key, de.device_type
-        ORDER BY `date`, changes desc
-        ;
-        '''
-        df_change_type = pd.read_sql_query(query, con = engine)
-        df_change_type.to_csv(
-            f'{dir}change_by_type_by_date_{click}_{rand}.csv', 
-            index = False    
-        )
+        params = {'start_date': str(start_date), 'end_date': str(end_date)}
+        tag = hashlib.sha1('|'.join(self.watermark()).encode()).hexdigest()[:12]
+        paths = {name: f'{dir}{name}_{start_date}_{end_date}_{tag}.csv' for name in self.reports}
 
-        ## change by date
-        query = f'''
-        SELECT date_key as `date`, SUM(has_changed) as changes
-        FROM fact_inventory fi 
-        WHERE fi.date_key between '{start_date}' and '{end_date}'
-        group by `date` 
-        ;
-        '''
-        df_change = pd.read_sql_query(query, con = engine)
-        df_change.to_csv(
-            f'{dir}change_by_date_{click}_{rand}.csv', 
-            index = False   
-        )
+        with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(paths)))) as pool:
+            futures = [pool.submit(self.__stream_csv, self.reports[name], params, path, chunksize)
+                       for name, path in paths.items()]
+            for future in futures:
+                future.result()
 
-        ## number of deployed by date
-        query = f'''
-        SELECT date_key as `date`, SUM(is_deployed) as deployed
-        FROM fact_inventory fi 
-        WHERE fi.date_key between '{start_date}' and '{end_date}'
-        group by `date` 
-        ;
-        '''
-        df_device = pd.read_sql_query(query, con = engine)
-        df_device.to_csv(
-            f'{dir}deployed_{click}_{rand}.csv', 
-            index = False   
-        )
+        if click is not None and rand is not None:
+            for name, path in paths.items():
+                self.__link(path, f'{dir}{name}_{click}_{rand}.csv')
+        if bundle:
+            paths['bundle'] = self.__bundle(list(paths.values()), f'{dir}reports_{start_date}_{end_date}_{tag}.zip')
+        return paths
 
-        ## confidence & difference
-        query = f'''
-        SELECT date_key as `date`, SUM(has_changed) * 1.0 / SUM(is_deployed) * 1.0 as difference, 
-        1 - SUM(has_changed) * 1.0 / SUM(is_deployed) * 1.0 as confidence
-        FROM fact_inventory fi 
-        WHERE fi.date_key between '{start_date}' and '{end_date}'
-        group by date_key 
-        ;
-        '''
-        df_con_diff = pd.read_sql_query(query, con = engine)
-        df_con_diff.to_csv(
-            f'{dir}confidence_difference_{click}_{rand}.csv', 
-            index = False  
-        )
\ No newline at end of file
+    def __stream_csv(self, query, params, path, chunksize):
+        """write query to path chunk by chunk, skipped if path exists"""
+        import os
+        import csv
+        import threading
+        from sqlalchemy import text
+
+        if os.path.exists(path):
+            return path
+        part = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results = True).execute(text(query), params)
+            with open(part, 'w', newline = '') as f:
+                writer = csv.writer(f)
+                writer.writerow(result.keys())
+                while True:
+                    rows = result.fetchmany(chunksize)
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+        os.replace(part, path)
+        return path
+
+    @staticmethod
+    def __link(src, dst):
+        """hard link dst to src, copy where links are not supported"""
+        import os
+        import shutil
+
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    @staticmethod
+    def __bundle(files, path):
+        """zip files into path, skipped if path exists"""
+        import os
+        import zipfile
+
+        if not os.path.exists(path):
+            part = f'{path}.{os.getpid()}.part'
+            with zipfile.ZipFile(part, 'w', compression = zipfile.ZIP_DEFLATED) as z:
+                for file in files:
+                    z.write(file, arcname = os.path.basename(file))
+            os.replace(part, path)
+        return path
+
+
+class RefreshDaemon:
+    """
+    Polls a ReportStore and keeps the warehouse and the dashboard up to date.
+    
+    New or changed asset-report-YYYY-MM-DD files are collected until none has 
+    arrived for debounce seconds, then one job downloads them, loads them with 
+    DataPrep.updatedb_sql (the load ledger skips what is already loaded) and 
+    refreshes the dashboard for the dates it loaded with CreateDash.refresh. 
+    Jobs are single-flight: reports arriving during a job wait for the next one. 
+    The blocking download, database and pandas work runs in a one-thread executor, 
+    so the event loop keeps polling, and prep and dash are only used by that thread.
+    A failed job is retried with the next poll. Dates loaded by a job whose refresh 
+    failed, or that failed after loading some dates, wait in pending_refresh: the 
+    retry's load skips them, the next refresh includes them.
+    """
+    pattern = r'asset-report-(\d{4}-\d{2}-\d{2})\.csv$'
+
+    def __init__(self, 
+                 prep: "DataPrep of the warehouse",
+                 dash: "CreateDash of the same warehouse",
+                 store: "ReportStore to poll, e.g. BoxReportStore or LocalReportStore",
+                 raw_dir: "directory the reports are downloaded to",
+                 interval: "seconds between polls" = 60,
+                 debounce: "seconds without new reports before a job starts" = 30,
+                 loader: "loader of updatedb_sql, 'procedures' or 'setbased'" = 'procedures',
+                 render: "keyword arguments of render_all, e.g. {'executor': 'thread'}" = None):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self.prep = prep
+        self.dash = dash
+        self.store = store
+        self.downloader = ReportDownloader(store, raw_dir)
+        self.raw_dir = raw_dir
+        self.interval = interval
+        self.debounce = debounce
+        self.loader = loader
+        self.render = render or {}
+        self.seen = {}
+        self.changed = {}
+        self.last_change = None
+        self.pending_refresh = set()
+        self.job = None
+        self.runs = []
+        self.__lock = asyncio.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'refresh')
+
+    async def poll(self):
+        """list the store once, returns the names of new or changed reports"""
+        import re
+        import time
+        import asyncio
+        reports = await asyncio.get_running_loop().run_in_executor(None, self.store.list_reports)
+        arrived = []
+        for report in reports:
+            if re.search(self.pattern, report['name']) is None:
+                continue
+            signature = (report['size'], report['etag'], report['sha1'])
+            if self.seen.get(report['name']) != signature and self.changed.get(report['name']) != signature:
+                self.changed[report['name']] = signature
+                arrived.append(report['name'])
+        if arrived:
+            self.last_change = time.monotonic()
+        return arrived
+
+    def due(self):
+        """True when reports or refreshes are waiting, none arrived for debounce seconds and no job runs"""
+        import time
+        return ((bool(self.changed) or bool(self.pending_refresh)) and not self.__lock.locked() and 
+                time.monotonic() - self.last_change >= self.debounce)
+
+    async def run(self):
+        """one job over the reports collected so far, skipped if a job is running; returns its summary"""
+        import re
+        import time
+        import asyncio
+        if self.__lock.locked():
+            return None
+        async with self.__lock:
+            batch = dict(self.changed)
+            dates = sorted({re.search(self.pattern, name).group(1) for name in batch})
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            try:
+                loaded = await loop.run_in_executor(self.__executor, self.__ingest, dates)
+                refreshed = sorted(self.pending_refresh)
+                rendered = await loop.run_in_executor(self.__executor, self.__refresh, refreshed)
+                self.pending_refresh.difference_update(refreshed)
+            except Exception as e:
+                print(f"refresh of {', '.join(dates)} failed, retried after the next poll: {e!r}")
+                self.last_change = time.monotonic()
+                return {'dates': dates, 'error': repr(e)}
+            for name, signature in batch.items():
+                self.seen[name] = signature
+                if self.changed.get(name) == signature:
+                    del self.changed[name]
+            summary = {'dates': dates, 'loaded': loaded, 'refreshed': refreshed, 'rendered': sorted(rendered), 
+                       'seconds': round(time.perf_counter() - start, 3)}
+            self.runs.append(summary)
+            print(f"refreshed {', '.join(refreshed) or 'nothing'} in {summary['seconds']}s")
+            return summary
+
+    async def serve(self, 
+                    stop: "asyncio.Event that ends the loop, None runs until cancelled" = None):
+        """poll every interval and start a job when reports are due, until stop is set"""
+        import asyncio
+        stop = stop or asyncio.Event()
+        try:
+            while not stop.is_set():
+                await self.poll()
+                if self.due():
+                    self.job = asyncio.create_task(self.run())
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout = self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            if self.job is not None:
+                await self.job
+        finally:
+            self.__executor.shutdown(wait = True)
+
+    def __ingest(self, dates):
+        """
+        download and load the reports of dates, returns the dates loaded or reloaded; 
+        every date the ledger finished anew goes to pending_refresh, also when the load fails
+        """
+        before = self.__finished()
+        try:
+            self.downloader.download(dates)
+            status = self.prep.updatedb_sql(self.raw_dir, loader = self.loader)
+        finally:
+            self.pending_refresh.update(date for date, finished in self.__finished().items() 
+                                        if before.get(date) != finished)
+        return [date for date, action in status.items() if action in ('load', 'reload')]
+
+    def __finished(self):
+        """{date_key: finished_at} of the loaded dates of the ledger"""
+        return {date: entry['finished_at'] for date, entry in self.prep.ledger.entries().items() 
+                if entry['status'] == 'loaded' and isinstance(entry['finished_at'], str)}
+
+    def __refresh(self, dates):
+        return self.dash.refresh(dates, **self.render) if dates else {}
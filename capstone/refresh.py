@@ -0,0 +1,72 @@
+"""
+Refresh daemon for the dashboard, run from the private directory like the other steps:
+
+    python refresh.py --engine mysql+pymysql://user:pw@host/db --box-config box.json --folder 123
+    python refresh.py --engine sqlite:///warehouse.db --local-dir /data/reports --loader setbased --interval 10 --debounce 5
+    python refresh.py --engine sqlite:///warehouse.db --migrate-facts
+
+--migrate-facts switches the warehouse to interval facts once and exits, 
+later runs load it with --fact-storage interval --loader setbased.
+
+Polls the reports, loads new ones into the warehouse and refreshes the plots
+and the summary, see dashtoolkit.RefreshDaemon.
+"""
+
+
+def main(argv: "command line arguments, sys.argv[1:] if None" = None):
+    import os
+    import asyncio
+    import argparse
+    import signal
+    from dashtoolkit import (DataPrep, CreateDash, BoxReportStore, LocalReportStore, RefreshDaemon, 
+                             EngineRegistry, IntervalFacts)
+
+    parser = argparse.ArgumentParser(description = 'poll the asset reports and refresh the dashboard')
+    parser.add_argument('--engine', required = True, help = 'warehouse url')
+    source = parser.add_mutually_exclusive_group(required = True)
+    source.add_argument('--box-config', help = 'box config json, with --folder')
+    source.add_argument('--local-dir', help = 'directory with the reports, instead of box')
+    source.add_argument('--migrate-facts', action = 'store_true', 
+                        help = 'move the daily fact_inventory table into intervals and exit')
+    parser.add_argument('--folder', help = 'id of the box folder with the reports')
+    parser.add_argument('--raw-dir', default = f'{os.getcwd()}/raw_csv', help = 'download directory')
+    parser.add_argument('--interval', type = float, default = 60, help = 'seconds between polls')
+    parser.add_argument('--debounce', type = float, default = 30,
+                        help = 'seconds without new reports before loading')
+    parser.add_argument('--loader', default = 'procedures', choices = ['procedures', 'setbased'],
+                        help = "'setbased' for warehouses without the stored procedures, e.g. SQLite")
+    parser.add_argument('--fact-storage', default = 'daily', choices = ['daily', 'interval'])
+    args = parser.parse_args(argv)
+    if args.box_config and not args.folder:
+        parser.error('--box-config needs --folder')
+    if args.migrate_facts:
+        engine = EngineRegistry.acquire(args.engine)
+        try:
+            dates = IntervalFacts(engine).migrate()
+        finally:
+            EngineRegistry.release(args.engine)
+        print(f"fact_inventory moved to intervals, {len(dates)} dates")
+        return
+
+    store = (BoxReportStore(args.box_config, args.folder) if args.box_config
+             else LocalReportStore(args.local_dir))
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        with DataPrep(args.engine, fact_storage = args.fact_storage) as prep, CreateDash(args.engine) as dash:
+            daemon = RefreshDaemon(prep, dash, store, args.raw_dir,
+                                   interval = args.interval, debounce = args.debounce,
+                                   loader = args.loader, render = {'executor': 'thread'})
+            await daemon.serve(stop)
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
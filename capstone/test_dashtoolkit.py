@@ -0,0 +1,448 @@
+"""
+tests of dashtoolkit against small generated reports and SQLite warehouses, run with: python -m pytest capstone
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from dashtoolkit import equipment_ids, read_report
+
+
+def legacy_equipment_ids(df):
+    """the original DataPrep.__get_equipmentid loop, kept as the oracle"""
+    f = lambda x: str(x).replace(' ', '_')
+    device_name = [name.split('.')[0] for name in df.loc[:, 'device_name']]
+    id = []
+    for i in range(len(df)):
+        a = device_name[i]
+        b = df.loc[:, 'serial_number'][i]
+        c = df.loc[:, 'rack_room_number'][i]
+        id.append((lambda x, y, z:x + f(z) if pd.isna(y) else x + f(y))(a, b, c).replace('nan', ''))
+    return id
+
+
+EDGE_CASES = {
+    'nan serial uses the rack': (['sw1'], [np.nan], ['R 101']),
+    'nan serial and rack': (['sw1'], [np.nan], [np.nan]),
+    'dotted device names': (['sw1.net.edu', 'ap.2', '.lead'], ['S1', 'S2', 'S3'], ['R1', 'R2', 'R3']),
+    'spaces': (['core sw'], ['SN 12 A'], ['R 1']),
+    'spaces in the rack': (['sw1'], [None], ['Room 1 Rack 2']),
+    'float serials': (['sw1', 'sw2'], [112345.0, np.nan], ['R1', 'R 2']),
+    'int serials': (['sw1', 'sw2'], [112345, 7], ['R1', 'R2']),
+    'numeric rack': (['sw1', 'sw2'], [np.nan, np.nan], [101.0, np.nan]),
+    'nan inside a name': (['financesw.edu', 'nanosw'], ['SNnan1', np.nan], ['R1', 'Rnan']),
+}
+
+
+@pytest.mark.parametrize('case', list(EDGE_CASES))
+def test_equipment_ids_match_legacy(case):
+    names, serials, racks = EDGE_CASES[case]
+    df = pd.DataFrame({'device_name': names, 'serial_number': serials, 'rack_room_number': racks})
+    assert equipment_ids(df).tolist() == legacy_equipment_ids(df)
+
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_read_report_ids_match_legacy_read(tmp_path, chunksize):
+    """ids of read_report against the oracle over a plain read_csv, as the loads before the fixed schema"""
+    path = tmp_path / 'asset-report-2021-01-01.csv'
+    pd.DataFrame({'location': ['A', 'B', 'A', 'C'], 'bldg': ['B1', 'B2', 'B1', 'B3'],
+                  'device name': ['sw1.net', 'finance.sw', 'ap 3', 'sw4'],
+                  'serial number': [112345, np.nan, 7, 8],
+                  'rack room number': ['R 1', 'R2', np.nan, 'R4'],
+                  'port count': ['24', 'n/a', np.nan, '48']}).to_csv(path, index = False)
+    legacy = pd.read_csv(path)
+    legacy.columns = [c.replace(' ', '_') for c in legacy.columns]
+    df = read_report(path, chunksize = chunksize)
+    if chunksize is not None:
+        df = pd.concat(df, ignore_index = True)
+    assert equipment_ids(df).tolist() == legacy_equipment_ids(legacy)
+    assert df['port_count'].tolist()[::3] == [24.0, 48.0]
+    assert df['port_count'].isna().tolist() == [False, True, True, False]
+
+
+def test_failed_construction_releases_the_engine(tmp_path):
+    from dashtoolkit import DataPrep, EngineRegistry
+    url = f"sqlite:///{tmp_path / 'warehouse.db'}"
+    with pytest.raises(ValueError):
+        DataPrep(url, fact_storage = 'weekly')
+    assert url not in EngineRegistry._engines
+
+
+def test_watermark_changes_on_a_reload_with_the_same_totals(tmp_path):
+    from benchmark import generate_reports, create_warehouse
+    from dashtoolkit import DataPrep, CreateDash
+    files = generate_reports(str(tmp_path / 'raw_csv'), devices = 50, days = 2)
+    url = create_warehouse(str(tmp_path / 'warehouse.db'))
+    with DataPrep(url) as prep, CreateDash(url) as dash:
+        for file in files:
+            prep.ingest_report(file)
+        before = dash.watermark()
+        prep.ingest_report(files[-1], skip_loaded = False)
+        assert dash.watermark() != before
+
+
+def test_render_all_on_a_first_day_warehouse_and_with_a_broken_plot(tmp_path, monkeypatch):
+    from benchmark import generate_reports, create_warehouse
+    from dashtoolkit import DataPrep, CreateDash
+    files = generate_reports(str(tmp_path / 'raw_csv'), devices = 30, days = 1, device_types = 2)
+    url = create_warehouse(str(tmp_path / 'warehouse.db'))
+    (tmp_path / 'private').mkdir()
+    monkeypatch.chdir(tmp_path / 'private')
+    broken = tmp_path / 'static' / 'plots' / 'broken.html'
+    broken.parent.mkdir(parents = True)
+    broken.write_text('previous')
+    plots = dict(CreateDash.plots, broken = {'kind': 'bar', 'query': 'SELECT nothing FROM missing_table', 
+                                             'options': {'title': 'Broken', 'x': 'date', 'y': 'n'}})
+    with DataPrep(url) as prep, CreateDash(url) as dash:
+        prep.ingest_report(files[0])
+        rendered = dash.render_all(plots, executor = 'thread')
+    assert [name for name in rendered if 'error' in rendered[name]] == ['broken']
+    assert all(rendered[name]['rendered'] for name in CreateDash.plots)
+    assert broken.read_text() == 'previous'
+
+
+def test_nested_span_keeps_the_outer_traced_peak():
+    from dashtoolkit import Tracer, MemorySink
+    sink = MemorySink()
+    tracer = Tracer([sink], trace_memory = True)
+    with tracer.span('outer'):
+        big = bytearray(8 * 1024 * 1024)
+        del big
+        with tracer.span('inner'):
+            small = bytearray(1024)
+        del small
+    inner, outer = sink.records
+    assert inner['traced_peak_bytes'] < 1024 * 1024
+    assert outer['traced_peak_bytes'] >= 8 * 1024 * 1024
+    assert outer['rss_growth_kb'] is None or outer['rss_growth_kb'] >= 0
+
+
+def test_bulk_file_escape_covers_categorical_columns():
+    import pandas as pd
+    from dashtoolkit import BulkFileStageLoader
+    chunk = pd.DataFrame({'make': pd.Series(['A\\B', None, 'C'], dtype = 'category'), 
+                          'model': ['X\\Y', 'Z', None], 'port_count': [1.0, None, 3.0]})
+    escaped = BulkFileStageLoader.escape(chunk)
+    assert escaped['make'].tolist()[0] == 'A\\\\B' and pd.isna(escaped['make'][1])
+    assert escaped['model'].tolist()[:2] == ['X\\\\Y', 'Z']
+    assert escaped['port_count'].equals(chunk['port_count'])
+
+
+@pytest.mark.parametrize('read_chunksize', [None, 150])
+def test_set_based_loader_matches_the_pandas_path(tmp_path, read_chunksize):
+    from benchmark import generate_reports, create_warehouse, same_warehouse
+    from dashtoolkit import DataPrep, EngineRegistry
+    files = generate_reports(str(tmp_path / 'raw_csv'), devices = 400, days = 4, churn = 0.05)
+    pandas_url = create_warehouse(str(tmp_path / 'pandas.db'))
+    set_url = create_warehouse(str(tmp_path / 'setbased.db'))
+    with DataPrep(pandas_url) as prep:
+        for file in files:
+            prep.ingest_report(file)
+    with DataPrep(set_url) as prep:
+        prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased', read_chunksize = read_chunksize)
+    EngineRegistry.release(pandas_url)
+    EngineRegistry.release(set_url)
+    assert all(same_warehouse(pandas_url, set_url, ignore = ()).values())
+
+
+def test_interval_storage_matches_daily_with_duplicate_calendar_rows(tmp_path):
+    import pandas as pd
+    from benchmark import generate_reports, create_warehouse
+    from sqlalchemy import create_engine
+    from dashtoolkit import DataPrep, IntervalFacts
+    generate_reports(str(tmp_path / 'raw_csv'), devices = 200, days = 4, churn = 0.05)
+    facts = {}
+    for storage in ['daily', 'interval']:
+        url = create_warehouse(str(tmp_path / f'{storage}.db'))
+        if storage == 'interval':
+            IntervalFacts(create_engine(url)).migrate()
+        with DataPrep(url, fact_storage = storage) as prep:
+            prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+            with prep.engine.begin() as connection:
+                connection.execute("INSERT INTO dim_date_calendar SELECT * FROM dim_date_calendar;")
+            prep.aggregates.rebuild()
+            facts[storage] = pd.read_sql_query("""
+            SELECT date_key, SUM(is_deployed) AS deployed, SUM(has_changed) AS changed 
+            FROM fact_inventory GROUP BY date_key ORDER BY date_key;""", con = prep.engine)
+            facts[f'{storage}_agg'] = pd.read_sql_query(f"SELECT * FROM {prep.aggregates.by_type} ORDER BY 1, 2;", 
+                                                        con = prep.engine)
+    assert facts['daily'].equals(facts['interval'])
+    assert facts['daily_agg'].equals(facts['interval_agg'])
+
+
+def test_migrate_is_explicit_and_keeps_fact_inventory_readable(tmp_path):
+    import pandas as pd
+    from sqlalchemy import create_engine, inspect
+    from benchmark import generate_reports, create_warehouse
+    from dashtoolkit import DataPrep, IntervalFacts, EngineRegistry
+    generate_reports(str(tmp_path / 'raw_csv'), devices = 200, days = 3, churn = 0.05)
+    url = create_warehouse(str(tmp_path / 'warehouse.db'))
+    with DataPrep(url) as prep:
+        prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+    with pytest.raises(ValueError, match = 'migrate'):
+        DataPrep(url, fact_storage = 'interval')
+    EngineRegistry.release(url)
+    
+    engine = create_engine(url)
+    query = """SELECT date_key, SUM(is_deployed) AS deployed, SUM(has_changed) AS changed 
+               FROM fact_inventory GROUP BY date_key ORDER BY date_key;"""
+    daily = pd.read_sql_query(query, con = engine)
+    # a calendar date missing, the intervals would not give back its rows
+    with engine.begin() as connection:
+        connection.execute("DELETE FROM dim_date_calendar WHERE date_key = (SELECT MAX(date_key) FROM dim_date_calendar);")
+    with pytest.raises(ValueError, match = 'nothing was migrated'):
+        IntervalFacts(engine).migrate()
+    assert pd.read_sql_query(query, con = engine).equals(daily)
+    assert not IntervalFacts(engine).migrated()
+    with engine.begin() as connection:
+        connection.execute("INSERT INTO dim_date_calendar (date_key) SELECT MAX(date_key) FROM fact_inventory;")
+    
+    assert len(IntervalFacts(engine).migrate()) == 3
+    assert 'fact_inventory' in inspect(engine).get_view_names()
+    assert inspect(engine).has_table(IntervalFacts.daily)
+    assert pd.read_sql_query(query, con = engine).equals(daily)
+    with pytest.raises(ValueError, match = "fact_storage = 'interval'"):
+        DataPrep(url)
+    EngineRegistry.release(url)
+    with DataPrep(url, fact_storage = 'interval') as prep:
+        assert prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased') == {
+            date: 'skip' for date in daily['date_key']}
+    engine.dispose()
+
+
+def test_refresh_daemon_refreshes_the_dates_of_a_failed_refresh_on_retry(tmp_path, monkeypatch):
+    import asyncio
+    from benchmark import generate_reports, create_warehouse
+    from dashtoolkit import DataPrep, CreateDash, LocalReportStore, RefreshDaemon
+    generate_reports(str(tmp_path / 'reports'), devices = 50, days = 2)
+    url = create_warehouse(str(tmp_path / 'warehouse.db'))
+    refreshes = []
+    
+    def refresh(dates, **render):
+        refreshes.append(list(dates))
+        if len(refreshes) == 1:
+            raise RuntimeError('render failed')
+        return {}
+    
+    async def retry(daemon):
+        await daemon.poll()
+        return [await daemon.run(), await daemon.run()]
+    
+    with DataPrep(url) as prep, CreateDash(url) as dash:
+        monkeypatch.setattr(dash, 'refresh', refresh)
+        daemon = RefreshDaemon(prep, dash, LocalReportStore(str(tmp_path / 'reports')), 
+                               str(tmp_path / 'raw_csv'), debounce = 0, loader = 'setbased')
+        failed, retried = asyncio.run(retry(daemon))
+    dates = ['2021-01-01', '2021-01-02']
+    assert 'error' in failed
+    assert retried['loaded'] == [] and retried['refreshed'] == dates
+    assert refreshes == [dates, dates] and daemon.pending_refresh == set()
+
+
+def load_ledger_warehouse(tmp_path, name, days = 4):
+    from benchmark import generate_reports, create_warehouse
+    files = generate_reports(str(tmp_path / 'raw_csv'), devices = 200, days = days, churn = 0.05)
+    return files, create_warehouse(str(tmp_path / f'{name}.db'))
+
+
+def natural_state(url):
+    """dim_equipment and fact_inventory with equipment_key replaced by equipment_id and effective_date"""
+    import pandas as pd
+    from sqlalchemy import create_engine
+    engine = create_engine(url)
+    equipment = pd.read_sql_query("SELECT * FROM dim_equipment ORDER BY equipment_id, effective_date;", 
+                                  con = engine).drop(columns = 'equipment_key')
+    facts = pd.read_sql_query("""
+    SELECT d.equipment_id, d.effective_date, f.location_key, f.date_key, f.has_changed, f.is_deployed
+    FROM fact_inventory f JOIN dim_equipment d ON f.equipment_key = d.equipment_key
+    ORDER BY 1, 2, 3, 4, 5, 6;""", con = engine)
+    engine.dispose()
+    return equipment, facts
+
+
+def test_load_ledger_skips_unchanged_files_on_a_rerun(tmp_path):
+    from dashtoolkit import DataPrep
+    files, url = load_ledger_warehouse(tmp_path, 'warehouse')
+    with DataPrep(url) as prep:
+        first = prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+        assert set(first.values()) == {'load'}
+        assert set(prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased').values()) == {'skip'}
+        assert prep.ingest_report(files[-1]) == 'skip'
+        assert {date: entry['status'] for date, entry in prep.ledger.entries().items()} == {
+            date: 'loaded' for date in first}
+
+
+def test_load_ledger_reloads_a_changed_latest_file_like_a_fresh_load(tmp_path):
+    import pandas as pd
+    from benchmark import create_warehouse, same_warehouse
+    from dashtoolkit import DataPrep, EngineRegistry
+    files, url = load_ledger_warehouse(tmp_path, 'warehouse')
+    with DataPrep(url) as prep:
+        prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+        latest = pd.read_csv(files[-1], dtype = str)
+        latest.iloc[5:].to_csv(files[-1], index = False)
+        status = prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+    assert list(status.values()) == ['skip'] * (len(files) - 1) + ['reload']
+    fresh = create_warehouse(str(tmp_path / 'fresh.db'))
+    with DataPrep(fresh) as prep:
+        prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+    EngineRegistry.release(url)
+    EngineRegistry.release(fresh)
+    # the reloaded devices get new surrogate keys, autoincrement does not reuse the purged ones
+    same = same_warehouse(url, fresh, ignore = ())
+    assert all(same[t] for t in same if t not in ('dim_equipment', 'fact_inventory'))
+    for reloaded, loaded in zip(natural_state(url), natural_state(fresh)):
+        assert reloaded.equals(loaded)
+
+
+def test_load_ledger_resumes_from_a_failed_date(tmp_path, monkeypatch):
+    from benchmark import create_warehouse, same_warehouse
+    from dashtoolkit import DataPrep, EngineRegistry, SetBasedLoader
+    files, url = load_ledger_warehouse(tmp_path, 'warehouse')
+    load = SetBasedLoader.load
+    
+    def failing(self, date, df, connection = None):
+        if date == '2021-01-03':
+            raise RuntimeError('connection lost')
+        return load(self, date, df, connection)
+    
+    with DataPrep(url) as prep:
+        monkeypatch.setattr(SetBasedLoader, 'load', failing)
+        with pytest.raises(RuntimeError):
+            prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+        assert {date: entry['status'] for date, entry in prep.ledger.entries().items()} == {
+            '2021-01-01': 'loaded', '2021-01-02': 'loaded', '2021-01-03': 'failed'}
+        monkeypatch.setattr(SetBasedLoader, 'load', load)
+        status = prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+    assert list(status.values()) == ['skip', 'skip', 'reload', 'load']
+    fresh = create_warehouse(str(tmp_path / 'fresh.db'))
+    with DataPrep(fresh) as prep:
+        prep.updatedb_sql(str(tmp_path / 'raw_csv'), loader = 'setbased')
+    EngineRegistry.release(url)
+    EngineRegistry.release(fresh)
+    assert all(same_warehouse(url, fresh, ignore = ()).values())
+
+
+def test_dimension_cache_verify_finds_rows_changed_behind_its_back(tmp_path):
+    from benchmark import generate_reports, create_warehouse
+    from dashtoolkit import DataPrep
+    files = generate_reports(str(tmp_path / 'raw_csv'), devices = 100, days = 3, churn = 0.05, modified = 0.05)
+    url = create_warehouse(str(tmp_path / 'warehouse.db'))
+    with DataPrep(url) as prep:
+        for file in files:
+            prep.ingest_report(file)
+        assert prep.equipment.verify() == [] and prep.locations.verify() == []
+        changed, expired = prep.equipment.frame().index[:2]
+        with prep.engine.begin() as connection:
+            connection.execute(f"UPDATE dim_equipment SET location_key = -1 WHERE equipment_key = {changed};")
+            connection.execute(f"UPDATE dim_equipment SET retirement_date = '2021-01-01' WHERE equipment_key = {expired};")
+        assert prep.equipment.verify() == sorted([changed, expired])
+        prep.equipment.reset()
+        assert prep.equipment.verify() == []
+
+
+@pytest.mark.parametrize('threshold', [1000, 10])
+def test_update_by_keys_on_the_in_list_and_the_key_table_paths(threshold):
+    from sqlalchemy import create_engine
+    from dashtoolkit import update_by_keys
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        connection.execute("CREATE TABLE t (k INTEGER PRIMARY KEY, expiration_dt TEXT, note TEXT);")
+        connection.execute("INSERT INTO t VALUES " + ', '.join(f"({k}, '9999-12-31', NULL)" for k in range(100)))
+        keys = list(range(0, 100, 3)) + [3, 6, 1000]
+        updated = update_by_keys(connection, 't', 'k', keys, {'expiration_dt': '2021-01-02', 'note': "it's"}, 
+                                 threshold = threshold, chunksize = 7)
+        rows = connection.execute("SELECT k FROM t WHERE expiration_dt = '2021-01-02' AND note = 'it''s' ORDER BY k;").fetchall()
+        untouched = connection.execute("SELECT COUNT(*) FROM t WHERE expiration_dt = '9999-12-31' AND note IS NULL;").scalar()
+        assert update_by_keys(connection, 't', 'k', [], {'note': 'x'}) == 0
+    assert updated == 34
+    assert [k for (k,) in rows] == list(range(0, 100, 3))
+    assert untouched == 66
+
+
+def test_daily_aggregates_check_finds_stale_dates_until_refreshed(tmp_path):
+    from benchmark import generate_reports, create_warehouse
+    from dashtoolkit import DataPrep
+    files = generate_reports(str(tmp_path / 'raw_csv'), devices = 100, days = 4, churn = 0.05)
+    url = create_warehouse(str(tmp_path / 'warehouse.db'))
+    with DataPrep(url) as prep:
+        for file in files:
+            prep.ingest_report(file)
+        aggregates = prep.aggregates
+        assert aggregates.check() == []
+        with prep.engine.begin() as connection:
+            connection.execute(f"""UPDATE {aggregates.by_type} SET num_deployed = num_deployed + 1 
+                                   WHERE date_key = '2021-01-01' AND device_type = 'type0';""")
+            connection.execute("""INSERT INTO fact_inventory (equipment_key, location_key, date_key, has_changed, is_deployed)
+                                  SELECT equipment_key, location_key, '2021-01-02', 1, 0 FROM dim_equipment LIMIT 1;""")
+            connection.execute(f"DELETE FROM {aggregates.daily} WHERE date_key = '2021-01-04';")
+        assert aggregates.check() == ['2021-01-01', '2021-01-02', '2021-01-04']
+        aggregates.refresh('2021-01-02')
+        assert aggregates.check() == ['2021-01-01', '2021-01-04']
+        aggregates.rebuild()
+        assert aggregates.check() == []
+
+
+def test_report_downloader_skips_unchanged_and_retries_failed_fetches(tmp_path):
+    import os
+    from benchmark import generate_reports
+    from dashtoolkit import ReportDownloader, LocalReportStore
+    files = generate_reports(str(tmp_path / 'box'), devices = 20, days = 3)
+    
+    class FlakyStore(LocalReportStore):
+        failures = {'asset-report-2021-01-02.csv': 1}
+        
+        def fetch(self, report, fileobj):
+            if self.failures.get(report['name']):
+                self.failures[report['name']] -= 1
+                fileobj.write(b'partial')
+                raise IOError('connection reset')
+            super().fetch(report, fileobj)
+    
+    dest = tmp_path / 'raw_csv'
+    downloader = ReportDownloader(FlakyStore(str(tmp_path / 'box')), str(dest), backoff = 0)
+    assert downloader.download(['2021-01-01', '2021-01-02']) == {
+        'asset-report-2021-01-01.csv': 'downloaded', 'asset-report-2021-01-02.csv': 'downloaded'}
+    assert sorted(os.listdir(dest)) == ['.manifest.json', 'asset-report-2021-01-01.csv', 'asset-report-2021-01-02.csv']
+    for file in files[:2]:
+        assert (dest / os.path.basename(file)).read_bytes() == open(file, 'rb').read()
+    
+    with open(files[1], 'a') as f:
+        f.write('\n')
+    # a new downloader reads the manifest back
+    downloader = ReportDownloader(LocalReportStore(str(tmp_path / 'box')), str(dest))
+    assert downloader.download(['2021-01-01', '2021-01-02', '2021-01-03']) == {
+        'asset-report-2021-01-01.csv': 'skipped', 'asset-report-2021-01-02.csv': 'downloaded', 
+        'asset-report-2021-01-03.csv': 'downloaded'}
+    assert (dest / os.path.basename(files[1])).read_bytes() == open(files[1], 'rb').read()
+
+
+def test_bucket_series_picks_the_finest_bucket_that_fits():
+    import pandas as pd
+    from dashtoolkit import bucket_series
+    df = pd.DataFrame({'date_key': pd.date_range('2021-01-01', periods = 400).strftime('%Y-%m-%d'), 
+                       'num_changes': 1, 'num_deployed': range(400)})
+    days, bucket = bucket_series(df.head(10), 'date_key', ['num_changes'], max_points = 20)
+    assert bucket == 'day' and days.equals(df.head(10).loc[:, ['date_key', 'num_changes']])
+    
+    weeks, bucket = bucket_series(df.head(60), 'date_key', ['num_changes'], max_points = 20)
+    assert bucket == 'week' and len(weeks) == 10
+    assert weeks['date_key'].iloc[:2].tolist() == ['2020-12-28', '2021-01-04']
+    assert weeks['num_changes'].sum() == 60 and weeks['num_changes'].iloc[:2].tolist() == [3, 7]
+    
+    months, bucket = bucket_series(df, 'date_key', ['num_deployed'], max_points = 5, aggfunc = 'last')
+    assert bucket == 'month' and len(months) == 14
+    assert months.iloc[0].tolist() == ['2021-01', 30] and months.iloc[-1].tolist() == ['2022-02', 399]
+
+
+def test_lttb_keeps_the_ends_and_the_spikes():
+    import numpy as np
+    from dashtoolkit import lttb
+    assert lttb(range(5), range(5), 10).tolist() == [0, 1, 2, 3, 4]
+    assert lttb(range(5), range(5), 2).tolist() == [0, 1, 2, 3, 4]
+    y = np.zeros(1000)
+    y[[137, 612]] = [50, -80]
+    keep = lttb(np.arange(1000), y, 20)
+    assert len(keep) == 20 and keep[0] == 0 and keep[-1] == 999
+    assert (np.diff(keep) > 0).all()
+    assert {137, 612} <= set(keep.tolist())